@@ -10,6 +10,7 @@ import ckan.model as model
 from ckan.common import OrderedDict, _, c
 
 import ckan.lib.maintain as maintain
+import ckan.lib.permission_cache as permission_cache
 
 log = getLogger(__name__)
 
@@ -252,9 +253,12 @@ def has_user_permission_for_group_or_org(group_id, user_name, permission):
         return True
     # Handle when permissions cascade. Check the user's roles on groups higher
     # in the group hierarchy for permission.
-    for capacity in check_config_permission('roles_that_cascade_to_sub_groups'):
-        parent_groups = group.get_parent_group_hierarchy(type=group.type)
-        group_ids = [group_.id for group_ in parent_groups]
+    roles_that_cascade = \
+        check_config_permission('roles_that_cascade_to_sub_groups')
+    if not roles_that_cascade:
+        return False
+    group_ids = get_group_ancestor_ids(group_id, group.type)
+    for capacity in roles_that_cascade:
         if _has_user_permission_for_groups(user_id, permission, group_ids,
                                            capacity=capacity):
             return True
@@ -270,22 +274,71 @@ def _has_user_permission_for_groups(user_id, permission, group_ids,
     if not group_ids:
         return False
     # get any roles the user has for the group
-    q = model.Session.query(model.Member) \
-        .filter(model.Member.group_id.in_(group_ids)) \
-        .filter(model.Member.table_name == 'user') \
-        .filter(model.Member.state == 'active') \
-        .filter(model.Member.table_id == user_id)
-    if capacity:
-        q = q.filter(model.Member.capacity == capacity)
-    # see if any role has the required permission
-    # admin permission allows anything for the group
-    for row in q.all():
-        perms = ROLE_PERMISSIONS.get(row.capacity, [])
-        if 'admin' in perms or permission in perms:
-            return True
+    capacities = get_user_memberships(user_id)
+    for group_id in group_ids:
+        for row_capacity in capacities.get(group_id, ()):
+            if capacity and row_capacity != capacity:
+                continue
+            # see if any role has the required permission
+            # admin permission allows anything for the group
+            perms = ROLE_PERMISSIONS.get(row_capacity, [])
+            if 'admin' in perms or permission in perms:
+                return True
     return False
 
 
+def get_user_memberships(user_id):
+    ''' Returns the capacities of the user in the groups and organizations
+    they are an active member of, as a dict of sets keyed by group id.
+
+    The memberships are loaded once per request (see
+    :py:mod:`ckan.lib.permission_cache`).
+    '''
+    def load():
+        q = model.Session.query(model.Member.group_id,
+                                model.Member.capacity) \
+            .filter(model.Member.table_name == 'user') \
+            .filter(model.Member.state == 'active') \
+            .filter(model.Member.table_id == user_id)
+        capacities = {}
+        for group_id, capacity in q:
+            capacities.setdefault(group_id, set()).add(capacity)
+        return capacities
+    return permission_cache.get(('memberships', user_id), load)
+
+
+def _get_related_group_ids(group_id, type, upwards):
+    hierarchy = model.group_hierarchy_table
+    if upwards:
+        from_id, to_id = hierarchy.c.descendant_id, hierarchy.c.ancestor_id
+    else:
+        from_id, to_id = hierarchy.c.ancestor_id, hierarchy.c.descendant_id
+    q = model.Session.query(model.Group.id) \
+        .join(hierarchy, to_id == model.Group.id) \
+        .filter(from_id == group_id) \
+        .filter(model.Group.type == type) \
+        .filter(model.Group.state == 'active')
+    return set(row[0] for row in q)
+
+
+def get_group_ancestor_ids(group_id, type='group'):
+    ''' Returns the ids of the active groups of the given type above a group
+    in the hierarchy, i.e. its parents, parents' parents, etc., loaded once
+    per request (see :py:mod:`ckan.lib.permission_cache`). '''
+    return permission_cache.get(
+        ('ancestors', group_id, type),
+        lambda: _get_related_group_ids(group_id, type, upwards=True))
+
+
+def get_group_descendant_ids(group_id, type='group'):
+    ''' Returns the ids of the active groups of the given type underneath a
+    group in the hierarchy, i.e. its children, children's children, etc.,
+    loaded once per request (see :py:mod:`ckan.lib.permission_cache`). '''
+    return permission_cache.get(
+        ('descendants', group_id, type),
+        lambda: _get_related_group_ids(group_id, type, upwards=False))
+
+
 def users_role_for_group_or_org(group_id, user_name):
     ''' Returns the user's role for the group. (Ignores privileges that cascade
     in a group hierarchy.)
@@ -299,14 +352,10 @@ def users_role_for_group_or_org(group_id, user_name):
     if not user_id:
         return None
     # get any roles the user has for the group
-    q = model.Session.query(model.Member) \
-        .filter(model.Member.group_id == group_id) \
-        .filter(model.Member.table_name == 'user') \
-        .filter(model.Member.state == 'active') \
-        .filter(model.Member.table_id == user_id)
+    capacities = get_user_memberships(user_id).get(group_id)
     # return the first role we find
-    for row in q.all():
-        return row.capacity
+    if capacities:
+        return sorted(capacities)[0]
     return None
 
 
@@ -320,14 +369,9 @@ def has_user_permission_for_some_org(user_name, permission):
     if not roles:
         return False
     # get any groups the user has with the needed role
-    q = model.Session.query(model.Member) \
-        .filter(model.Member.table_name == 'user') \
-        .filter(model.Member.state == 'active') \
-        .filter(model.Member.capacity.in_(roles)) \
-        .filter(model.Member.table_id == user_id)
-    group_ids = []
-    for row in q.all():
-        group_ids.append(row.group_id)
+    group_ids = [group_id for group_id, capacities
+                 in get_user_memberships(user_id).iteritems()
+                 if capacities & set(roles)]
     # if not in any groups has no permissions
     if not group_ids:
         return False
@@ -2,13 +2,16 @@
 import urllib
 import urllib2
 import logging
-import json
 import hashlib
 import os
+import time
+import atexit
+import threading
+import zlib
 
 import sqlalchemy as sa
 from paste.cascade import Cascade
-from paste.registry import RegistryManager
+from paste.registry import Registry, RegistryManager
 from paste.urlparser import StaticURLParser
 from paste.deploy.converters import asbool
 from pylons import config
@@ -21,6 +24,7 @@ from ckan.plugins import PluginImplementations
 from ckan.plugins.interfaces import IMiddleware
 from ckan.lib.i18n import get_locales_from_config
 import ckan.lib.uploader as uploader
+import ckan.lib.page_cache as page_cache
 
 from ckan.config.environment import load_environment
 import ckan.lib.app_globals as app_globals
@@ -92,7 +96,7 @@ def make_app(conf, full_stack=True, static_files=True, **app_conf):
             app = StatusCodeRedirect(app, [400, 404, 500])
 
     # Establish the Registry for this application
-    app = RegistryManager(app)
+    app = StreamingRegistryManager(app)
 
     app = I18nMiddleware(app, config)
 
@@ -107,6 +111,46 @@ def make_app(conf, full_stack=True, static_files=True, **app_conf):
     return app
 
 
+class _StreamingRegistry(Registry):
+    '''A registry whose cleanup is put off once when the request's
+    CKAN_STREAMING_RESPONSE environ variable is set.'''
+    def __init__(self, environ):
+        Registry.__init__(self)
+        self.environ = environ
+        self.cleanup_deferred = False
+
+    def cleanup(self):
+        if self.environ.get('CKAN_STREAMING_RESPONSE') and \
+                not self.cleanup_deferred:
+            self.cleanup_deferred = True
+            return
+        Registry.cleanup(self)
+
+
+class StreamingRegistryManager(RegistryManager):
+    '''A RegistryManager that keeps the Pylons globals (``c``,
+    ``request``, the translator...) of a request registered until its
+    response has been sent, rather than until the controller returns, when
+    the controller sets the CKAN_STREAMING_RESPONSE environ variable. This is
+    for responses that are generated while they are being sent.'''
+
+    def __call__(self, environ, start_response):
+        if 'paste.registry' not in environ:
+            environ['paste.registry'] = _StreamingRegistry(environ)
+        reg = environ['paste.registry']
+        try:
+            app_iter = RegistryManager.__call__(self, environ,
+                                                start_response)
+        except:
+            if getattr(reg, 'cleanup_deferred', False):
+                Registry.cleanup(reg)
+            raise
+        if getattr(reg, 'cleanup_deferred', False):
+            return generate_close_and_callback(
+                app_iter, lambda environ: Registry.cleanup(reg), environ)
+        return app_iter
+
+
 class I18nMiddleware(object):
     """I18n Middleware selects the language based on the url
     eg /fr/home is French"""
@@ -156,19 +200,45 @@ class I18nMiddleware(object):
 
 
 class PageCacheMiddleware(object):
-    ''' A simple page cache that can store and serve pages. It uses
-    Redis as storage. It caches pages that have a http status code of
-    200, use the GET method. Only non-logged in users receive cached
-    pages.
+    ''' A page cache that stores and serves pages, see
+    :py:mod:`ckan.lib.page_cache`. It caches pages that have a http status
+    code of 200 and use the GET method. Only non-logged in users receive
+    cached pages.
     Cachable pages are indicated by a environ CKAN_PAGE_CACHABLE
-    variable.'''
+    variable, and their tags by a CKAN_PAGE_CACHE_TAGS one.
+
+    Each page is kept for the ``ckan.page_cache.ttl.<controller>.<action>``
+    seconds of its route, or ``ckan.page_cache.ttl`` seconds (0 to not
+    cache it at all). Pages are stored compressed, together with an ETag
+    that conditional requests are answered with.'''
+
+    chunk_size = 64 * 1024
 
     def __init__(self, app, config):
         self.app = app
-        import redis    # only import if used
-        self.redis = redis  # we need to reference this within the class
-        self.redis_exception = redis.exceptions.ConnectionError
-        self.redis_connection = None
+        self.backend = page_cache.get_backend()
+        self.default_ttl, self.route_ttls = page_cache.ttls()
+        self.apikey_header = config.get('apikey_header_name',
+                                        'X-CKAN-API-Key')
+
+    def _anonymous(self, environ):
+        # REMOTE_USER is used by some tests.
+        if environ.get('REMOTE_USER'):
+            return False
+        if 'auth_tkt=' in environ.get('HTTP_COOKIE', ''):
+            return False
+        apikey_environ = 'HTTP_' + self.apikey_header.upper().replace('-', '_')
+        return not (environ.get(apikey_environ) or
+                    environ.get('HTTP_AUTHORIZATION'))
+
+    def _ttl(self, environ):
+        routing_args = environ.get('wsgiorg.routing_args')
+        if routing_args:
+            route = '%s.%s' % (routing_args[1].get('controller'),
+                               routing_args[1].get('action'))
+            if route in self.route_ttls:
+                return self.route_ttls[route]
+        return self.default_ttl
 
     def __call__(self, environ, start_response):
 
@@ -179,71 +249,181 @@ class PageCacheMiddleware(object):
             return start_response(status, response_headers, exc_info)
 
         # Only use cache for GET requests
-        # REMOTE_USER is used by some tests.
-        if environ['REQUEST_METHOD'] != 'GET' or environ.get('REMOTE_USER'):
+        if environ['REQUEST_METHOD'] != 'GET' or \
+                not self._anonymous(environ):
             return self.app(environ, start_response)
 
         # Make our cache key
-        key = 'page:%s?%s' % (environ['PATH_INFO'], environ['QUERY_STRING'])
-
-        # Try to connect if we don't have a connection. Doing this here
-        # allows the redis server to be unavailable at times.
-        if self.redis_connection is None:
-            try:
-                self.redis_connection = self.redis.StrictRedis()
-                self.redis_connection.flushdb()
-            except self.redis_exception:
-                # Connection may have failed at flush so clear it.
-                self.redis_connection = None
-                return self.app(environ, start_response)
+        key = '%s?%s' % (environ['PATH_INFO'], environ['QUERY_STRING'])
 
         # If cached return cached result
-        try:
-            result = self.redis_connection.lrange(key, 0, 2)
-        except self.redis_exception:
-            # Connection failed so clear it and return the page as normal.
-            self.redis_connection = None
-            return self.app(environ, start_response)
+        entry = self.backend.get(key)
+        if entry is not None:
+            return self._replay(environ, start_response, entry)
 
-        if result:
-            headers = json.loads(result[1])
-            # Convert headers from list to tuples.
-            headers = [(str(key), str(value)) for key, value in headers]
-            start_response(str(result[0]), headers)
-            # Returning a huge string slows down the server. Therefore we
-            # cut it up into more usable chunks.
-            page = result[2]
-            out = []
-            total = len(page)
-            position = 0
-            size = 4096
-            while position < total:
-                out.append(page[position:position + size])
-                position += size
-            return out
-
-        # Generate the response from our application.
+        # Generate the response from our application. The controller has
+        # set the status, headers and environ variables of the page by now,
+        # so pages that are not cached are passed on untouched.
         page = self.app(environ, _start_response)
-
-        # Only cache http status 200 pages
-        if not environ['CKAN_PAGE_STATUS'].startswith('200'):
+        ttl = self._cachable_ttl(environ)
+        if not ttl:
             return page
+        return self._store(environ, key, page, ttl)
 
-        cachable = False
-        if environ.get('CKAN_PAGE_CACHABLE'):
-            cachable = True
-
-        # Cache things if cachable.
-        if cachable:
-            # Make sure we consume any file handles etc.
-            page_string = ''.join(list(page))
-            # Use a pipe to add page in a transaction.
-            pipe = self.redis_connection.pipeline()
-            pipe.rpush(key, environ['CKAN_PAGE_STATUS'])
-            pipe.rpush(key, json.dumps(environ['CKAN_PAGE_HEADERS']))
-            pipe.rpush(key, page_string)
-            pipe.execute()
-        return page
+    def _cachable_ttl(self, environ):
+        '''Return the seconds to cache the page of the request for, or None
+        if it is not to be cached.'''
+        # Only cache http status 200 pages
+        if not environ.get('CKAN_PAGE_STATUS', '').startswith('200') or \
+                not environ.get('CKAN_PAGE_CACHABLE'):
+            return None
+        # pages that set cookies are someone's own
+        if any(name.lower() == 'set-cookie'
+               for name, value in environ['CKAN_PAGE_HEADERS']):
+            return None
+        ttl = self._ttl(environ)
+        if ttl <= 0:
+            return None
+        return ttl
+
+    def _replay(self, environ, start_response, entry):
+        headers = [(str(name), str(value))
+                   for name, value in entry['headers']]
+        headers.append(('ETag', '"%s"' % entry['etag']))
+        headers.append(('Age', str(int(time.time() - entry['stored']))))
+        if page_cache.etag_matches(environ.get('HTTP_IF_NONE_MATCH'),
+                                   entry['etag']):
+            headers = [(name, value) for name, value in headers
+                       if name.lower() not in ('content-length',
+                                               'content-type')]
+            start_response('304 Not Modified', headers)
+            return []
+        start_response(str(entry['status']), headers)
+        return self._decompress(entry['body'])
+
+    def _decompress(self, body):
+        # Returning a huge string slows down the server, and decompressing
+        # it at once takes memory. Therefore we replay it in chunks.
+        decompressor = zlib.decompressobj()
+        for position in xrange(0, len(body), self.chunk_size):
+            chunk = decompressor.decompress(
+                body[position:position + self.chunk_size])
+            if chunk:
+                yield chunk
+        chunk = decompressor.flush()
+        if chunk:
+            yield chunk
+
+    def _store(self, environ, key, page, ttl):
+        # The page is passed on as it is generated and compressed on the
+        # way, it is stored once it has been sent in full.
+        compressor = zlib.compressobj()
+        etag = hashlib.md5()
+        body = []
+        try:
+            for chunk in page:
+                etag.update(chunk)
+                body.append(compressor.compress(chunk))
+                yield chunk
+        finally:
+            # Make sure we release any file handles etc.
+            if hasattr(page, 'close'):
+                page.close()
+
+        body.append(compressor.flush())
+        self.backend.set(key, {
+            'status': environ['CKAN_PAGE_STATUS'],
+            'headers': [(name, value) for name, value
+                        in environ['CKAN_PAGE_HEADERS']
+                        if name.lower() != 'etag'],
+            'etag': etag.hexdigest(),
+            'body': ''.join(body),
+            'stored': time.time(),
+        }, ttl, environ.get('CKAN_PAGE_CACHE_TAGS') or
+            [page_cache.SITE_TAG])
+
+
+class TrackingBuffer(object):
+    '''Collects tracking events in memory and writes them in batches.
+
+    Events are written with one multi-row INSERT by a background thread once
+    ``size`` of them have been collected or every ``interval`` seconds,
+    and when the process exits. At most ``max_size`` events are kept
+    waiting; further events are dropped and counted in ``dropped``.
+    '''
+
+    def __init__(self, engine, size=100, interval=10, max_size=10000):
+        self.engine = engine
+        self.size = size
+        self.interval = interval
+        self.max_size = max_size
+        self.dropped = 0
+        self._reported_dropped = 0
+        self._events = []
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+        self._pid = None
+        atexit.register(self.flush)
+
+    def add(self, user_key, url, tracking_type):
+        '''Queue an event, without waiting for it to be written.'''
+        with self._lock:
+            if len(self._events) >= self.max_size:
+                self.dropped += 1
+                return
+            self._events.append((user_key, url, tracking_type, time.time()))
+            full = len(self._events) >= self.size
+        self._start()
+        if full:
+            self._wake.set()
+
+    def flush(self):
+        '''Write all queued events to tracking_raw and return their number.
+
+        The events keep the time they were received at: their access
+        timestamp is the database time minus the time they waited.
+        '''
+        with self._lock:
+            events, self._events = self._events, []
+        now = time.time()
+        for start in range(0, len(events), self.size):
+            batch = events[start:start + self.size]
+            sql = '''INSERT INTO tracking_raw
+                     (user_key, url, tracking_type, access_timestamp)
+                     VALUES ''' + ', '.join(
+                ["(%s, %s, %s, now() - %s * interval '1 second')"] *
+                len(batch))
+            params = []
+            for user_key, url, tracking_type, received in batch:
+                params.extend([user_key, url, tracking_type, now - received])
+            try:
+                self.engine.execute(sql, *params)
+            except Exception:
+                log.exception('Could not write %s tracking events',
+                              len(batch))
+                with self._lock:
+                    self.dropped += len(batch)
+        if self.dropped != self._reported_dropped:
+            log.warning('%s tracking events dropped so far', self.dropped)
+            self._reported_dropped = self.dropped
+        return len(events)
+
+    def _start(self):
+        # threads don't survive forking, so start one per process
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._thread = threading.Thread(target=self._run)
+                    self._thread.daemon = True
+                    self._thread.start()
+                    self._pid = os.getpid()
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            self.flush()
 
 
 class TrackingMiddleware(object):
@@ -251,6 +431,14 @@ class TrackingMiddleware(object):
     def __init__(self, app, config):
         self.app = app
         self.engine = sa.create_engine(config.get('sqlalchemy.url'))
+        buffer_size = int(config.get('ckan.tracking_buffer_size', 0))
+        if buffer_size:
+            self.buffer = TrackingBuffer(
+                self.engine, buffer_size,
+                float(config.get('ckan.tracking_flush_interval', 10)),
+                int(config.get('ckan.tracking_buffer_max_size', 10000)))
+        else:
+            self.buffer = None
 
     def __call__(self, environ, start_response):
         path = environ['PATH_INFO']
@@ -275,6 +463,9 @@ class TrackingMiddleware(object):
             ])
             key = hashlib.md5(key).hexdigest()
             # store key/data here
+            if self.buffer:
+                self.buffer.add(key, data.get('url'), data.get('type'))
+                return []
             sql = '''INSERT INTO tracking_raw
                      (user_key, url, tracking_type)
                      VALUES (%s, %s, %s)'''
@@ -3,6 +3,8 @@ import logging
 import cgi
 import datetime
 import glob
+import hashlib
+import itertools
 import urllib
 
 from webob.multidict import UnicodeMultiDict
@@ -16,6 +18,8 @@ import ckan.lib.search as search
 import ckan.lib.navl.dictization_functions
 import ckan.lib.jsonp as jsonp
 import ckan.lib.munge as munge
+import ckan.lib.page_cache as page_cache
+import ckan.lib.i18n as i18n
 
 from ckan.common import _, c, request, response
 
@@ -35,6 +39,8 @@ CONTENT_TYPES = {
     'html': 'text/html;charset=utf-8',
     'json': 'application/json;charset=utf-8',
 }
+# the number of datasets searched at a time by dataset_export
+EXPORT_PAGE_SIZE = 1000
 
 
 class ApiController(base.BaseController):
@@ -245,8 +251,91 @@ class ApiController(base.BaseController):
                     str(e)}
             return_dict['success'] = False
             return self._finish(500, return_dict, content_type='json')
+
+        # Let clients polling read-only actions revalidate their copy
+        # instead of downloading it again.
+        if side_effect_free and request.method == 'GET':
+            if self._set_validators(result):
+                return self._finish(304)
         return self._finish_ok(return_dict)
 
+    def _set_validators(self, result):
+        '''Set the ETag and Last-Modified headers of the response to an
+        action from the modification stamps of its result, and return True
+        if the client's copy of the response is still valid.
+
+        Only the results of show actions (dicts with a ``metadata_modified``
+        or ``revision_id``) and of searches (dicts with ``results``) have
+        validators, which can be computed without serializing them.
+        '''
+        parts = [c.user, i18n.get_lang(), sorted(request.params.items())]
+        last_modified = None
+        if not isinstance(result, dict):
+            return False
+        elif 'results' in result and 'count' in result:
+            parts.append([(item.get('id'), item.get('metadata_modified'))
+                          if isinstance(item, dict) else item
+                          for item in result['results']])
+            parts.append(result['count'])
+            parts.append(result.get('search_facets'))
+        elif 'metadata_modified' in result or 'revision_id' in result:
+            parts.extend([result.get('id'), result.get('metadata_modified'),
+                          result.get('revision_id'),
+                          # groups list datasets added after their last
+                          # revision
+                          result.get('package_count')])
+            # The objects embedded in the result (e.g. the members and
+            # datasets of a group, or the organization of a dataset) change
+            # without changing its stamps
+            embeds_objects = False
+            for key, value in sorted(result.items()):
+                if isinstance(value, (dict, list)):
+                    stamps = self._embedded_stamps(value)
+                    parts.append([key, stamps])
+                    if stamps and key not in self._RESULT_PARTS:
+                        embeds_objects = True
+            if result.get('metadata_modified') and not embeds_objects:
+                last_modified = h.date_str_to_datetime(
+                    result['metadata_modified']).replace(microsecond=0)
+        else:
+            return False
+
+        etag = hashlib.md5(h.json.dumps(parts, sort_keys=True)).hexdigest()
+        response.headers['ETag'] = '"%s"' % etag
+        if last_modified:
+            response.last_modified = last_modified
+
+        if_none_match = request.headers.get('If-None-Match')
+        if if_none_match:
+            return page_cache.etag_matches(if_none_match, etag)
+        if last_modified and request.if_modified_since:
+            return last_modified <= \
+                request.if_modified_since.replace(tzinfo=None)
+        return False
+
+    # the embedded objects that only change with the result's own stamps
+    _RESULT_PARTS = ('resources', 'tags', 'extras')
+
+    def _embedded_stamps(self, value):
+        '''Return the ids and modification stamps of the objects embedded in
+        (a value of) an action's result.'''
+        stamps = []
+        if isinstance(value, dict):
+            if 'id' in value:
+                stamps.append([value.get(key) for key in
+                               ('id', 'name', 'title', 'capacity', 'state',
+                                'metadata_modified', 'revision_id')])
+            for key, item in sorted(value.items()):
+                if isinstance(item, (dict, list)):
+                    stamps.extend(self._embedded_stamps(item))
+        elif isinstance(value, list):
+            for item in value:
+                if isinstance(item, (dict, list)):
+                    stamps.extend(self._embedded_stamps(item))
+                else:
+                    stamps.append(item)
+        return stamps
+
     def _get_action_from_map(self, action_map, register, subregister):
         ''' Helper function to get the action function specified in
             the action map'''
@@ -789,6 +878,44 @@ class ApiController(base.BaseController):
         }
         return self._finish_ok(out)
 
+    def dataset_export(self):
+        '''Stream all the datasets matching a search as JSON lines.
+
+        Takes the same parameters as the ``package_search`` action, apart
+        from ``rows`` and ``start``, and returns every matching dataset as
+        one JSON object per line.
+        '''
+        context = {'model': model, 'session': model.Session,
+                   'user': c.user or c.author, 'auth_user_obj': c.userobj}
+        data_dict = dict(request.params.items())
+
+        datasets = search.iter_package_search(context, data_dict,
+                                              EXPORT_PAGE_SIZE)
+        # run the first search now so that errors get a proper response
+        try:
+            first = list(itertools.islice(datasets, 1))
+        except ValidationError, e:
+            return self._finish(409, e.error_dict, content_type='json')
+        except NotAuthorized:
+            return self._finish_not_authz()
+        except search.SearchError, e:
+            return self._finish_bad_request(
+                _('Search error: %s') % str(e))
+
+        response.headers['Content-Type'] = 'application/x-ndjson'
+        # the later pages are searched while the response is sent, which
+        # needs the Pylons globals of the request
+        request.environ['CKAN_STREAMING_RESPONSE'] = True
+        return self._export_lines(itertools.chain(first, datasets))
+
+    def _export_lines(self, datasets):
+        try:
+            for dataset in datasets:
+                yield h.json.dumps(dataset) + '\n'
+        finally:
+            # the controller has removed its session already
+            model.Session.remove()
+
     def status(self):
         context = {'model': model, 'session': model.Session}
         data_dict = {}
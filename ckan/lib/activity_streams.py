@@ -4,7 +4,7 @@ from webhelpers.html import literal
 
 import ckan.lib.helpers as h
 import ckan.lib.base as base
-import ckan.logic as logic
+import ckan.lib.dictization.model_dictize as model_dictize
 
 from ckan.common import _
 
@@ -220,6 +220,39 @@ activity_stream_string_icons = {
 # A list of activity types that may have details
 activity_stream_actions_with_detail = ['changed package']
 
+# Matches the snippet placeholders like {actor} in activity strings.
+_placeholder_re = re.compile('\{([^}]*)\}')
+
+# The placeholders of each (translated) activity string, parsed once per
+# process. The strings are translated, so there is an entry per locale.
+_placeholder_cache = {}
+_PLACEHOLDER_CACHE_SIZE = 1000
+
+
+def _placeholders(activity_msg):
+    placeholders = _placeholder_cache.get(activity_msg)
+    if placeholders is None:
+        placeholders = tuple(_placeholder_re.findall(activity_msg))
+        if len(_placeholder_cache) >= _PLACEHOLDER_CACHE_SIZE:
+            _placeholder_cache.clear()
+        _placeholder_cache[activity_msg] = placeholders
+    return placeholders
+
+
+def _activity_details(context, activity_stream):
+    '''Return the details of the activities that may have them, by activity
+    id, fetched in one query.'''
+    model = context['model']
+    activity_ids = [activity['id'] for activity in activity_stream
+                    if activity['activity_type'] in
+                    activity_stream_actions_with_detail]
+    details = dict((activity_id, []) for activity_id in activity_ids)
+    for detail in model_dictize.activity_detail_list_dictize(
+            model.ActivityDetail.by_activity_ids(activity_ids), context):
+        details[detail['activity_id']].append(detail)
+    return details
+
+
 def activity_list_to_html(context, activity_stream, extra_vars):
     '''Return the given activity stream as a snippet of HTML.
 
@@ -233,13 +266,13 @@ def activity_list_to_html(context, activity_stream, extra_vars):
 
     '''
     activity_list = [] # These are the activity stream messages.
+    activity_details = _activity_details(context, activity_stream)
     for activity in activity_stream:
         detail = None
         activity_type = activity['activity_type']
         # Some activity types may have details.
         if activity_type in activity_stream_actions_with_detail:
-            details = logic.get_action('activity_detail_list')(context=context,
-                data_dict={'id': activity['id']})
+            details = activity_details[activity['id']]
             # If an activity has just one activity detail then render the
             # detail instead of the activity.
             if len(details) == 1:
@@ -267,9 +300,8 @@ def activity_list_to_html(context, activity_stream, extra_vars):
                 activity)
 
         # Get the data needed to render the message.
-        matches = re.findall('\{([^}]*)\}', activity_msg)
         data = {}
-        for match in matches:
+        for match in _placeholders(activity_msg):
             snippet = activity_snippet_functions[match](activity, detail)
             data[str(match)] = snippet
 
@@ -1,5 +1,6 @@
 from pylons import config
 from sqlalchemy.orm.session import SessionExtension
+from sqlalchemy.orm import attributes as orm_attributes
 from paste.deploy.converters import asbool
 import logging
 
@@ -165,3 +166,47 @@ class DatasetActivitySessionExtension(SessionExtension):
                 session.add(activity_detail_obj)
 
         session.flush()
+
+
+def _has_changes(obj, *attributes):
+    return any(orm_attributes.get_history(obj, attribute).has_changes()
+               for attribute in attributes)
+
+
+class ActivityFanoutSessionExtension(SessionExtension):
+    """Session extension that keeps the activity_fanout table up to date.
+
+    Activities added to the session are fanned out to the streams of their
+    object, their user and the groups of their dataset when they are flushed.
+    When a dataset is added to or removed from a group, or is deleted or made
+    private, the group rows of all the dataset's activities are rebuilt, so
+    that group streams show the activities of the group's current datasets.
+
+    """
+    def after_flush(self, session, flush_context):
+        import ckan.model as model
+
+        package_ids = set()
+        for obj in session.new | session.deleted | session.dirty:
+            if isinstance(obj, model.Member):
+                if obj.table_name != 'package':
+                    continue
+                if obj in session.dirty and not _has_changes(
+                        obj, 'state', 'group_id'):
+                    continue
+                package_ids.add(obj.table_id)
+            elif isinstance(obj, model.Package):
+                # new datasets have no activities yet
+                if obj in session.new:
+                    continue
+                if obj in session.dirty and not _has_changes(
+                        obj, 'state', 'private'):
+                    continue
+                package_ids.add(obj.id)
+        if package_ids:
+            model.activity.refresh_package_fanout(session, list(package_ids))
+
+        activities = [obj for obj in session.new
+                      if isinstance(obj, model.Activity)]
+        if activities:
+            model.activity.fan_out_activities(session, activities)
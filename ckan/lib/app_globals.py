@@ -1,10 +1,12 @@
 ''' The application's Globals object '''
 
 import logging
+import os
 import time
 from threading import Lock
 import re
 
+import psycopg2.extensions
 from paste.deploy.converters import asbool
 from pylons import config
 
@@ -186,6 +188,137 @@ def reset():
         app_globals.header_class = 'header-text-logo-tagline'
 
 
+class ConfigUpdateChannel(object):
+    '''Tells the other CKAN processes that the runtime config was updated.
+
+    Without a channel each process finds out by reading
+    ``ckan.config_update`` from the database at most once every
+    ``ckan.config_update_ttl`` seconds. A channel lets processes pick up the
+    update on their next request, so the TTL can be long.
+    '''
+
+    def publish(self):
+        '''Notify the processes that the runtime config was updated.
+
+        Call this once the update is committed, the processes may reload
+        the config straight away.
+        '''
+        pass
+
+    def poll(self):
+        '''Return True if an update was published since the last poll.
+
+        This is called on every request, so it must not query the database.
+        '''
+        return False
+
+
+class LocalConfigUpdateChannel(ConfigUpdateChannel):
+    '''A channel within the current process, as a stand-in for tests.'''
+
+    def __init__(self):
+        self._published = False
+
+    def publish(self):
+        self._published = True
+
+    def poll(self):
+        published, self._published = self._published, False
+        return published
+
+
+class PostgresConfigUpdateChannel(ConfigUpdateChannel):
+    '''A channel using PostgreSQL's LISTEN and NOTIFY on the CKAN database.
+
+    Each process listens on a connection of its own, which is opened on the
+    first poll so that it isn't shared by forked worker processes.
+    '''
+
+    name = 'ckan_config_update'
+
+    def __init__(self):
+        self._connection = None
+        self._pid = None
+
+    def publish(self):
+        # on a connection of its own, so the caller's session isn't committed
+        with model.meta.engine.begin() as connection:
+            connection.execute('NOTIFY {0}'.format(self.name))
+
+    def poll(self):
+        try:
+            if self._connection is None or self._pid != os.getpid():
+                self._listen()
+            connection = self._connection.connection
+            connection.poll()
+        except Exception, e:
+            log.warning('Could not listen for config updates: %s', e)
+            self._close()
+            # a notification may have been missed
+            return True
+        if connection.notifies:
+            del connection.notifies[:]
+            return True
+        return False
+
+    def _listen(self):
+        connection = model.meta.engine.raw_connection()
+        try:
+            # keep the listening connection out of the pool
+            connection.detach()
+            connection.connection.set_isolation_level(
+                psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+            cursor = connection.cursor()
+            cursor.execute('LISTEN {0}'.format(self.name))
+            cursor.close()
+        except Exception:
+            connection.close()
+            raise
+        self._connection = connection
+        self._pid = os.getpid()
+
+    def _close(self):
+        # a connection inherited from the parent process belongs to it
+        if self._connection is not None and self._pid == os.getpid():
+            try:
+                self._connection.close()
+            except Exception, e:
+                log.debug('Could not close the config update connection: %s',
+                          e)
+        self._connection = None
+
+
+config_update_channels = {
+    'local': LocalConfigUpdateChannel,
+    'postgresql': PostgresConfigUpdateChannel,
+}
+
+_config_update_channel = None
+
+
+def config_update_channel():
+    '''Return the channel set by ``ckan.config_update_channel``.'''
+    global _config_update_channel
+    if _config_update_channel is None:
+        name = config.get('ckan.config_update_channel')
+        if name:
+            _config_update_channel = config_update_channels[name]()
+        else:
+            _config_update_channel = ConfigUpdateChannel()
+    return _config_update_channel
+
+
+def publish_config_update():
+    '''Make every CKAN process reload the runtime config.
+
+    This process reloads it on its next request and the others as soon as
+    they get the notification on the config update channel, or when their
+    ``ckan.config_update_ttl`` expires.
+    '''
+    app_globals._last_check = 0
+    config_update_channel().publish()
+
+
 class _Globals(object):
 
     ''' Globals acts as a container for objects available throughout the
@@ -198,11 +331,23 @@ class _Globals(object):
         '''
         self._init()
         self._config_update = None
+        self._last_check = 0
         self._mutex = Lock()
 
     def _check_uptodate(self):
         ''' check the config is uptodate needed when several instances are
-        running '''
+        running
+
+        The update time in the database is only read once every
+        ``ckan.config_update_ttl`` seconds, or when an update is published
+        on the config update channel.
+        '''
+        notified = config_update_channel().poll()
+        ttl = float(config.get('ckan.config_update_ttl', 5))
+        if not notified and time.time() - self._last_check < ttl:
+            return
+        self._last_check = time.time()
+
         value = model.get_system_info('ckan.config_update')
         if self._config_update != value:
             if self._mutex.acquire(False):
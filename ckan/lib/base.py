@@ -25,6 +25,9 @@ import ckan.lib.app_globals as app_globals
 import ckan.plugins as p
 import ckan.model as model
 import ckan.lib.maintain as maintain
+import ckan.lib.page_cache as page_cache
+import ckan.lib.user_cache as user_cache
+import ckan.lib.profiler as profiler
 
 # These imports are for legacy usages and will be removed soon these should
 # be imported directly from ckan.common for internal ckan code and via the
@@ -156,6 +159,14 @@ def render(template_name, extra_vars=None, cache_key=None, cache_type=None,
             break
     # Record cachability for the page cache if enabled
     request.environ['CKAN_PAGE_CACHABLE'] = allow_cache
+    # and what the page shows, to purge it when that changes
+    if allow_cache and 'CKAN_PAGE_CACHE_TAGS' not in request.environ:
+        if c.pkg_dict:
+            request.environ['CKAN_PAGE_CACHE_TAGS'] = \
+                page_cache.dataset_tags(c.pkg_dict)
+        elif c.group_dict:
+            request.environ['CKAN_PAGE_CACHE_TAGS'] = \
+                page_cache.group_tags(c.group_dict)
 
     if allow_cache:
         response.headers["Cache-Control"] = "public"
@@ -196,6 +207,7 @@ class BaseController(WSGIController):
 
     def __before__(self, action, **params):
         c.__timer = time.time()
+        profiler.start(request.method, request.path_qs)
         c.__version__ = ckan.__version__
         app_globals.app_globals._check_uptodate()
 
@@ -268,6 +280,8 @@ class BaseController(WSGIController):
             res = WSGIController.__call__(self, environ, start_response)
         finally:
             model.Session.remove()
+            # in case __after__ did not run, e.g. after an abort()
+            profiler.discard()
 
         return res
 
@@ -279,6 +293,9 @@ class BaseController(WSGIController):
         r_time = time.time() - c.__timer
         url = request.environ['CKAN_CURRENT_URL'].split('?')[0]
         log.info(' %s render time %.3f seconds' % (url, r_time))
+        profile = profiler.finish()
+        if profile is not None:
+            response.headers.update(profiler.headers(profile))
 
     def _set_cors(self):
         '''
@@ -320,9 +337,7 @@ class BaseController(WSGIController):
             return None
         self.log.debug("Received API Key: %s" % apikey)
         apikey = unicode(apikey)
-        query = model.Session.query(model.User)
-        user = query.filter_by(apikey=apikey).first()
-        return user
+        return user_cache.user_by_apikey(apikey)
 
     def _get_page_number(self, params, key='page', default=1):
         """
@@ -192,6 +192,8 @@ class ManageDb(CkanCommand):
                                      the schema upgrade or search indexing
     db create-from-model           - create database from the model (indexes not made)
     db migrate-filestore           - migrate all uploaded data from the 2.1 filesore.
+    db rebuild-activity-fanout     - fill the activity_fanout table from all
+                                     the existing activities
     '''
     summary = __doc__.split('\n')[0]
     usage = __doc__
@@ -253,6 +255,8 @@ class ManageDb(CkanCommand):
             self.send_rdf()
         elif cmd == 'migrate-filestore':
             self.migrate_filestore()
+        elif cmd == 'rebuild-activity-fanout':
+            self.rebuild_activity_fanout()
         else:
             print 'Command %s not recognized' % cmd
             sys.exit(1)
@@ -424,6 +428,13 @@ class ManageDb(CkanCommand):
             Session.commit()
             print "Saved url %s" % url
 
+    def rebuild_activity_fanout(self):
+        import ckan.model as model
+        model.activity.rebuild_activity_fanout(model.Session)
+        model.Session.commit()
+        print 'Activity fan-out rebuilt: %s rows' % model.Session.query(
+            model.activity_fanout_table).count()
+
     def version(self):
         from ckan.model import Session
         print Session.execute('select version from migrate_version;').fetchall()
@@ -433,7 +444,8 @@ class SearchIndexCommand(CkanCommand):
     '''Creates a search index for all datasets
 
     Usage:
-      search-index [-i] [-o] [-r] [-e] rebuild [dataset_name]  - reindex dataset_name if given, if not then rebuild
+      search-index [-i] [-o] [-r] [-e] [-b N] rebuild [dataset_name]
+                                                               - reindex dataset_name if given, if not then rebuild
                                                                  full search index (all datasets)
       search-index rebuild_fast                                - reindex using multiprocessing using all cores.
                                                                  This acts in the same way as rubuild -r [EXPERIMENTAL]
@@ -469,6 +481,11 @@ class SearchIndexCommand(CkanCommand):
 immediately available on the search, but slows significantly the process.
 Default is false.''')
 
+        self.parser.add_option('-b', '--batch-size', dest='batch_size',
+                               type='int', default=None, help=
+'''Send the datasets to Solr in batches of this size, over a single
+connection, instead of one request per dataset.''')
+
     def command(self):
         if not self.args:
             # default to printing help
@@ -505,7 +522,8 @@ Default is false.''')
             rebuild(only_missing=self.options.only_missing,
                     force=self.options.force,
                     refresh=self.options.refresh,
-                    defer_commit=(not self.options.commit_each))
+                    defer_commit=(not self.options.commit_each),
+                    batch_size=self.options.batch_size)
 
         if not self.options.commit_each:
             commit()
@@ -545,7 +563,7 @@ Default is false.''')
             ## sa session
             self._load_config()
             from ckan.lib.search import rebuild, commit
-            rebuild(package_ids=ids)
+            rebuild(package_ids=ids, batch_size=self.options.batch_size)
             commit()
 
         def chunks(l, n):
@@ -1102,6 +1120,57 @@ class Ratings(CkanCommand):
         model.repo.commit_and_remove()
 
 
+class GroupHierarchyCommand(CkanCommand):
+    '''Check or rebuild the group hierarchy table
+
+    Usage:
+      group-hierarchy check     - lists the rows of the table that do not
+                                  match the memberships of groups
+      group-hierarchy rebuild   - recomputes the table from the memberships
+                                  of groups
+    '''
+
+    summary = __doc__.split('\n')[0]
+    usage = __doc__
+    max_args = 1
+    min_args = 1
+
+    def command(self):
+        self._load_config()
+
+        cmd = self.args[0]
+        if cmd == 'check':
+            self.check()
+        elif cmd == 'rebuild':
+            self.rebuild()
+        else:
+            print 'Command %s not recognized' % cmd
+            sys.exit(1)
+
+    def check(self):
+        import ckan.model as model
+        wrong = model.group_hierarchy.check(model.Session)
+        for ancestor_id, descendant_id, expected, depth in wrong:
+            if depth is None:
+                problem = 'missing'
+            elif expected is None:
+                problem = 'not in the hierarchy'
+            else:
+                problem = 'depth %s instead of %s' % (depth, expected)
+            print '%s above %s: %s' % (ancestor_id, descendant_id, problem)
+        if wrong:
+            print '%i rows are wrong, run "group-hierarchy rebuild" to ' \
+                'fix them' % len(wrong)
+            sys.exit(1)
+        print 'The group hierarchy table is consistent'
+
+    def rebuild(self):
+        import ckan.model as model
+        count = model.group_hierarchy.rebuild(model.Session)
+        model.repo.commit_and_remove()
+        print 'Rebuilt the group hierarchy table: %i rows' % count
+
+
 ## Used by the Tracking class
 _ViewCount = collections.namedtuple("ViewCount", "id name count")
 
@@ -1119,6 +1188,9 @@ class Tracking(CkanCommand):
     max_args = 3
     min_args = 1
 
+    # the number of datasets updated in the search index per request
+    SOLR_BATCH_SIZE = 500
+
     def command(self):
         self._load_config()
         import ckan.model as model
@@ -1250,69 +1322,126 @@ class Tracking(CkanCommand):
                  AND tracking_type = 'page';'''
         engine.execute(sql, PACKAGE_URL)
 
-        # update summary totals for resources
-        sql = '''UPDATE tracking_summary t1
-                 SET running_total = (
-                    SELECT sum(count)
-                    FROM tracking_summary t2
-                    WHERE t1.url = t2.url
-                    AND t2.tracking_date <= t1.tracking_date
-                 )
-                 ,recent_views = (
-                    SELECT sum(count)
-                    FROM tracking_summary t2
-                    WHERE t1.url = t2.url
-                    AND t2.tracking_date <= t1.tracking_date AND t2.tracking_date >= t1.tracking_date - 14
-                 )
-                 WHERE t1.running_total = 0 AND tracking_type = 'resource';'''
-        engine.execute(sql)
+        self._update_tracking_totals(engine, summary_date, 'resource', 'url')
+        self._update_tracking_totals(engine, summary_date, 'page',
+                                     'package_id')
 
-        # update summary totals for pages
-        sql = '''UPDATE tracking_summary t1
-                 SET running_total = (
-                    SELECT sum(count)
-                    FROM tracking_summary t2
-                    WHERE t1.package_id = t2.package_id
-                    AND t2.tracking_date <= t1.tracking_date
-                 )
-                 ,recent_views = (
-                    SELECT sum(count)
-                    FROM tracking_summary t2
-                    WHERE t1.package_id = t2.package_id
-                    AND t2.tracking_date <= t1.tracking_date AND t2.tracking_date >= t1.tracking_date - 14
-                 )
-                 WHERE t1.running_total = 0 AND tracking_type = 'page'
-                 AND t1.package_id IS NOT NULL
-                 AND t1.package_id != '~~not~found~~';'''
-        engine.execute(sql)
+    def _update_tracking_totals(self, engine, summary_date, tracking_type,
+                                key):
+        '''Set the running totals and recent views of the summary rows of
+        a day, for each url (resources) or package_id (pages).
+
+        The running totals carry on from the latest earlier totals of each
+        url or package, so days must be updated in order. Recent views are
+        the views of the 14 days before and of the day itself.
+        '''
+        assert key in ('url', 'package_id')
+        sql = '''UPDATE tracking_summary t
+                 SET running_total = day.count
+                                     + COALESCE(previous.running_total, 0)
+                    ,recent_views = recent.recent_views
+                 FROM (
+                    SELECT {key}, sum(count) AS count
+                    FROM tracking_summary
+                    WHERE tracking_date = %(summary_date)s
+                    AND tracking_type = %(tracking_type)s
+                    AND {key} IS NOT NULL
+                    AND {key} != '~~not~found~~'
+                    GROUP BY {key}
+                 ) day
+                 LEFT OUTER JOIN (
+                    SELECT DISTINCT ON ({key}) {key}, running_total
+                    FROM tracking_summary
+                    WHERE tracking_date < %(summary_date)s
+                    AND tracking_type = %(tracking_type)s
+                    AND {key} IN (
+                        SELECT {key} FROM tracking_summary
+                        WHERE tracking_date = %(summary_date)s
+                        AND tracking_type = %(tracking_type)s)
+                    ORDER BY {key}, tracking_date DESC
+                 ) previous ON previous.{key} = day.{key}
+                 JOIN (
+                    SELECT {key}, sum(count) AS recent_views
+                    FROM tracking_summary
+                    WHERE tracking_date <= %(summary_date)s
+                    AND tracking_date >= CAST(%(summary_date)s AS date) - 14
+                    AND tracking_type = %(tracking_type)s
+                    AND {key} IN (
+                        SELECT {key} FROM tracking_summary
+                        WHERE tracking_date = %(summary_date)s
+                        AND tracking_type = %(tracking_type)s)
+                    GROUP BY {key}
+                 ) recent ON recent.{key} = day.{key}
+                 WHERE t.{key} = day.{key}
+                 AND t.tracking_date = %(summary_date)s
+                 AND t.tracking_type = %(tracking_type)s;'''.format(key=key)
+        engine.execute(sql, summary_date=summary_date,
+                       tracking_type=tracking_type)
 
     def update_tracking_solr(self, engine, start_date):
-        sql = '''SELECT package_id FROM tracking_summary
+        '''Update the view counts in the search index of the datasets
+        viewed since start_date.
+
+        With ckan.search.solr_atomic_updates on and a Solr schema that
+        supports them, only the views_total and views_recent fields of the
+        documents are set, with atomic updates. Otherwise the datasets are
+        reindexed in batches.
+        '''
+        from ckan.lib.search import (index_for, rebuild,
+                                     get_solr_schema_version,
+                                     ATOMIC_UPDATES_SCHEMA_VERSIONS)
+        from paste.deploy.converters import asbool
+
+        sql = '''SELECT DISTINCT package_id FROM tracking_summary
                 where package_id!='~~not~found~~'
                 and tracking_date >= %s;'''
         results = engine.execute(sql, start_date)
+        package_ids = set(row['package_id'] for row in results)
 
-        package_ids = set()
-        for row in results:
-            package_ids.add(row['package_id'])
+        # deleted datasets are not in the index
+        indexed_ids = set()
+        for batch in _batches(list(package_ids), self.SOLR_BATCH_SIZE):
+            indexed_ids.update(row[0] for row in model.Session.query(
+                model.Package.id).filter(model.Package.id.in_(batch)).filter(
+                model.Package.state != model.State.DELETED))
+        not_found = len(package_ids - indexed_ids)
+        package_ids = sorted(indexed_ids)
 
         total = len(package_ids)
-        not_found = 0
-        print '%i package index%s to be rebuilt starting from %s' % (total, '' if total < 2 else 'es', start_date)
+        print '%i package index%s to be updated starting from %s' % (total, '' if total < 2 else 'es', start_date)
+
+        package_index = index_for(model.Package)
+        atomic_updates = (
+            package_ids and
+            asbool(config.get('ckan.search.solr_atomic_updates', False)) and
+            hasattr(package_index, 'update_views'))
+        if atomic_updates:
+            # updating the documents of an older schema would lose the
+            # fields it does not store
+            version = get_solr_schema_version()
+            if version not in ATOMIC_UPDATES_SCHEMA_VERSIONS:
+                print 'Solr schema version %s does not support atomic ' \
+                    'updates, reindexing the datasets instead.' % version
+                atomic_updates = False
+        try:
+            if atomic_updates:
+                for batch in _batches(package_ids, self.SOLR_BATCH_SIZE):
+                    package_index.update_views(
+                        model.TrackingSummary.get_for_packages(batch),
+                        defer_commit=True)
+                package_index.commit()
+            elif package_ids:
+                rebuild(package_ids=package_ids,
+                        batch_size=self.SOLR_BATCH_SIZE)
+        except KeyboardInterrupt:
+            print "Stopped."
+            return
+        print 'search index update done.' + (' %i not found.' % (not_found) if not_found else "")
 
-        from ckan.lib.search import rebuild
-        for package_id in package_ids:
-            try:
-                rebuild(package_id)
-            except logic.NotFound:
-                print "Error: package %s not found." % (package_id)
-                not_found += 1
-            except KeyboardInterrupt:
-                print "Stopped."
-                return
-            except:
-                raise
-        print 'search index rebuilding done.' + (' %i not found.' % (not_found) if not_found else "")
+
+def _batches(items, size):
+    for start in xrange(0, len(items), size):
+        yield items[start:start + size]
 
 
 class PluginInfo(CkanCommand):
@@ -9,7 +9,10 @@ The basic recipe is to call:
 
 which builds the dictionary by iterating over the table columns.
 '''
+import collections
 import datetime
+import threading
+import time
 import urlparse
 
 from pylons import config
@@ -298,6 +301,14 @@ def package_dictize(pkg, context):
     if isinstance(pkg, model.PackageRevision):
         pkg = model.Package.get(pkg.id)
 
+    _add_package_properties(pkg, result_dict)
+
+    return result_dict
+
+
+def _add_package_properties(pkg, result_dict):
+    '''Add to result_dict the properties that are computed from the Package
+    domain object rather than read from the tables.'''
     # isopen
     result_dict['isopen'] = pkg.isopen if isinstance(pkg.isopen, bool) \
                             else pkg.isopen()
@@ -320,7 +331,139 @@ def package_dictize(pkg, context):
     result_dict['metadata_created'] = pkg.metadata_created.isoformat() \
         if pkg.metadata_created else None
 
-    return result_dict
+
+def _rows_by(rows, key):
+    '''Group the given result rows in a dict of lists, keyed by the value of
+    their ``key`` column.'''
+    grouped = collections.defaultdict(list)
+    for row in rows:
+        grouped[row[key]].append(row)
+    return grouped
+
+
+def _pop_key(dict_list, key):
+    for dict_ in dict_list:
+        dict_.pop(key, None)
+    return dict_list
+
+
+def package_list_dictize(pkg_ids, context):
+    '''
+    Given a list of package ids, returns a list of the equivalent
+    dictionaries, in the same order, as package_dictize would return them.
+
+    The related objects (resources, tags, extras, groups, organization and
+    relationships) are fetched with a single query per table for all the
+    packages, rather than with several queries per package, so the number
+    of queries does not depend on the number of packages. Callers dictizing
+    very large numbers of packages should still split them in batches.
+
+    Ids that don't match any package are ignored.
+
+    Only the latest revision is supported. If revision_id or revision_date
+    are provided in the context, each package is dictized with
+    package_dictize instead.
+    '''
+    model = context['model']
+    session = model.Session
+    pkg_ids = list(pkg_ids)
+    if not pkg_ids:
+        return []
+
+    pkgs = dict((pkg.id, pkg) for pkg in
+                session.query(model.Package).filter(
+                    model.Package.id.in_(pkg_ids)))
+    pkgs = [pkgs[pkg_id] for pkg_id in pkg_ids if pkg_id in pkgs]
+
+    if context.get('revision_id') or context.get('revision_date'):
+        return [package_dictize(pkg, context) for pkg in pkgs]
+
+    pkg_ids = [pkg.id for pkg in pkgs]
+
+    #resources
+    res = model.resource_table
+    q = select([res]).where(res.c.package_id.in_(pkg_ids))
+    resources = _rows_by(_execute(q, res, context), 'package_id')
+
+    #tags
+    tag = model.tag_table
+    pkg_tag = model.package_tag_table
+    q = select([tag, pkg_tag.c.state, pkg_tag.c.package_id.label('_pkg_id')],
+               from_obj=pkg_tag.join(tag, tag.c.id == pkg_tag.c.tag_id)
+               ).where(pkg_tag.c.package_id.in_(pkg_ids))
+    tags = _rows_by(_execute(q, pkg_tag, context), '_pkg_id')
+
+    #extras
+    extra = model.package_extra_table
+    q = select([extra]).where(extra.c.package_id.in_(pkg_ids))
+    extras = _rows_by(_execute(q, extra, context), 'package_id')
+
+    #groups
+    member = model.member_table
+    group = model.group_table
+    q = select([group, member.c.capacity, member.c.table_id.label('_pkg_id')],
+               from_obj=member.join(group, group.c.id == member.c.group_id)
+               ).where(member.c.table_id.in_(pkg_ids))\
+                .where(member.c.state == 'active') \
+                .where(group.c.is_organization == False)
+    groups = _rows_by(_execute(q, member, context), '_pkg_id')
+
+    #owning organizations
+    org_ids = set(pkg.owner_org for pkg in pkgs if pkg.owner_org)
+    organizations = {}
+    if org_ids:
+        q = select([group]
+                   ).where(group.c.id.in_(org_ids)) \
+                    .where(group.c.state == 'active')
+        organizations = _rows_by(_execute(q, group, context), 'id')
+
+    #relations
+    rel = model.package_relationship_table
+    q = select([rel]).where(rel.c.subject_package_id.in_(pkg_ids))
+    rels_as_subject = _rows_by(_execute(q, rel, context),
+                               'subject_package_id')
+    q = select([rel]).where(rel.c.object_package_id.in_(pkg_ids))
+    rels_as_object = _rows_by(_execute(q, rel, context), 'object_package_id')
+
+    result_list = []
+    for pkg in pkgs:
+        result_dict = d.table_dictize(pkg, context)
+        #strip whitespace from title
+        if result_dict.get('title'):
+            result_dict['title'] = result_dict['title'].strip()
+
+        result_dict['resources'] = resource_list_dictize(
+            resources.get(pkg.id, []), context)
+        result_dict['num_resources'] = len(result_dict['resources'])
+
+        result_dict['tags'] = _pop_key(
+            d.obj_list_dictize(tags.get(pkg.id, []), context,
+                               lambda x: x['name']), '_pkg_id')
+        result_dict['num_tags'] = len(result_dict['tags'])
+        for tag_dict in result_dict['tags']:
+            tag_dict['display_name'] = tag_dict['name']
+
+        result_dict['extras'] = extras_list_dictize(extras.get(pkg.id, []),
+                                                    context)
+
+        context['with_capacity'] = False
+        result_dict['groups'] = _pop_key(
+            group_list_dictize(groups.get(pkg.id, []), context,
+                               with_package_counts=False), '_pkg_id')
+
+        orgs = d.obj_list_dictize(organizations.get(pkg.owner_org, []),
+                                  context)
+        result_dict['organization'] = orgs[0] if orgs else None
+
+        result_dict['relationships_as_subject'] = d.obj_list_dictize(
+            rels_as_subject.get(pkg.id, []), context)
+        result_dict['relationships_as_object'] = d.obj_list_dictize(
+            rels_as_object.get(pkg.id, []), context)
+
+        _add_package_properties(pkg, result_dict)
+        result_list.append(result_dict)
+
+    return result_list
 
 
 def _get_members(context, group, member_type):
@@ -349,6 +492,27 @@ def get_group_dataset_counts():
     return query.facets
 
 
+_group_dataset_counts = {'counts': None, 'expires': 0}
+_group_dataset_counts_lock = threading.Lock()
+
+
+def get_cached_group_dataset_counts():
+    '''Return the result of get_group_dataset_counts(), cached for
+    ``ckan.group_dataset_counts_cache_ttl`` seconds (default: 60) so that
+    listing groups doesn't query Solr every time.'''
+    ttl = int(config.get('ckan.group_dataset_counts_cache_ttl', 60))
+    if ttl <= 0:
+        return get_group_dataset_counts()
+    with _group_dataset_counts_lock:
+        if _group_dataset_counts['expires'] > time.time():
+            return _group_dataset_counts['counts']
+    counts = get_group_dataset_counts()
+    with _group_dataset_counts_lock:
+        _group_dataset_counts.update({'counts': counts,
+                                      'expires': time.time() + ttl})
+    return counts
+
+
 def group_dictize(group, context,
                   include_groups=True,
                   include_tags=True,
@@ -1,13 +1,19 @@
 import csv
 import datetime
-from sqlalchemy import orm
+from pylons import config
+from sqlalchemy import orm, func
 
 import ckan.model as model
 import ckan.model
+import ckan.lib.helpers as h
 from ckan.common import json, OrderedDict
 
 class SimpleDumper(object):
     '''Dumps just package data but including tags, groups, license text etc'''
+
+    # number of packages dictized together
+    batch_size = 1000
+
     def dump(self, dump_file_obj, format='json', query=None):
         if query is None:
             query = model.Session.query(model.Package)
@@ -22,8 +28,7 @@ class SimpleDumper(object):
 
     def dump_csv(self, dump_file_obj, query):
         row_dicts = []
-        for pkg in query:
-            pkg_dict = pkg.as_dict()
+        for pkg_dict in self.package_dicts(query):
             # flatten dict
             for name, value in pkg_dict.items()[:]:
                 if isinstance(value, (list, tuple)):
@@ -44,12 +49,125 @@ class SimpleDumper(object):
         writer.save(dump_file_obj)
 
     def dump_json(self, dump_file_obj, query):
-        pkgs = []
-        for pkg in query:
-            pkg_dict = pkg.as_dict()
-            pkgs.append(pkg_dict)
+        pkgs = list(self.package_dicts(query))
         json.dump(pkgs, dump_file_obj, indent=4)
 
+    def package_dicts(self, query):
+        '''Yield the dump dict of each package in the query.
+
+        Packages are dictized in batches with package_list_dictize, so the
+        number of queries depends on the number of batches rather than on
+        the number of packages. The dicts have the same shape as the ones
+        returned by Package.as_dict().
+        '''
+        from ckan.lib.dictization.model_dictize import package_list_dictize
+
+        context = {'model': model, 'session': model.Session}
+        pkg_ids = [row[0] for row in query.with_entities(model.Package.id)]
+        for start in xrange(0, len(pkg_ids), self.batch_size):
+            batch_ids = pkg_ids[start:start + self.batch_size]
+            pkg_dicts = package_list_dictize(batch_ids, context)
+            ratings = self._ratings(batch_ids)
+            names = self._related_package_names(pkg_dicts)
+            groups = self._group_names(batch_ids)
+            resources = self._resources(batch_ids)
+            for pkg_dict in pkg_dicts:
+                yield self._dump_dict(pkg_dict, ratings, names, groups,
+                                      resources)
+
+    def _ratings(self, pkg_ids):
+        q = model.Session.query(model.Rating.package_id,
+                                func.sum(model.Rating.rating),
+                                func.count(model.Rating.id)) \
+            .filter(model.Rating.package_id.in_(pkg_ids)) \
+            .group_by(model.Rating.package_id)
+        return dict((pkg_id, (total, count)) for pkg_id, total, count in q)
+
+    def _group_names(self, pkg_ids):
+        # like Package.get_groups(), so organizations are included
+        q = model.Session.query(model.Member.table_id, model.Group.name) \
+            .join(model.Group, model.Group.id == model.Member.group_id) \
+            .filter(model.Member.table_name == 'package') \
+            .filter(model.Member.state == 'active') \
+            .filter(model.Member.table_id.in_(pkg_ids))
+        groups = {}
+        for pkg_id, group_name in q:
+            groups.setdefault(pkg_id, []).append(group_name)
+        return groups
+
+    def _resources(self, pkg_ids):
+        # the resources as stored, without the url rewriting of
+        # resource_dictize
+        q = model.Session.query(model.Resource) \
+            .filter(model.Resource.package_id.in_(pkg_ids)) \
+            .filter(model.Resource.state != model.State.DELETED) \
+            .order_by(model.Resource.package_id, model.Resource.position)
+        resources = {}
+        for resource in q:
+            resources.setdefault(resource.package_id, []).append(
+                resource.as_dict(core_columns_only=False))
+        return resources
+
+    def _related_package_names(self, pkg_dicts):
+        pkg_ids = set()
+        for pkg_dict in pkg_dicts:
+            for rel in (pkg_dict['relationships_as_subject'] +
+                        pkg_dict['relationships_as_object']):
+                pkg_ids.add(rel['subject_package_id'])
+                pkg_ids.add(rel['object_package_id'])
+        if not pkg_ids:
+            return {}
+        q = model.Session.query(model.Package.id, model.Package.name) \
+            .filter(model.Package.id.in_(pkg_ids))
+        return dict(q)
+
+    def _dump_dict(self, pkg_dict, ratings, names, groups, resources):
+        _dict = OrderedDict()
+        table = orm.class_mapper(model.Package).mapped_table
+        for col in table.c:
+            _dict[col.name] = pkg_dict.get(col.name)
+        license = model.Package.get_license_register().get(
+            _dict['license_id'])
+        _dict['license'] = license.title if license else \
+            _dict.get('license_id', '')
+        _dict['isopen'] = pkg_dict['isopen']
+        _dict['tags'] = sorted(tag['name'] for tag in pkg_dict['tags']
+                               if not tag.get('vocabulary_id'))
+        _dict['groups'] = sorted(groups.get(pkg_dict['id'], []))
+        _dict['extras'] = dict((extra['key'], extra['value'])
+                               for extra in pkg_dict['extras'])
+        total, count = ratings.get(pkg_dict['id'], (0, 0))
+        _dict['ratings_average'] = total / count if total else None
+        _dict['ratings_count'] = count
+        _dict['resources'] = resources.get(pkg_dict['id'], [])
+        site_url = config.get('ckan.site_url', None)
+        if site_url:
+            _dict['ckan_url'] = '%s/dataset/%s' % (site_url, pkg_dict['name'])
+        relationships = []
+        for rel in pkg_dict['relationships_as_subject']:
+            if rel['state'] != model.State.ACTIVE:
+                continue
+            relationships.append({
+                'subject': pkg_dict['name'],
+                'type': rel['type'],
+                'object': names.get(rel['object_package_id']),
+                'comment': rel['comment']})
+        for rel in pkg_dict['relationships_as_object']:
+            if rel['state'] != model.State.ACTIVE:
+                continue
+            relationships.append({
+                'subject': pkg_dict['name'],
+                'type': model.PackageRelationship.forward_to_reverse_type(
+                    rel['type']),
+                'object': names.get(rel['subject_package_id']),
+                'comment': rel['comment']})
+        _dict['relationships'] = relationships
+        _dict['metadata_modified'] = pkg_dict['metadata_modified']
+        _dict['metadata_created'] = pkg_dict['metadata_created']
+        _dict['notes_rendered'] = h.render_markdown(pkg_dict.get('notes'))
+        _dict['type'] = pkg_dict['type']
+        return _dict
+
 class Dumper(object):
     '''Dumps the database in same structure as it appears in the database'''
     model_classes = [
@@ -0,0 +1,125 @@
+'''A cache for the values computed by template helpers.
+
+Some helpers, like the site statistics and the featured groups on the home
+page, run several searches and action calls to compute values that hardly
+ever change. Decorating them with ``cached`` keeps their results for a given
+number of seconds::
+
+    @helper_cache.cached(expire=600, topics=['package', 'group'])
+    def get_site_statistics():
+        ...
+
+The cached values of a helper are also dropped as soon as a change to the
+objects of one of its ``topics`` (see ``TOPICS``) is committed, e.g. when a
+dataset is created, updated or deleted.
+
+The values are kept in a Beaker cache set up with the ``beaker.cache.*``
+config options. The default memory cache is per process; use a ``file`` or
+``ext:memcached`` cache to share the values, and their invalidation, between
+worker processes.
+
+'''
+import copy
+import functools
+import hashlib
+import logging
+import os
+import threading
+import uuid
+
+from beaker.cache import CacheManager
+from beaker.util import parse_cache_config_options
+from paste.deploy.converters import asbool
+from pylons import config
+
+log = logging.getLogger(__name__)
+
+# The names of the domain object classes whose changes invalidate each topic.
+TOPICS = {
+    'package': set(['Package', 'Resource', 'PackageTag', 'PackageExtra',
+                    'Member']),
+    'group': set(['Group', 'GroupExtra', 'Member']),
+    'related': set(['Related', 'RelatedDataset']),
+}
+
+_TOPICS_NAMESPACE = 'ckan.lib.helper_cache.topics'
+
+_cache_manager = None
+_cache_manager_lock = threading.Lock()
+
+
+def _get_cache(namespace):
+    global _cache_manager
+    with _cache_manager_lock:
+        if _cache_manager is None:
+            options = parse_cache_config_options(config)
+            if options['type'] in ('file', 'dbm') and \
+                    not options.get('data_dir') and config.get('cache_dir'):
+                options['data_dir'] = os.path.join(config['cache_dir'],
+                                                   'helper_cache')
+            _cache_manager = CacheManager(**options)
+    return _cache_manager.get_cache(namespace)
+
+
+def _topic_version(topic):
+    return _get_cache(_TOPICS_NAMESPACE).get_value(
+        topic, createfunc=lambda: uuid.uuid4().hex)
+
+
+def _lang():
+    # the helpers' values may be translated
+    import ckan.lib.i18n as i18n
+    try:
+        return i18n.get_lang()
+    except TypeError:
+        # not in a request
+        return None
+
+
+def cached(expire, topics=()):
+    '''Cache the results of a helper function for ``expire`` seconds, or
+    until an object of one of the ``topics`` changes.
+
+    The results are cached by the helper's arguments and the language of the
+    request. They must not depend on the logged-in user. Caching can be
+    turned off with ``ckan.helper_cache_enabled``.
+    '''
+    for topic in topics:
+        assert topic in TOPICS, 'Unknown helper cache topic: %s' % topic
+
+    def decorator(func):
+        namespace = '%s.%s' % (func.__module__, func.__name__)
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not asbool(config.get('ckan.helper_cache_enabled', True)):
+                return func(*args, **kwargs)
+            key = repr((args, sorted(kwargs.items()), _lang(),
+                        [_topic_version(topic) for topic in topics]))
+            value = _get_cache(namespace).get_value(
+                hashlib.md5(key).hexdigest(),
+                createfunc=lambda: func(*args, **kwargs),
+                expiretime=expire)
+            # callers may change the value they get
+            return copy.deepcopy(value)
+        return wrapper
+    return decorator
+
+
+def invalidate(*topics):
+    '''Drop the cached values of all the helpers of the given topics.'''
+    cache = _get_cache(_TOPICS_NAMESPACE)
+    for topic in topics:
+        log.debug('Invalidating cached helper values of topic %s', topic)
+        cache.put(topic, uuid.uuid4().hex)
+
+
+def invalidate_changed(class_names):
+    '''Drop the cached values of the topics the changes to instances of the
+    given domain object classes affect.'''
+    if not asbool(config.get('ckan.helper_cache_enabled', True)):
+        return
+    topics = [topic for topic, topic_classes in TOPICS.iteritems()
+              if topic_classes & set(class_names)]
+    if topics:
+        invalidate(*topics)
@@ -34,6 +34,7 @@ import ckan.exceptions
 
 import ckan.model as model
 import ckan.lib.formatters as formatters
+import ckan.lib.helper_cache as helper_cache
 import ckan.lib.maintain as maintain
 import ckan.logic as logic
 import ckan.lib.uploader as uploader
@@ -1714,9 +1715,13 @@ def uploads_enabled():
     return False
 
 
+@helper_cache.cached(expire=600, topics=['package', 'group'])
 def get_featured_organizations(count=1):
     '''Returns a list of favourite organization in the form
     of organization_list action function
+
+    The organizations are shown as to a visitor who is not logged in and
+    are cached for up to ten minutes.
     '''
     config_orgs = config.get('ckan.featured_orgs', '').split()
     orgs = featured_group_org(get_action='organization_show',
@@ -1726,9 +1731,13 @@ def get_featured_organizations(count=1):
     return orgs
 
 
+@helper_cache.cached(expire=600, topics=['package', 'group'])
 def get_featured_groups(count=1):
     '''Returns a list of favourite group the form
     of organization_list action function
+
+    The groups are shown as to a visitor who is not logged in and are cached
+    for up to ten minutes.
     '''
     config_groups = config.get('ckan.featured_groups', '').split()
     groups = featured_group_org(get_action='group_show',
@@ -1742,7 +1751,8 @@ def featured_group_org(items, get_action, list_action, count):
     def get_group(id):
         context = {'ignore_auth': True,
                    'limits': {'packages': 2},
-                   'for_view': True}
+                   'for_view': True,
+                   'user': ''}
         data_dict = {'id': id,
                      'include_datasets': True}
 
@@ -1754,7 +1764,7 @@ def featured_group_org(items, get_action, list_action, count):
 
     groups_data = []
 
-    extras = logic.get_action(list_action)({}, {})
+    extras = logic.get_action(list_action)({'user': ''}, {})
 
     # list of found ids to prevent duplicates
     found = []
@@ -1773,10 +1783,13 @@ def featured_group_org(items, get_action, list_action, count):
     return groups_data
 
 
+@helper_cache.cached(expire=600, topics=['package', 'group', 'related'])
 def get_site_statistics():
+    '''Return the numbers of public datasets, groups, organizations and
+    related items, cached for up to ten minutes.'''
     stats = {}
     stats['dataset_count'] = logic.get_action('package_search')(
-        {}, {"rows": 1})['count']
+        {'user': ''}, {"rows": 1})['count']
     stats['group_count'] = len(logic.get_action('group_list')({}, {}))
     stats['organization_count'] = len(
         logic.get_action('organization_list')({}, {}))
@@ -79,6 +79,9 @@ def get_all_key_combinations(data, flattented_schema):
 
     '''
     schema_prefixes = set([key[:-1] for key in flattented_schema])
+    return _get_key_combinations(data, schema_prefixes)
+
+def _get_key_combinations(data, schema_prefixes):
     combinations = set([()])
 
     for key in sorted(data.keys(), key=flattened_order_key):
@@ -94,33 +97,119 @@ def get_all_key_combinations(data, flattented_schema):
 
     return combinations
 
-def make_full_schema(data, schema):
-    '''make schema by getting all valid combinations and making sure that all keys
-    are available'''
 
-    flattented_schema = flatten_schema(schema)
+class CompiledSchema(object):
+    '''A schema together with the structures that validating against it
+    needs, worked out once rather than on every call to validate.
 
-    key_combinations = get_all_key_combinations(data, flattented_schema)
+    Use compile_schema() to get one. It can be passed to validate() and
+    validate_flattened() in place of the schema dict.
 
-    full_schema = {}
+    '''
+    def __init__(self, schema):
+        self.schema = schema
+        self.keys = schema.keys()
+        self.flattened = flatten_schema(schema)
+        self.prefixes = set(key[:-1] for key in self.flattened)
+
+        # every leading part of the flattened keys, to spot data placed
+        # against a sub-schema
+        self.key_starts = set()
+        for key in self.flattened:
+            for i in range(len(key) + 1):
+                self.key_starts.add(key[:i])
+
+        # (key, converters) of the fields of each (sub-)schema, keyed by
+        # the path to it, e.g. () or ('resources',)
+        self.fields = {}
+        for prefix in self.prefixes:
+            sub_schema = schema
+            for key in prefix:
+                sub_schema = sub_schema[key]
+            # copies, as the compiled schema is shared by the schemas with
+            # the same converters
+            self.fields[prefix] = [(key, list(value)) for key, value
+                                   in sub_schema.iteritems()
+                                   if isinstance(value, list)]
+
+    def key_combinations(self, data):
+        return _get_key_combinations(data, self.prefixes)
+
+    def full_schema(self, data, key_combinations=None):
+        if key_combinations is None:
+            key_combinations = self.key_combinations(data)
+        full_schema = {}
+        for combination in key_combinations:
+            for key, value in self.fields.get(combination[::2], []):
+                full_schema[combination + (key,)] = value
+        return full_schema
+
+    def run_order(self, full_schema):
+        '''Return the keys of the full schema split in the lists for the
+        before, main, extras and after runs, in the order they run.'''
+        before, main, extras, after = [], [], [], []
+        for key in sorted(full_schema, key=flattened_order_key):
+            last = key[-1]
+            if last == '__before':
+                before.append(key)
+            elif last == '__extras':
+                extras.append(key)
+            elif last == '__after':
+                after.append(key)
+            elif not last.startswith('__'):
+                main.append(key)
+        after.reverse()
+        return before, main, extras, after
+
+
+_compiled_schemas = {}
+_COMPILED_SCHEMAS_MAX = 200
+
+def _schema_key(schema):
+    '''Return a key of the structure and converters of a schema dict, equal
+    for the schemas that validate the same way.'''
+    return frozenset((key, _schema_key(value) if isinstance(value, dict)
+                      else tuple(value))
+                     for key, value in schema.iteritems())
+
+def compile_schema(schema):
+    '''Return the CompiledSchema for the given schema dict.
+
+    Compiled schemas are cached by the keys and converters of the schema
+    dict, so the schemas that are built afresh for every call (e.g. by the
+    ``default_*_schema()`` functions of ckan.logic.schema) are only compiled
+    once. Schemas with converters that can't be hashed are not cached.
 
-    for combination in key_combinations:
-        sub_schema = schema
-        for key in combination[::2]:
-            sub_schema = sub_schema[key]
+    '''
+    if isinstance(schema, CompiledSchema):
+        return schema
+    try:
+        key = _schema_key(schema)
+        compiled = _compiled_schemas.get(key)
+    except TypeError:
+        return CompiledSchema(schema)
+    if compiled is None:
+        compiled = CompiledSchema(schema)
+        if len(_compiled_schemas) >= _COMPILED_SCHEMAS_MAX:
+            _compiled_schemas.clear()
+        _compiled_schemas[key] = compiled
+    return compiled
 
-        for key, value in sub_schema.iteritems():
-            if isinstance(value, list):
-                full_schema[combination + (key,)] = value
+def make_full_schema(data, schema):
+    '''make schema by getting all valid combinations and making sure that all keys
+    are available'''
 
-    return full_schema
+    return compile_schema(schema).full_schema(data)
 
 def augment_data(data, schema):
     '''add missing, extras and junk data'''
-    flattented_schema = flatten_schema(schema)
-    key_combinations = get_all_key_combinations(data, flattented_schema)
+    return _augment_data(data, compile_schema(schema))
 
-    full_schema = make_full_schema(data, schema)
+def _augment_data(data, compiled, key_combinations=None, full_schema=None):
+    if key_combinations is None:
+        key_combinations = compiled.key_combinations(data)
+    if full_schema is None:
+        full_schema = compiled.full_schema(data, key_combinations)
 
     new_data = copy.copy(data)
 
@@ -132,8 +221,7 @@ def augment_data(data, schema):
 
         ## check if any thing naugthy is placed against subschemas
         initial_tuple = key[::2]
-        if initial_tuple in [initial_key[:len(initial_tuple)]
-                             for initial_key in flattented_schema]:
+        if initial_tuple in compiled.key_starts:
             if data[key] <> []:
                 raise DataError('Only lists of dicts can be placed against '
                                 'subschema %s, not %s' % (key,type(data[key])))
@@ -220,8 +308,12 @@ def _remove_blank_keys(schema):
     return schema
 
 def validate(data, schema, context=None):
-    '''Validate an unflattened nested dict against a schema.'''
+    '''Validate an unflattened nested dict against a schema.
+
+    The schema can be a schema dict or a CompiledSchema.
+    '''
     context = context or {}
+    schema = compile_schema(schema)
 
     assert isinstance(data, dict)
 
@@ -232,7 +324,7 @@ def validate(data, schema, context=None):
 
     # create a copy of the context which also includes the schema keys so
     # they can be used by the validators
-    validators_context = dict(context, schema_keys=schema.keys())
+    validators_context = dict(context, schema_keys=list(schema.keys))
 
     flattened = flatten_dict(data)
     converted_data, errors = _validate(flattened, schema, validators_context)
@@ -266,7 +358,7 @@ def validate_flattened(data, schema, context=None):
 
     context = context or {}
     assert isinstance(data, dict)
-    converted_data, errors = _validate(data, schema, context)
+    converted_data, errors = _validate(data, compile_schema(schema), context)
 
     for key, value in errors.items():
         if not value:
@@ -277,41 +369,17 @@ def validate_flattened(data, schema, context=None):
 
 def _validate(data, schema, context):
     '''validate a flattened dict against a schema'''
-    converted_data = augment_data(data, schema)
-    full_schema = make_full_schema(data, schema)
+    schema = compile_schema(schema)
+    key_combinations = schema.key_combinations(data)
+    full_schema = schema.full_schema(data, key_combinations)
+    converted_data = _augment_data(data, schema, key_combinations,
+                                   full_schema)
 
     errors = dict((key, []) for key in full_schema)
 
-    ## before run
-    for key in sorted(full_schema, key=flattened_order_key):
-        if key[-1] == '__before':
-            for converter in full_schema[key]:
-                try:
-                    convert(converter, key, converted_data, errors, context)
-                except StopOnError:
-                    break
-
-    ## main run
-    for key in sorted(full_schema, key=flattened_order_key):
-        if not key[-1].startswith('__'):
-            for converter in full_schema[key]:
-                try:
-                    convert(converter, key, converted_data, errors, context)
-                except StopOnError:
-                    break
-
-    ## extras run
-    for key in sorted(full_schema, key=flattened_order_key):
-        if key[-1] == '__extras':
-            for converter in full_schema[key]:
-                try:
-                    convert(converter, key, converted_data, errors, context)
-                except StopOnError:
-                    break
-
-    ## after run
-    for key in reversed(sorted(full_schema, key=flattened_order_key)):
-        if key[-1] == '__after':
+    ## before, main, extras and after runs
+    for keys in schema.run_order(full_schema):
+        for key in keys:
             for converter in full_schema[key]:
                 try:
                     convert(converter, key, converted_data, errors, context)
@@ -0,0 +1,280 @@
+'''Storage and invalidation for the page cache.
+
+The page cache (``ckan.page_cache_enabled``) keeps the pages that anonymous
+users get, see :py:class:`ckan.config.middleware.PageCacheMiddleware`. Each
+page is kept for the time to live of its route and is tagged with the objects
+it shows:
+
+* ``dataset:<id>``, ``organization:<id>`` and ``group:<id>`` for the pages of
+  a dataset (the dataset, its organization and its groups) and of a group or
+  organization,
+* ``site`` for every other page, e.g. the home page and the search pages,
+  which may show any dataset.
+
+When a change to the database is committed the pages of the tags it affects
+are purged (see :py:func:`changed_tags`). ``site`` pages are purged by every
+change, and changes to the site settings purge every page.
+
+The pages are kept in Redis (``ckan.page_cache.backend = redis``, the
+default), which shares them between all the CKAN processes, or in the memory
+of each process (``ckan.page_cache.backend = memory``), which is only
+suitable for a single process.
+
+'''
+import collections
+import json
+import logging
+import threading
+import time
+
+from paste.deploy.converters import asint
+from pylons import config
+
+log = logging.getLogger(__name__)
+
+SITE_TAG = 'site'
+ALL_TAG = 'all'
+
+DEFAULT_TTL = 300
+DEFAULT_MAX_ENTRIES = 1000
+DEFAULT_REDIS_URL = 'redis://localhost:6379/0'
+
+# Changes to the objects of these classes purge every cached page
+_ALL_PAGES_CLASSES = set(['SystemInfo'])
+
+
+class MemoryBackend(object):
+    '''Keeps the pages in the memory of the current process, dropping the
+    least recently used ones beyond ``max_entries``.'''
+
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries = collections.OrderedDict()
+        self._tags = collections.defaultdict(set)
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            try:
+                expires, tags, entry = self._entries.pop(key)
+            except KeyError:
+                return None
+            if expires <= time.time():
+                self._discard(key, tags)
+                return None
+            self._entries[key] = (expires, tags, entry)
+            return entry
+
+    def set(self, key, entry, ttl, tags):
+        with self._lock:
+            if key in self._entries:
+                self._discard(key, self._entries.pop(key)[1])
+            self._entries[key] = (time.time() + ttl, tags, entry)
+            for tag in tags:
+                self._tags[tag].add(key)
+            while len(self._entries) > self.max_entries:
+                old_key, (expires, old_tags, old_entry) = \
+                    self._entries.popitem(last=False)
+                self._discard(old_key, old_tags)
+
+    def purge(self, tags):
+        with self._lock:
+            if ALL_TAG in tags:
+                self._entries.clear()
+                self._tags.clear()
+                return
+            for tag in tags:
+                for key in self._tags.pop(tag, ()):
+                    entry = self._entries.pop(key, None)
+                    if entry is not None:
+                        self._discard(key, entry[1])
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._tags.clear()
+
+    def _discard(self, key, tags):
+        for tag in tags:
+            keys = self._tags.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tags[tag]
+
+
+class RedisBackend(object):
+    '''Keeps the pages in Redis. Each page is a hash that expires after its
+    time to live, and each tag a set of the keys of its pages.'''
+
+    prefix = 'ckan:page_cache:'
+
+    def __init__(self, url=DEFAULT_REDIS_URL, tag_ttl=DEFAULT_TTL):
+        import redis    # only import if used
+        self.redis = redis.StrictRedis.from_url(url)
+        self.error = redis.exceptions.RedisError
+        # the tag sets must live as long as the longest lived of their pages
+        self.tag_ttl = tag_ttl
+
+    def _page_key(self, key):
+        return self.prefix + 'page:' + key
+
+    def _tag_key(self, tag):
+        return self.prefix + 'tag:' + tag
+
+    def get(self, key):
+        try:
+            entry = self.redis.hgetall(self._page_key(key))
+        except self.error, e:
+            log.warning('Could not read from the page cache: %s', e)
+            return None
+        if not entry:
+            return None
+        entry['headers'] = json.loads(entry['headers'])
+        entry['stored'] = float(entry['stored'])
+        return entry
+
+    def set(self, key, entry, ttl, tags):
+        page_key = self._page_key(key)
+        values = dict(entry, headers=json.dumps(entry['headers']))
+        try:
+            pipe = self.redis.pipeline()
+            pipe.delete(page_key)
+            pipe.hmset(page_key, values)
+            pipe.expire(page_key, ttl)
+            for tag in tags:
+                pipe.sadd(self._tag_key(tag), key)
+                pipe.expire(self._tag_key(tag), max(ttl, self.tag_ttl))
+            pipe.execute()
+        except self.error, e:
+            log.warning('Could not write to the page cache: %s', e)
+
+    def purge(self, tags):
+        try:
+            if ALL_TAG in tags:
+                self.clear()
+                return
+            for tag in tags:
+                tag_key = self._tag_key(tag)
+                pipe = self.redis.pipeline()
+                pipe.smembers(tag_key)
+                pipe.delete(tag_key)
+                keys = pipe.execute()[0]
+                if keys:
+                    self.redis.delete(*[self._page_key(key) for key in keys])
+        except self.error, e:
+            log.warning('Could not purge the page cache: %s', e)
+
+    def clear(self):
+        # only our own keys, the database may be shared
+        keys = list(self.redis.scan_iter(self.prefix + '*'))
+        if keys:
+            self.redis.delete(*keys)
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def ttls():
+    '''Return the default time to live of the cached pages and a dict of
+    the times to live of particular routes, keyed by
+    ``<controller>.<action>``.'''
+    prefix = 'ckan.page_cache.ttl.'
+    route_ttls = dict((key[len(prefix):], asint(value))
+                      for key, value in config.items()
+                      if key.startswith(prefix))
+    return asint(config.get('ckan.page_cache.ttl', DEFAULT_TTL)), route_ttls
+
+
+def get_backend():
+    '''Return the page cache backend set up in the config.'''
+    global _backend
+    with _backend_lock:
+        if _backend is None:
+            name = config.get('ckan.page_cache.backend', 'redis')
+            if name == 'memory':
+                _backend = MemoryBackend(asint(config.get(
+                    'ckan.page_cache.max_entries', DEFAULT_MAX_ENTRIES)))
+            elif name == 'redis':
+                default_ttl, route_ttls = ttls()
+                _backend = RedisBackend(
+                    config.get('ckan.page_cache.redis_url',
+                               DEFAULT_REDIS_URL),
+                    max([default_ttl] + route_ttls.values()))
+            else:
+                raise ValueError('Unknown page cache backend: %s' % name)
+    return _backend
+
+
+def reset_backend():
+    '''Forget the backend, so that the next call to get_backend() sets up a
+    new one from the config.'''
+    global _backend
+    with _backend_lock:
+        _backend = None
+
+
+def dataset_tags(pkg_dict):
+    '''Return the tags of the page of a dataset.'''
+    tags = ['dataset:%s' % pkg_dict['id']]
+    if pkg_dict.get('owner_org'):
+        tags.append('organization:%s' % pkg_dict['owner_org'])
+    for group in pkg_dict.get('groups') or []:
+        if group.get('id'):
+            tags.append('group:%s' % group['id'])
+    return tags
+
+
+def group_tags(group_dict):
+    '''Return the tags of the page of a group or organization.'''
+    # its page lists datasets, which may change at any time
+    kind = 'organization' if group_dict.get('is_organization') else 'group'
+    return ['%s:%s' % (kind, group_dict['id']), SITE_TAG]
+
+
+def changed_tags(objects):
+    '''Return the tags of the cached pages that a change to the given
+    domain objects affects.'''
+    if not objects:
+        return set()
+    tags = set([SITE_TAG])
+    for obj in objects:
+        class_name = obj.__class__.__name__
+        if class_name in _ALL_PAGES_CLASSES:
+            tags.add(ALL_TAG)
+        elif class_name == 'Package':
+            tags.add('dataset:%s' % obj.id)
+        elif class_name in ('Resource', 'PackageTag', 'PackageExtra'):
+            tags.add('dataset:%s' % obj.package_id)
+        elif class_name == 'Group':
+            kind = 'organization' if obj.is_organization else 'group'
+            tags.add('%s:%s' % (kind, obj.id))
+        elif class_name == 'GroupExtra':
+            # the group may be an organization
+            tags.add('group:%s' % obj.group_id)
+            tags.add('organization:%s' % obj.group_id)
+        elif class_name == 'Member' and obj.table_name == 'package':
+            tags.add('dataset:%s' % obj.table_id)
+    return tags
+
+
+def purge_changed(objects):
+    '''Purge the cached pages that a change to the given domain objects
+    affects.'''
+    tags = changed_tags(objects)
+    if tags:
+        log.debug('Purging the cached pages tagged %s', ', '.join(tags))
+        get_backend().purge(tags)
+
+
+def etag_matches(if_none_match, etag):
+    '''Return True if the value of an If-None-Match request header matches
+    the given entity tag.'''
+    if not if_none_match or not etag:
+        return False
+    if if_none_match.strip() == '*':
+        return True
+    # weak comparison, as it is only used for GET and HEAD requests
+    strip = lambda tag: tag.strip().replace('W/', '', 1).strip('"')
+    return strip(etag) in [strip(tag) for tag in if_none_match.split(',')]
@@ -0,0 +1,114 @@
+'''A cache of the data that permission checks need.
+
+Checking a user's permissions for a group or organization needs the user's
+memberships and the group hierarchy. They are loaded once per database
+session, i.e. once per request, with::
+
+    memberships = permission_cache.get(('memberships', user_id), load)
+
+When ``ckan.permission_cache_ttl`` is set they are also shared between the
+requests a process handles for that many seconds; this is off by default.
+The values loaded in a session are dropped when the session flushes changes
+to memberships or groups (e.g. by ``member_create`` or ``member_delete``),
+and the shared values when such changes are committed. Changes committed by
+other processes are only seen once the shared values expire.
+
+'''
+import collections
+import itertools
+import threading
+import time
+
+from paste.deploy.converters import asint
+from pylons import config
+
+DEFAULT_TTL = 0
+DEFAULT_SIZE = 1000
+
+_SESSION_KEY = 'ckan.permissions'
+_SESSION_CHANGED_KEY = 'ckan.permissions_changed'
+
+_shared = collections.OrderedDict()
+_shared_lock = threading.Lock()
+# counts invalidations, so that values loaded before one are not shared
+_generation = 0
+
+
+def _ttl():
+    return asint(config.get('ckan.permission_cache_ttl', DEFAULT_TTL))
+
+
+def _changes_permissions(objects):
+    # groups, and the memberships of users and groups (not datasets)
+    for obj in objects:
+        class_name = obj.__class__.__name__
+        if class_name == 'Group' or \
+                class_name == 'Member' and obj.table_name != 'package':
+            return True
+    return False
+
+
+def get(key, load):
+    '''Return the value for the given key, calling ``load`` to load it if
+    it is not cached.'''
+    import ckan.model as model
+    session = model.Session()
+    values = session.info.setdefault(_SESSION_KEY, {})
+    if key in values:
+        return values[key]
+
+    # values loaded after this session changed permissions may never be
+    # committed, so they are not shared
+    share = _ttl() > 0 and not session.info.get(_SESSION_CHANGED_KEY)
+    if share:
+        with _shared_lock:
+            generation = _generation
+            entry = _shared.pop(key, None)
+            if entry is not None and entry[0] > time.time():
+                _shared[key] = entry
+                values[key] = entry[1]
+                return entry[1]
+
+    value = load()
+    values[key] = value
+    if share:
+        with _shared_lock:
+            if generation == _generation:
+                _shared[key] = (time.time() + _ttl(), value)
+                size = asint(config.get('ckan.permission_cache_size',
+                                        DEFAULT_SIZE))
+                while len(_shared) > size:
+                    _shared.popitem(last=False)
+    return value
+
+
+def invalidate():
+    '''Drop all the shared values.'''
+    global _generation
+    with _shared_lock:
+        _generation += 1
+        _shared.clear()
+
+
+def flushed(session):
+    '''Drop the values loaded in the session if the changes it flushed
+    change permissions.'''
+    if _changes_permissions(itertools.chain(session.new, session.dirty,
+                                            session.deleted)):
+        session.info.pop(_SESSION_KEY, None)
+        session.info[_SESSION_CHANGED_KEY] = True
+
+
+def committed(session, objects):
+    '''Drop the shared values if the committed changes to the given objects
+    change permissions.'''
+    session.info.pop(_SESSION_CHANGED_KEY, None)
+    if _changes_permissions(objects):
+        invalidate()
+
+
+def rolled_back(session):
+    '''Drop the values loaded in the session, they may reflect changes that
+    have been rolled back.'''
+    session.info.pop(_SESSION_KEY, None)
+    session.info.pop(_SESSION_CHANGED_KEY, None)
@@ -0,0 +1,216 @@
+'''An opt-in profiler of the action calls made while handling a request.
+
+When ``ckan.action_profiler.enabled`` is on, every request records the
+actions it called (through :py:func:`ckan.logic.get_action`), how they were
+nested, how long each took and how many SQL statements and Solr calls each
+made. At the end of the request the totals are added to the response as
+``X-CKAN-Actions``, ``X-CKAN-Queries``, ``X-CKAN-Solr-Calls`` and
+``X-CKAN-Action-Time`` headers, the whole profile is logged as one JSON line
+and it is kept in a per-process buffer of the latest profiles, which
+sysadmins can see with the ``action_profile_list`` action.
+
+'''
+import collections
+import contextlib
+import datetime
+import json
+import logging
+import threading
+import time
+
+from paste.deploy.converters import asbool, asint
+from pylons import config
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+log = logging.getLogger(__name__)
+
+_local = threading.local()
+
+_profiles = None
+_profiles_lock = threading.Lock()
+
+_listening = False
+_listening_lock = threading.Lock()
+
+
+class RequestProfile(object):
+    '''The action calls made while handling one request.'''
+
+    def __init__(self, method=None, url=None):
+        self.method = method
+        self.url = url
+        self.timestamp = datetime.datetime.utcnow()
+        self.started = time.time()
+        self.duration = None
+        self.queries = 0
+        self.solr_calls = 0
+        self.calls = []
+        self._stack = []
+
+    def enter(self, action_name):
+        call = {
+            'action': action_name,
+            'depth': len(self._stack),
+            'parent': self._stack[-1]['index'] if self._stack else None,
+            'index': len(self.calls),
+            'queries': 0,
+            'solr_calls': 0,
+            'started': time.time(),
+            'duration': None,
+        }
+        self.calls.append(call)
+        self._stack.append(call)
+        return call
+
+    def exit(self, call):
+        call['duration'] = time.time() - call.pop('started')
+        # the call may not be on top if an inner call was left unfinished
+        while self._stack:
+            if self._stack.pop() is call:
+                break
+
+    def count_query(self):
+        self.queries += 1
+        for call in self._stack:
+            call['queries'] += 1
+
+    def count_solr_call(self):
+        self.solr_calls += 1
+        for call in self._stack:
+            call['solr_calls'] += 1
+
+    def finish(self):
+        self.duration = time.time() - self.started
+        self._stack = []
+
+    @property
+    def action_time(self):
+        '''The total time spent in the outermost action calls.'''
+        return sum(call['duration'] or 0 for call in self.calls
+                   if call['depth'] == 0)
+
+    def as_dict(self):
+        return {
+            'method': self.method,
+            'url': self.url,
+            'timestamp': self.timestamp.isoformat(),
+            'duration': self.duration,
+            'action_time': self.action_time,
+            'queries': self.queries,
+            'solr_calls': self.solr_calls,
+            'calls': [dict((key, value) for key, value in call.iteritems()
+                           if key != 'started')
+                      for call in self.calls],
+        }
+
+
+def enabled():
+    return asbool(config.get('ckan.action_profiler.enabled', False))
+
+
+def _buffer():
+    global _profiles
+    with _profiles_lock:
+        if _profiles is None:
+            size = asint(config.get('ckan.action_profiler.buffer_size', 100))
+            _profiles = collections.deque(maxlen=size)
+    return _profiles
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context,
+                           executemany):
+    profile = current()
+    if profile is not None:
+        profile.count_query()
+
+
+def _listen():
+    # one listener serves every engine and thread, it counts the statements
+    # towards the profile of the request the executing thread is handling
+    global _listening
+    with _listening_lock:
+        if not _listening:
+            event.listen(Engine, 'before_cursor_execute',
+                         _before_cursor_execute)
+            _listening = True
+
+
+def current():
+    '''Return the profile of the request the current thread is handling,
+    or None if it is not being profiled.'''
+    return getattr(_local, 'profile', None)
+
+
+def start(method=None, url=None):
+    '''Start profiling the request the current thread is handling, if the
+    profiler is enabled, and return its profile.'''
+    if not enabled():
+        _local.profile = None
+        return None
+    _listen()
+    _local.profile = RequestProfile(method, url)
+    return _local.profile
+
+
+def finish():
+    '''Stop profiling the current request, keep and log its profile and
+    return it (None if it was not being profiled).'''
+    profile = current()
+    if profile is None:
+        return None
+    _local.profile = None
+    profile.finish()
+    profile_dict = profile.as_dict()
+    _buffer().append(profile_dict)
+    log.info(json.dumps(profile_dict))
+    return profile
+
+
+def discard():
+    '''Stop profiling the current request without keeping its profile.'''
+    _local.profile = None
+
+
+def headers(profile):
+    '''Return the response headers that summarize a request profile.'''
+    return {
+        'X-CKAN-Actions': str(len(profile.calls)),
+        'X-CKAN-Queries': str(profile.queries),
+        'X-CKAN-Solr-Calls': str(profile.solr_calls),
+        'X-CKAN-Action-Time': '%.3f' % profile.action_time,
+    }
+
+
+@contextlib.contextmanager
+def action(action_name):
+    '''Record a call to the given action for the duration of a ``with``
+    block, if the current request is being profiled.'''
+    profile = current()
+    if profile is None:
+        yield
+        return
+    call = profile.enter(action_name)
+    try:
+        yield
+    finally:
+        profile.exit(call)
+
+
+def count_solr_call():
+    profile = current()
+    if profile is not None:
+        profile.count_solr_call()
+
+
+def profiles():
+    '''Return the latest request profiles kept by this process, newest
+    first.'''
+    return list(reversed(_buffer()))
+
+
+def clear():
+    '''Forget the request profiles kept by this process.'''
+    global _profiles
+    with _profiles_lock:
+        _profiles = None
@@ -1,5 +1,6 @@
 import logging
 import sys
+import time
 import cgitb
 import warnings
 import xml.dom.minidom
@@ -32,7 +33,11 @@ def text_traceback():
 
 SIMPLE_SEARCH = asbool(config.get('ckan.simple_search', False))
 
-SUPPORTED_SCHEMA_VERSIONS = ['2.3']
+SUPPORTED_SCHEMA_VERSIONS = ['2.3', '2.5']
+
+# The schema versions storing every field that is not a copyField
+# destination, so that documents can be updated atomically
+ATOMIC_UPDATES_SCHEMA_VERSIONS = ['2.5']
 
 DEFAULT_OPTIONS = {
     'limit': 20,
@@ -60,7 +65,7 @@ SOLR_SCHEMA_FILE_OFFSET = '/admin/file/?file=schema.xml'
 
 if SIMPLE_SEARCH:
     import sql as sql
-    _INDICES['package'] = NoopSearchIndex
+    _INDICES['package'] = sql.PackageSearchIndex
     _QUERIES['package'] = sql.PackageSearchQuery
 
 
@@ -135,7 +140,8 @@ class SynchronousSearchPlugin(p.SingletonPlugin):
             log.warn("Discarded Sync. indexing for: %s" % entity)
 
 
-def rebuild(package_id=None, only_missing=False, force=False, refresh=False, defer_commit=False, package_ids=None):
+def rebuild(package_id=None, only_missing=False, force=False, refresh=False,
+            defer_commit=False, package_ids=None, batch_size=None):
     '''
         Rebuilds the search index.
 
@@ -144,6 +150,10 @@ def rebuild(package_id=None, only_missing=False, force=False, refresh=False, def
         datasets not already indexed will be processed. If force equals
         True, if an exception is found, the exception will be logged, but
         the process will carry on.
+
+        If batch_size is provided, datasets are sent to Solr in batches of
+        that size, using a single connection for the whole rebuild and one
+        request per batch, rather than one request per dataset.
     '''
     log.info("Rebuilding search index...")
 
@@ -157,51 +167,147 @@ def rebuild(package_id=None, only_missing=False, force=False, refresh=False, def
         log.info('Indexing just package %r...', pkg_dict['name'])
         package_index.remove_dict(pkg_dict)
         package_index.insert_dict(pkg_dict)
-    elif package_ids:
+    elif package_ids and not batch_size:
         for package_id in package_ids:
             pkg_dict = logic.get_action('package_show')(context,
                 {'id': package_id})
             log.info('Indexing just package %r...', pkg_dict['name'])
             package_index.update_dict(pkg_dict, True)
     else:
-        package_ids = [r[0] for r in model.Session.query(model.Package.id).
-                       filter(model.Package.state != 'deleted').all()]
-        if only_missing:
-            log.info('Indexing only missing packages...')
-            package_query = query_for(model.Package)
-            indexed_pkg_ids = set(package_query.get_all_entity_ids(
-                max_results=len(package_ids)))
-            # Packages not indexed
-            package_ids = set(package_ids) - indexed_pkg_ids
-
-            if len(package_ids) == 0:
-                log.info('All datasets are already indexed')
-                return
+        if not package_ids:
+            package_ids = [r[0] for r in model.Session.query(model.Package.id).
+                           filter(model.Package.state != 'deleted').all()]
+            if only_missing:
+                log.info('Indexing only missing packages...')
+                package_query = query_for(model.Package)
+                indexed_pkg_ids = set(package_query.get_all_entity_ids(
+                    max_results=len(package_ids)))
+                # Packages not indexed
+                package_ids = set(package_ids) - indexed_pkg_ids
+
+                if len(package_ids) == 0:
+                    log.info('All datasets are already indexed')
+                    return
+            else:
+                log.info('Rebuilding the whole index...')
+                # When refreshing, the index is not previously cleared
+                if not refresh:
+                    package_index.clear()
+
+        if batch_size:
+            _rebuild_in_batches(package_index, list(package_ids), batch_size,
+                                force, defer_commit)
         else:
-            log.info('Rebuilding the whole index...')
-            # When refreshing, the index is not previously cleared
-            if not refresh:
-                package_index.clear()
+            for pkg_id in package_ids:
+                try:
+                    package_index.update_dict(
+                        logic.get_action('package_show')(context,
+                            {'id': pkg_id}
+                        ),
+                        defer_commit
+                    )
+                except Exception, e:
+                    log.error('Error while indexing dataset %s: %s' %
+                              (pkg_id, str(e)))
+                    if force:
+                        log.error(text_traceback())
+                        continue
+                    else:
+                        raise
+
+    model.Session.commit()
+    log.info('Finished rebuilding search index.')
+
+
+def _index_batch(package_index, context, package_ids, conn):
+    '''Index the given datasets together, returning the number of documents
+    indexed.'''
+    pkg_dicts = _package_show_list(context, package_ids)
+    if hasattr(package_index, 'index_packages'):
+        return package_index.index_packages(
+            pkg_dicts, defer_commit=True, conn=conn)
+    for pkg_dict in pkg_dicts:
+        package_index.update_dict(pkg_dict)
+    return len(pkg_dicts)
+
+
+def _package_show_list(context, package_ids):
+    '''Return the dicts of the given datasets as package_show would (without
+    validation), dictizing all of them with a fixed number of queries.'''
+    from ckan.lib.dictization.model_dictize import package_list_dictize
+
+    pkg_dicts = package_list_dictize(package_ids, context)
+    for pkg_dict in pkg_dicts:
+        for item in p.PluginImplementations(p.IPackageController):
+            item.read(model.Package.get(pkg_dict['id']))
+
+        for resource_dict in pkg_dict['resources']:
+            for item in p.PluginImplementations(p.IResourceController):
+                resource_dict = item.before_show(resource_dict)
+
+        for item in p.PluginImplementations(p.IPackageController):
+            item.after_show(context, pkg_dict)
+    return pkg_dicts
+
+
+def _rebuild_in_batches(package_index, package_ids, batch_size, force,
+                        defer_commit):
+    '''Index the given datasets sending batch_size documents per request
+    to Solr, over a single connection (or, with the SQL backend, writing
+    batch_size documents per transaction).'''
+    context = {'model': model, 'ignore_auth': True, 'validate': False,
+        'use_cache': False}
+    batch_size = int(batch_size)
+    total = len(package_ids)
+    indexed = 0
+    started = time.time()
+
+    conn = make_connection() if isinstance(
+        package_index, PackageSearchIndex) else None
+    try:
+        for batch_start in xrange(0, total, batch_size):
+            batch_ids = package_ids[batch_start:batch_start + batch_size]
+            batch_started = time.time()
 
-        for pkg_id in package_ids:
             try:
-                package_index.update_dict(
-                    logic.get_action('package_show')(context,
-                        {'id': pkg_id}
-                    ),
-                    defer_commit
-                )
+                count = _index_batch(package_index, context, batch_ids, conn)
             except Exception, e:
-                log.error('Error while indexing dataset %s: %s' %
-                          (pkg_id, str(e)))
-                if force:
-                    log.error(text_traceback())
-                    continue
-                else:
+                log.error('Error while indexing batch of datasets %s: %s' %
+                          (', '.join(batch_ids), str(e)))
+                if not force:
                     raise
-
-    model.Session.commit()
-    log.info('Finished rebuilding search index.')
+                log.error(text_traceback())
+                # index the datasets of the batch one at a time, so only
+                # the ones that fail are left out
+                model.Session.rollback()
+                count = 0
+                for pkg_id in batch_ids:
+                    try:
+                        count += _index_batch(package_index, context,
+                                              [pkg_id], conn)
+                    except Exception, e:
+                        log.error('Error while indexing dataset %s: %s' %
+                                  (pkg_id, str(e)))
+                        log.error(text_traceback())
+                        model.Session.rollback()
+
+            indexed += count
+            elapsed = time.time() - batch_started
+            log.info('Indexed %d datasets in %.2fs (%.1f datasets/s), '
+                     '%d/%d done', count, elapsed,
+                     count / elapsed if elapsed else 0,
+                     min(batch_start + batch_size, total), total)
+
+        if conn is not None and not defer_commit and asbool(
+                config.get('ckan.search.solr_commit', 'true')):
+            conn.commit(wait_searcher=False)
+    finally:
+        if conn is not None:
+            conn.close()
+
+    elapsed = time.time() - started
+    log.info('Indexed %d datasets in %.2fs (%.1f datasets/s)', indexed,
+             elapsed, indexed / elapsed if elapsed else 0)
 
 
 def commit():
@@ -231,13 +337,35 @@ def show(package_reference):
     return package_query.get_index(package_reference)
 
 
+def iter_package_search(context, data_dict, page_size=1000):
+    '''Yield all the datasets matching a package_search, one by one.
+
+    The results are fetched ``page_size`` at a time with a search cursor, so
+    the whole result set can be walked without holding it in memory or
+    paging to deep offsets. ``rows`` and ``start`` are ignored and facets
+    are not computed.
+    '''
+    data_dict = dict(data_dict)
+    data_dict.pop('start', None)
+    data_dict.update({'rows': page_size, 'cursor': '*', 'facet': 'false'})
+
+    package_search = logic.get_action('package_search')
+    while True:
+        result = package_search(dict(context), dict(data_dict))
+        for package_dict in result['results']:
+            yield package_dict
+        if not result['next_cursor']:
+            break
+        data_dict['cursor'] = result['next_cursor']
+
+
 def clear(package_reference=None):
     package_index = index_for(model.Package)
     if package_reference:
         log.debug("Clearing search index for dataset %s..." %
                   package_reference)
         package_index.delete_package({'id': package_reference})
-    elif not SIMPLE_SEARCH:
+    else:
         log.debug("Clearing search index...")
         package_index.clear()
 
@@ -273,7 +401,26 @@ def check_solr_schema_version(schema_file=None):
         log.warn('Problems were found while connecting to the SOLR server')
         return False
 
-    # Try to get the schema XML file to extract the version
+    version = get_solr_schema_version(schema_file)
+
+    if not version in SUPPORTED_SCHEMA_VERSIONS:
+        raise SearchError('SOLR schema version not supported: %s. Supported'
+                          ' versions are [%s]'
+                          % (version, ', '.join(SUPPORTED_SCHEMA_VERSIONS)))
+    return True
+
+
+def get_solr_schema_version(schema_file=None):
+    '''
+        Returns the version of the schema of the SOLR server, read from the
+        schema XML file as check_solr_schema_version() does.
+
+        A SearchError exception will be thrown if the version could not be
+        extracted.
+
+        :schema_file: Absolute path to an alternative schema file. Should
+                      be only used for testing purposes (Default is None)
+    '''
     if not schema_file:
         solr_url, solr_user, solr_password = SolrSettings.get()
 
@@ -299,9 +446,4 @@ def check_solr_schema_version(schema_file=None):
     if not len(version):
         raise SearchError('Could not extract version info from the SOLR'
                           ' schema, using file: \n%s' % url)
-
-    if not version in SUPPORTED_SCHEMA_VERSIONS:
-        raise SearchError('SOLR schema version not supported: %s. Supported'
-                          ' versions are [%s]'
-                          % (version, ', '.join(SUPPORTED_SCHEMA_VERSIONS)))
-    return True
+    return version
@@ -1,5 +1,15 @@
-from pylons import config
+import contextlib
+import httplib
 import logging
+import os
+import socket
+import threading
+import time
+
+from pylons import config
+
+import ckan.lib.profiler as profiler
+
 log = logging.getLogger(__name__)
 
 
@@ -16,6 +26,10 @@ class SearchQueryError(SearchError):
 
 DEFAULT_SOLR_URL = 'http://127.0.0.1:8983/solr'
 
+DEFAULT_SOLR_POOL_SIZE = 10
+DEFAULT_SOLR_POOL_TIMEOUT = 10
+DEFAULT_SOLR_POOL_MAX_IDLE = 30
+
 
 class SolrSettings(object):
     _is_initialised = False
@@ -32,6 +46,8 @@ class SolrSettings(object):
         else:
             cls._url = DEFAULT_SOLR_URL
         cls._is_initialised = True
+        # connections to the old URL must not be reused
+        reset_connection_pool()
 
     @classmethod
     def get(cls):
@@ -47,24 +63,226 @@ def is_available():
     Return true if we can successfully connect to Solr.
     """
     try:
-        conn = make_connection()
-        conn.query("*:*", rows=1)
+        with solr_connection() as conn:
+            conn.query("*:*", rows=1)
     except Exception, e:
         log.exception(e)
         return False
-    finally:
-        if 'conn' in dir():
-            conn.close()
 
     return True
 
 
 def make_connection():
+    '''Return a new connection to Solr.
+
+    Most callers should use ``solr_connection()`` instead, which reuses the
+    connections of a pool.
+    '''
     from solr import SolrConnection
     solr_url, solr_user, solr_password = SolrSettings.get()
     assert solr_url is not None
+    kwargs = {}
+    timeout = config.get('ckan.search.solr_timeout')
+    if timeout:
+        kwargs['timeout'] = float(timeout)
     if solr_user is not None and solr_password is not None:
-        return SolrConnection(solr_url, http_user=solr_user,
-                              http_pass=solr_password)
-    else:
-        return SolrConnection(solr_url)
+        kwargs.update({'http_user': solr_user, 'http_pass': solr_password})
+    return SolrConnection(solr_url, **kwargs)
+
+
+class SolrConnectionPool(object):
+    '''A thread-safe pool of keep-alive connections to Solr.
+
+    Connections are checked out with ``connection()`` and returned to the
+    pool afterwards, so requests don't pay for a new TCP (and TLS)
+    connection to Solr each time. At most ``size`` connections are open at
+    once; when all of them are in use, callers wait up to ``timeout``
+    seconds for one to be returned. Connections idle for longer than
+    ``max_idle`` seconds, which Solr may have closed already, and connections
+    that failed with a network error are closed rather than reused.
+
+    :param size: the maximum number of connections, or 0 to open a new
+        connection every time
+    :param timeout: how long in seconds to wait for a free connection
+    :param max_idle: how long in seconds a connection can stay idle in the
+        pool
+
+    '''
+    def __init__(self, size=None, timeout=None, max_idle=None):
+        if size is None:
+            size = config.get('ckan.search.solr_pool_size',
+                              DEFAULT_SOLR_POOL_SIZE)
+        if timeout is None:
+            timeout = config.get('ckan.search.solr_pool_timeout',
+                                 DEFAULT_SOLR_POOL_TIMEOUT)
+        if max_idle is None:
+            max_idle = config.get('ckan.search.solr_pool_max_idle',
+                                  DEFAULT_SOLR_POOL_MAX_IDLE)
+        self.size = int(size)
+        self.timeout = float(timeout)
+        self.max_idle = float(max_idle)
+        self.pid = os.getpid()
+        self.closed = False
+
+        # the idle connections as (connection, returned at) pairs, the most
+        # recently returned last
+        self._idle = []
+        self._open = 0
+        self._condition = threading.Condition()
+        self._stats = {
+            'checkouts': 0,
+            'connections_opened': 0,
+            'connections_evicted': 0,
+            'checkout_timeouts': 0,
+            'total_wait_time': 0.0,
+            'max_wait_time': 0.0,
+        }
+
+    @contextlib.contextmanager
+    def connection(self):
+        '''Check out a connection for the duration of a ``with`` block.'''
+        conn = self.checkout()
+        broken = False
+        try:
+            yield conn
+        except (socket.error, httplib.HTTPException):
+            broken = True
+            raise
+        finally:
+            self.checkin(conn, broken)
+
+    def checkout(self):
+        '''Return an idle connection, or a new one if there are none and
+        the pool is not full.
+
+        Raises SearchError if no connection becomes free within the pool's
+        timeout.
+        '''
+        started = time.time()
+        conn = None
+        with self._condition:
+            while True:
+                conn = self._pop_idle()
+                if conn is not None or self._open < self.size or \
+                        not self.size:
+                    break
+                remaining = started + self.timeout - time.time()
+                if remaining <= 0:
+                    self._stats['checkout_timeouts'] += 1
+                    raise SearchError(
+                        'Timed out after %.1fs waiting for a Solr connection '
+                        '(%d in use)' % (self.timeout, self._open))
+                self._condition.wait(remaining)
+
+            if conn is None:
+                self._open += 1
+                self._stats['connections_opened'] += 1
+            waited = time.time() - started
+            self._stats['checkouts'] += 1
+            self._stats['total_wait_time'] += waited
+            self._stats['max_wait_time'] = max(self._stats['max_wait_time'],
+                                               waited)
+        if waited > 0.1:
+            log.debug('Waited %.2fs for a Solr connection', waited)
+
+        if conn is None:
+            try:
+                conn = make_connection()
+            except Exception:
+                self._release()
+                raise
+        return conn
+
+    def checkin(self, conn, broken=False):
+        '''Return a connection to the pool, or close it if it is broken or
+        the pool is disabled.'''
+        if (broken or not self.size or self.closed or
+                os.getpid() != self.pid):
+            conn.close()
+            self._release()
+            return
+        with self._condition:
+            self._idle.append((conn, time.time()))
+            self._condition.notify()
+
+    def close(self):
+        '''Close all the idle connections. Connections still checked out
+        are closed when they are returned.'''
+        with self._condition:
+            self.closed = True
+            idle, self._idle = self._idle, []
+            self._open -= len(idle)
+            self._condition.notify_all()
+        for conn, returned in idle:
+            conn.close()
+
+    def stats(self):
+        '''Return a dict of the pool's counters, including the time spent
+        waiting to check out connections.'''
+        with self._condition:
+            stats = dict(self._stats)
+            stats['open'] = self._open
+            stats['idle'] = len(self._idle)
+        stats['mean_wait_time'] = (stats['total_wait_time'] /
+                                   stats['checkouts']
+                                   if stats['checkouts'] else 0.0)
+        return stats
+
+    def _pop_idle(self):
+        '''Return the most recently used idle connection, closing the ones
+        that have been idle for too long. Must be called with the lock
+        held.'''
+        now = time.time()
+        while self._idle:
+            conn, returned = self._idle.pop()
+            if now - returned <= self.max_idle:
+                return conn
+            self._open -= 1
+            self._stats['connections_evicted'] += 1
+            try:
+                conn.close()
+            except Exception, e:
+                log.debug('Error closing idle Solr connection: %r', e)
+        return None
+
+    def _release(self):
+        with self._condition:
+            self._open -= 1
+            self._condition.notify()
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def connection_pool():
+    '''Return the Solr connection pool of this process.
+
+    Each worker process gets its own pool, as connections opened before a
+    fork can't be shared.
+    '''
+    global _pool
+    with _pool_lock:
+        if _pool is None or _pool.pid != os.getpid():
+            _pool = SolrConnectionPool()
+        return _pool
+
+
+def reset_connection_pool():
+    '''Close the idle connections of the pool and start a new one.'''
+    global _pool
+    with _pool_lock:
+        pool, _pool = _pool, None
+    if pool is not None and pool.pid == os.getpid():
+        pool.close()
+
+
+def solr_connection():
+    '''Check out a connection to Solr from the pool, for use as::
+
+        with solr_connection() as conn:
+            conn.query('*:*')
+
+    '''
+    profiler.count_solr_call()
+    return connection_pool().connection()
@@ -2,6 +2,7 @@ import socket
 import string
 import logging
 import collections
+import hashlib
 import json
 import datetime
 from dateutil.parser import parse
@@ -13,7 +14,7 @@ import solr
 from pylons import config
 from paste.deploy.converters import asbool
 
-from common import SearchIndexError, make_connection
+from common import SearchIndexError, SolrSettings, solr_connection
 from ckan.model import PackageRelationship
 import ckan.model as model
 from ckan.plugins import (PluginImplementations,
@@ -44,23 +45,31 @@ def escape_xml_illegal_chars(val, replacement=''):
     return _illegal_xml_chars_re.sub(replacement, val)
 
 
+def _connection_error(e):
+    '''Return the SearchIndexError for a network error talking to Solr.
+
+    Network errors must be converted outside the ``with solr_connection()``
+    block, so that the pool discards the connection that failed.
+    '''
+    err = 'Could not connect to Solr using {0}: {1}'.format(
+        SolrSettings.get()[0], str(e))
+    log.error(err)
+    return SearchIndexError(err)
+
+
 def clear_index():
     import solr.core
-    conn = make_connection()
     query = "+site_id:\"%s\"" % (config.get('ckan.site_id'))
     try:
-        conn.delete_query(query)
-        conn.commit()
+        with solr_connection() as conn:
+            conn.delete_query(query)
+            conn.commit()
     except socket.error, e:
-        err = 'Could not connect to SOLR %r: %r' % (conn.url, e)
-        log.error(err)
-        raise SearchIndexError(err)
+        raise _connection_error(e)
     except solr.core.SolrException, e:
-        err = 'SOLR %r exception: %r' % (conn.url, e)
+        err = 'SOLR %r exception: %r' % (SolrSettings.get()[0], e)
         log.error(err)
         raise SearchIndexError(err)
-    finally:
-        conn.close()
 
 class SearchIndex(object):
     """
@@ -106,6 +115,135 @@ class PackageSearchIndex(SearchIndex):
         if pkg_dict is None:
             return
 
+        solr_dict = self._solr_document(pkg_dict)
+        if solr_dict is None:
+            return self.delete_package(pkg_dict)
+        solr_dict = self._before_index(solr_dict)
+
+        # send to solr:
+        commit = not defer_commit
+        if not asbool(config.get('ckan.search.solr_commit', 'true')):
+            commit = False
+        try:
+            with solr_connection() as conn:
+                self._add_documents(conn, [solr_dict], commit)
+        except socket.error, e:
+            raise _connection_error(e)
+
+        commit_debug_msg = 'Not committed yet' if defer_commit else 'Committed'
+        log.debug('Updated index for %s [%s]' % (solr_dict.get('name'), commit_debug_msg))
+
+    def index_packages(self, pkg_dicts, defer_commit=False, conn=None):
+        '''Index several datasets with a single request to Solr.
+
+        The documents are built as in ``index_package`` and sent with one
+        ``add_many`` call. Datasets with no state or in the deleted state
+        are removed from the index instead.
+
+        If a ``conn`` is given it is used (and left open) so several batches
+        can share the same Solr connection.
+
+        Returns the number of documents sent to Solr.
+        '''
+        solr_dicts = []
+        for pkg_dict in pkg_dicts:
+            if pkg_dict is None:
+                continue
+            solr_dict = self._solr_document(pkg_dict)
+            if solr_dict is None:
+                self.delete_package(pkg_dict)
+            else:
+                solr_dicts.append(solr_dict)
+
+        if not solr_dicts:
+            return 0
+
+        for item in PluginImplementations(IPackageController):
+            # plugins written before this hook existed may not inherit it
+            if hasattr(item, 'before_index_batch'):
+                item.before_index_batch(solr_dicts)
+        solr_dicts = [self._before_index(document)
+                      for document in solr_dicts]
+
+        commit = not defer_commit
+        if not asbool(config.get('ckan.search.solr_commit', 'true')):
+            commit = False
+        if conn is not None:
+            # network errors are left to the owner of the connection
+            self._add_documents(conn, solr_dicts, commit)
+        else:
+            try:
+                with solr_connection() as conn:
+                    self._add_documents(conn, solr_dicts, commit)
+            except socket.error, e:
+                raise _connection_error(e)
+
+        log.debug('Updated index for %d datasets [%s]' % (
+            len(solr_dicts), 'Not committed yet' if defer_commit else 'Committed'))
+        return len(solr_dicts)
+
+    def update_views(self, tracking_summaries, defer_commit=False):
+        '''Set the ``views_total`` and ``views_recent`` fields of indexed
+        datasets with a Solr atomic update, without rebuilding their
+        documents.
+
+        ``tracking_summaries`` is a dict of dataset ids to dicts with the
+        keys ``total`` and ``recent``, like the ones returned by
+        ``TrackingSummary.get_for_packages``. The datasets must be in the
+        index already.
+
+        Atomic updates need a Solr schema with all the fields that are not
+        copyField destinations stored, i.e. one of the
+        ``ATOMIC_UPDATES_SCHEMA_VERSIONS`` (schema version 2.5 or later), and
+        the update log enabled. Returns the number of documents updated.
+        '''
+        site_id = config.get('ckan.site_id')
+        docs = []
+        for package_id, tracking_summary in tracking_summaries.iteritems():
+            index_id = hashlib.md5('%s%s' % (package_id, site_id)).hexdigest()
+            docs.append(
+                u'<doc><field name="index_id">%s</field>'
+                u'<field name="views_total" update="set">%d</field>'
+                u'<field name="views_recent" update="set">%d</field></doc>'
+                % (index_id, tracking_summary['total'] or 0,
+                   tracking_summary['recent'] or 0))
+        if not docs:
+            return 0
+
+        query = None
+        if not defer_commit and asbool(
+                config.get('ckan.search.solr_commit', 'true')):
+            query = {'commit': 'true'}
+        try:
+            with solr_connection() as conn:
+                # solrpy has no API for atomic updates, so post the XML
+                # update message ourselves
+                conn._update(u'<add>%s</add>' % u''.join(docs), query)
+        except solr.core.SolrException, e:
+            msg = 'Solr returned an error: {0} {1} - {2}'.format(
+                e.httpcode, e.reason, e.body[:1000]  # limit huge responses
+            )
+            raise SearchIndexError(msg)
+        log.debug('Updated the views of %d datasets', len(docs))
+        return len(docs)
+
+    def _add_documents(self, conn, solr_dicts, commit):
+        # network errors are raised as they are, see _connection_error()
+        try:
+            conn.add_many(solr_dicts, _commit=commit)
+        except solr.core.SolrException, e:
+            msg = 'Solr returned an error: {0} {1} - {2}'.format(
+                e.httpcode, e.reason, e.body[:1000] # limit huge responses
+            )
+            raise SearchIndexError(msg)
+
+    def _solr_document(self, pkg_dict):
+        '''Turn a dataset dict (as returned by package_show) into the
+        document that gets sent to Solr.
+
+        Returns None if the dataset should not be in the index. The
+        before_index plugin hooks are not called here, see ``_before_index``.
+        '''
         # tracking summary values will be stale, never store them
         tracking_summary = pkg_dict.pop('tracking_summary', None)
         for r in pkg_dict.get('resources', []):
@@ -133,7 +271,7 @@ class PackageSearchIndex(SearchIndex):
 
         # delete the package if there is no state, or the state is `deleted`
         if (not pkg_dict.get('state') or 'deleted' in pkg_dict.get('state')):
-            return self.delete_package(pkg_dict)
+            return None
 
         index_fields = RESERVED_FIELDS + pkg_dict.keys()
 
@@ -273,58 +411,37 @@ class PackageSearchIndex(SearchIndex):
                 pass
 
         # add a unique index_id to avoid conflicts
-        import hashlib
         pkg_dict['index_id'] = hashlib.md5('%s%s' % (pkg_dict['id'],config.get('ckan.site_id'))).hexdigest()
 
+        return pkg_dict
+
+    def _before_index(self, pkg_dict):
+        '''Let the plugins modify a document built by ``_solr_document``.'''
         for item in PluginImplementations(IPackageController):
             pkg_dict = item.before_index(pkg_dict)
 
         assert pkg_dict, 'Plugin must return non empty package dict on index'
 
-        # send to solr:
-        try:
-            conn = make_connection()
-            commit = not defer_commit
-            if not asbool(config.get('ckan.search.solr_commit', 'true')):
-                commit = False
-            conn.add_many([pkg_dict], _commit=commit)
-        except solr.core.SolrException, e:
-            msg = 'Solr returned an error: {0} {1} - {2}'.format(
-                e.httpcode, e.reason, e.body[:1000] # limit huge responses
-            )
-            raise SearchIndexError(msg)
-        except socket.error, e:
-            err = 'Could not connect to Solr using {0}: {1}'.format(conn.url, str(e))
-            log.error(err)
-            raise SearchIndexError(err)
-        finally:
-            conn.close()
-
-        commit_debug_msg = 'Not committed yet' if defer_commit else 'Committed'
-        log.debug('Updated index for %s [%s]' % (pkg_dict.get('name'), commit_debug_msg))
+        return pkg_dict
 
     def commit(self):
         try:
-            conn = make_connection()
-            conn.commit(wait_searcher=False)
+            with solr_connection() as conn:
+                conn.commit(wait_searcher=False)
         except Exception, e:
             log.exception(e)
             raise SearchIndexError(e)
-        finally:
-            conn.close()
 
 
     def delete_package(self, pkg_dict):
-        conn = make_connection()
         query = "+%s:%s (+id:\"%s\" OR +name:\"%s\") +site_id:\"%s\"" % (TYPE_FIELD, PACKAGE_TYPE,
                                                        pkg_dict.get('id'), pkg_dict.get('id'),
                                                        config.get('ckan.site_id'))
         try:
-            conn.delete_query(query)
-            if asbool(config.get('ckan.search.solr_commit', 'true')):
-                conn.commit()
+            with solr_connection() as conn:
+                conn.delete_query(query)
+                if asbool(config.get('ckan.search.solr_commit', 'true')):
+                    conn.commit()
         except Exception, e:
             log.exception(e)
             raise SearchIndexError(e)
-        finally:
-            conn.close()
@@ -7,7 +7,7 @@ from paste.deploy.converters import asbool
 from paste.util.multidict import MultiDict
 
 from ckan.common import json
-from ckan.lib.search.common import make_connection, SearchError, SearchQueryError
+from ckan.lib.search.common import solr_connection, SearchError, SearchQueryError
 import ckan.logic as logic
 import ckan.model as model
 
@@ -18,9 +18,12 @@ _open_licenses = None
 VALID_SOLR_PARAMETERS = set([
     'q', 'fl', 'fq', 'rows', 'sort', 'start', 'wt', 'qf', 'bf', 'boost',
     'facet', 'facet.mincount', 'facet.limit', 'facet.field',
-    'extras', 'fq_list', 'tie', 'defType', 'mm'
+    'extras', 'fq_list', 'tie', 'defType', 'mm', 'cursorMark'
 ])
 
+# the number of ids fetched per request by get_all_entity_ids()
+ENTITY_IDS_PAGE_SIZE = 1000
+
 # for (solr) package searches, this specifies the fields that are searched
 # and their relative weighting
 QUERY_FIELDS = "name^4 title^4 tags^2 groups^2 text"
@@ -133,6 +136,7 @@ class SearchQuery(object):
     def __init__(self):
         self.results = []
         self.count = 0
+        self.next_cursor = None
 
     @property
     def open_licenses(self):
@@ -245,21 +249,50 @@ class ResourceSearchQuery(SearchQuery):
 
 
 class PackageSearchQuery(SearchQuery):
-    def get_all_entity_ids(self, max_results=1000):
+    def get_all_entity_ids(self, max_results=None):
         """
         Return a list of the IDs of all indexed packages.
-        """
-        query = "*:*"
-        fq = "+site_id:\"%s\" " % config.get('ckan.site_id')
-        fq += "+state:active "
 
-        conn = make_connection()
-        try:
-            data = conn.query(query, fq=fq, rows=max_results, fields='id')
-        finally:
-            conn.close()
+        The ids are fetched a page at a time with a Solr cursor (or by
+        offset on Solr versions older than 4.7, which have no cursors), so
+        this works on indexes of any size. Use ``max_results`` to limit the
+        number of ids returned.
+        """
+        query = {
+            'q': '*:*',
+            'fq': "+site_id:\"%s\" +state:active " % config.get('ckan.site_id'),
+            'fl': 'id',
+            'sort': 'index_id asc',
+            'cursorMark': '*',
+            'wt': 'json',
+        }
 
-        return [r.get('id') for r in data.results]
+        ids = []
+        with solr_connection() as conn:
+            while max_results is None or len(ids) < max_results:
+                query['rows'] = ENTITY_IDS_PAGE_SIZE
+                if max_results is not None:
+                    query['rows'] = min(query['rows'], max_results - len(ids))
+                try:
+                    data = json.loads(conn.raw_query(**query))
+                except SolrException, e:
+                    raise SearchError('SOLR returned an error running '
+                                      'query: %r Error: %r' %
+                                      (query, e.reason))
+                docs = data['response']['docs']
+                ids.extend(doc['id'] for doc in docs)
+                if not docs:
+                    break
+                next_cursor = data.get('nextCursorMark')
+                if next_cursor is None:
+                    # Solr without cursor support ignores cursorMark
+                    query['start'] = len(ids)
+                elif next_cursor == query['cursorMark']:
+                    break
+                else:
+                    query['cursorMark'] = next_cursor
+
+        return ids
 
     def get_index(self,reference):
         query = {
@@ -268,10 +301,10 @@ class PackageSearchQuery(SearchQuery):
             'wt': 'json',
             'fq': 'site_id:"%s"' % config.get('ckan.site_id')}
 
-        conn = make_connection()
         log.debug('Package query: %r' % query)
         try:
-            solr_response = conn.raw_query(**query)
+            with solr_connection() as conn:
+                solr_response = conn.raw_query(**query)
         except SolrException, e:
             raise SearchError('SOLR returned an error running query: %r Error: %r' %
                               (query, e.reason))
@@ -286,8 +319,6 @@ class PackageSearchQuery(SearchQuery):
             if not isinstance(e, SearchError):
                 log.exception(e)
             raise SearchError(e)
-        finally:
-            conn.close()
 
 
     def run(self, query):
@@ -312,7 +343,19 @@ class PackageSearchQuery(SearchQuery):
 
         # number of results
         rows_to_return = min(1000, int(query.get('rows', 10)))
-        if rows_to_return > 0:
+        cursor = query.get('cursorMark')
+        if cursor is not None:
+            # cursors page by sort values, so the sort needs the unique key
+            # as a tie breaker and start cannot be used. The #1683 extra row
+            # would move the cursor past a row that is not returned.
+            if int(query.pop('start', 0) or 0):
+                raise SearchQueryError('start cannot be used with a cursor')
+            sort = query.get('sort') or 'score desc'
+            if 'index_id' not in sort:
+                sort += ', index_id asc'
+            query['sort'] = sort
+            rows_to_query = rows_to_return
+        elif rows_to_return > 0:
             # #1683 Work around problem of last result being out of order
             #       in SOLR 1.4
             rows_to_query = rows_to_return + 1
@@ -355,10 +398,10 @@ class PackageSearchQuery(SearchQuery):
             query['qf'] = query.get('qf', QUERY_FIELDS)
 
 
-        conn = make_connection()
         log.debug('Package query: %r' % query)
         try:
-            solr_response = conn.raw_query(**query)
+            with solr_connection() as conn:
+                solr_response = conn.raw_query(**query)
         except SolrException, e:
             raise SearchError('SOLR returned an error running query: %r Error: %r' %
                               (query, e.reason))
@@ -371,6 +414,17 @@ class PackageSearchQuery(SearchQuery):
             # #1683 Filter out the last row that is sometimes out of order
             self.results = self.results[:rows_to_return]
 
+            self.next_cursor = None
+            if cursor is not None:
+                if 'nextCursorMark' not in data:
+                    raise SearchError('Paging with a cursor needs Solr 4.7 '
+                                      'or later')
+                # there are no more results once the cursor stops moving
+                # or a page is not full
+                if (data['nextCursorMark'] != cursor and
+                        len(self.results) == rows_to_return):
+                    self.next_cursor = data['nextCursorMark']
+
             # get any extras and add to 'extras' dict
             for result in self.results:
                 extra_keys = filter(lambda x: x.startswith('extras_'), result.keys())
@@ -392,7 +446,5 @@ class PackageSearchQuery(SearchQuery):
         except Exception, e:
             log.exception(e)
             raise SearchError(e)
-        finally:
-            conn.close()
 
         return {'results': self.results, 'count': self.count}
@@ -1,40 +1,417 @@
-from sqlalchemy import or_
+'''A PostgreSQL search backend, used instead of Solr when
+``ckan.simple_search`` is on.
+
+Each dataset's text is kept as a weighted ``tsvector`` in the
+``package_search_index`` table, which has a GIN index. Datasets that have not
+been indexed yet are still found, by their name, title and description.
+Filters are applied to the live dataset tables and facets are computed with
+grouped queries over the matching datasets.
+
+Only the common parts of the Solr query syntax are understood: free text,
+and ``field:value``, ``field:"value"`` and ``field:(value1 OR value2)``
+filters (optionally prefixed with ``+`` or ``-``) on the fields in
+``FILTER_FIELDS``, combined with ``AND``, ``OR`` and parentheses. Filters
+that are not joined by ``OR`` must all match. Filters on other fields are
+ignored, i.e. taken to match every dataset.
+'''
+import re
+import logging
+
+from sqlalchemy import and_, or_, not_, exists, select, func, text, desc, asc
+
+from ckan.lib.search.common import SearchQueryError
+from ckan.lib.search.index import SearchIndex
 from ckan.lib.search.query import SearchQuery
 import ckan.model as model
 
+log = logging.getLogger(__name__)
+
+# the text search configuration the documents and queries are parsed with
+FTS_LANG = 'english'
+
+FILTER_FIELDS = ['id', 'name', 'state', 'capacity', 'type', 'dataset_type',
+                 'license_id', 'creator_user_id', 'owner_org', 'tags',
+                 'groups', 'organization', 'res_format', 'site_id']
+
+FACET_FIELDS = ['tags', 'groups', 'organization', 'res_format',
+                'license_id']
+
+_filter_re = re.compile(r'([+-]?)(\w+):("[^"]*"|\([^)]*\)|[^\s()]+)')
+_token_re = re.compile(
+    r'(?P<filter>[+-]?\w+:(?:"[^"]*"|\([^)]*\)|[^\s()]+))'
+    r'|(?P<open>[+-]?\()|(?P<close>\))|(?P<word>[^\s()]+)')
+
+_INSERT_DOCUMENT = text(
+    '''INSERT INTO package_search_index (package_id, document)
+       VALUES (:package_id,
+               setweight(to_tsvector(CAST(:lang AS regconfig), :a), 'A') ||
+               setweight(to_tsvector(CAST(:lang AS regconfig), :b), 'B') ||
+               setweight(to_tsvector(CAST(:lang AS regconfig), :c), 'C') ||
+               setweight(to_tsvector(CAST(:lang AS regconfig), :d), 'D'))''')
+
+
+def _join_text(values):
+    return u' '.join(value for value in values
+                     if isinstance(value, basestring) and value)
+
+
+def _document_text(pkg_dict):
+    '''Return the text of a dataset dict in four parts, by weight.'''
+    organization = pkg_dict.get('organization') or {}
+    groups = pkg_dict.get('groups') or []
+    resources = pkg_dict.get('resources') or []
+    return {
+        'a': _join_text([pkg_dict.get('name'), pkg_dict.get('title')]),
+        'b': _join_text(
+            [tag.get('name') for tag in pkg_dict.get('tags') or []] +
+            [group.get(key) for group in groups for key in ('name', 'title')] +
+            [organization.get('name'), organization.get('title')]),
+        'c': _join_text(
+            [pkg_dict.get('notes')] +
+            [resource.get(key) for resource in resources
+             for key in ('name', 'description', 'format')]),
+        'd': _join_text(
+            [extra.get('value') for extra in pkg_dict.get('extras') or []] +
+            [pkg_dict.get(key) for key in ('author', 'maintainer',
+                                           'version', 'url')]),
+    }
+
+
+class PackageSearchIndex(SearchIndex):
+    '''Keeps the full text documents of the datasets up to date.
+
+    The documents are written in their own transactions, as datasets are
+    indexed while the transaction that changed them is being committed.
+    '''
+    def update_dict(self, pkg_dict, defer_commit=False):
+        self.index_packages([pkg_dict])
+
+    def remove_dict(self, pkg_dict):
+        self.delete_package(pkg_dict)
+
+    def index_packages(self, pkg_dicts, defer_commit=False, conn=None):
+        '''Index several datasets in one transaction.
+
+        Datasets with no state or in the deleted state are removed from the
+        index instead. Returns the number of datasets indexed.
+        '''
+        pkg_dicts = [pkg_dict for pkg_dict in pkg_dicts if pkg_dict]
+        if not pkg_dicts:
+            return 0
+        documents = []
+        for pkg_dict in pkg_dicts:
+            if pkg_dict.get('state') in (None, model.State.DELETED):
+                continue
+            document = _document_text(pkg_dict)
+            document.update({'package_id': pkg_dict['id'], 'lang': FTS_LANG})
+            documents.append(document)
+
+        table = model.package_search_index_table
+        with model.meta.engine.begin() as connection:
+            connection.execute(table.delete().where(table.c.package_id.in_(
+                [pkg_dict['id'] for pkg_dict in pkg_dicts])))
+            if documents:
+                connection.execute(_INSERT_DOCUMENT, documents)
+        return len(documents)
+
+    def delete_package(self, pkg_dict):
+        table = model.package_search_index_table
+        with model.meta.engine.begin() as connection:
+            connection.execute(table.delete().where(
+                table.c.package_id == pkg_dict['id']))
+
+    def clear(self):
+        with model.meta.engine.begin() as connection:
+            connection.execute(model.package_search_index_table.delete())
+
+    def commit(self):
+        pass
+
+
+def _filter_values(value):
+    if value.startswith('"'):
+        return [value.strip('"')]
+    if value.startswith('('):
+        return [v.strip().strip('"')
+                for v in re.split(r'\s+OR\s+', value[1:-1]) if v.strip()]
+    return [value]
+
+
+def _filter_clause(field, values):
+    '''Return the SQL condition of a field:value filter, or None if the
+    field is not supported.'''
+    package = model.package_table
+    if field in ('id', 'name', 'state', 'license_id', 'creator_user_id',
+                 'owner_org'):
+        return package.c[field].in_(values)
+    if field in ('type', 'dataset_type'):
+        return package.c.type.in_(values)
+    if field == 'capacity':
+        return package.c.private.in_(
+            [value == 'private' for value in values])
+    if field == 'tags':
+        return exists().where(and_(
+            model.package_tag_table.c.package_id == package.c.id,
+            model.package_tag_table.c.state == 'active',
+            model.package_tag_table.c.tag_id == model.tag_table.c.id,
+            model.tag_table.c.name.in_(values)))
+    if field == 'organization':
+        return package.c.owner_org.in_(
+            select([model.group_table.c.id]).where(
+                model.group_table.c.name.in_(values)))
+    if field == 'groups':
+        return exists().where(and_(
+            model.member_table.c.table_id == package.c.id,
+            model.member_table.c.table_name == 'package',
+            model.member_table.c.state == 'active',
+            model.member_table.c.group_id == model.group_table.c.id,
+            model.group_table.c.is_organization.is_(False),
+            model.group_table.c.name.in_(values)))
+    if field == 'res_format':
+        return exists().where(and_(
+            model.resource_table.c.package_id == package.c.id,
+            model.resource_table.c.state == 'active',
+            model.resource_table.c.format.in_(values)))
+    return None
+
+
+def _parse_group(tokens, fields, words):
+    '''Return the condition of the tokens up to the end of the current
+    group, or None if it does not restrict the datasets.'''
+    alternatives = [[]]
+    while tokens:
+        kind, token = tokens.pop(0)
+        if kind == 'close':
+            break
+        if kind == 'word':
+            if token == 'OR':
+                alternatives.append([])
+            elif token != 'AND':
+                words.append(token)
+            continue
+        if kind == 'open':
+            sign = token[:-1]
+            clause = _parse_group(tokens, fields, words)
+        else:
+            sign, field, value = _filter_re.match(token).groups()
+            fields.add(field)
+            clause = None
+            if field != 'site_id':
+                clause = _filter_clause(field, _filter_values(value))
+                if clause is None:
+                    log.debug('Ignoring filter on unsupported field %s',
+                              field)
+        if clause is not None and sign == '-':
+            clause = not_(clause)
+        alternatives[-1].append(clause)
+
+    conditions = []
+    for alternative in alternatives:
+        if not alternative:
+            continue
+        clauses = [part for part in alternative if part is not None]
+        if not clauses:
+            # an alternative that every dataset matches
+            return None
+        conditions.append(and_(*clauses))
+    if not conditions:
+        return None
+    return or_(*conditions)
+
+
+def _parse_filters(query_string):
+    '''Return the conditions of the field filters in a Solr query string,
+    the fields filtered on and the rest of the string.'''
+    tokens = [(match.lastgroup, match.group())
+              for match in _token_re.finditer(query_string)]
+    fields = set()
+    words = []
+    condition = _parse_group(tokens, fields, words)
+    clauses = [] if condition is None else [condition]
+    return clauses, fields, u' '.join(words)
+
+
+def _fallback_document():
+    package = model.package_table
+    return func.to_tsvector(
+        FTS_LANG,
+        func.coalesce(package.c.name, '') + ' ' +
+        func.coalesce(package.c.title, '') + ' ' +
+        func.coalesce(package.c.notes, ''))
+
+
 class PackageSearchQuery(SearchQuery):
-    def get_all_entity_ids(self, max_results=100):
+    def get_all_entity_ids(self, max_results=None):
         """
         Return a list of the IDs of all indexed packages.
         """
-        # could make this a pure sql query which would be much more efficient!
-        q = model.Session.query(model.Package).filter_by(state='active').limit(max_results)
-
-        return [r.id for r in q]
+        index = model.package_search_index_table
+        q = select([index.c.package_id])
+        if max_results is not None:
+            q = q.limit(max_results)
+        return [r[0] for r in model.Session.execute(q)]
 
     def run(self, query):
         assert isinstance(query, dict)
-        # no support for faceting atm
+        package = model.package_table
+        index = model.package_search_index_table
+
+        clauses = []
+        filtered_fields = set()
+        fqs = [query.get('fq') or ''] + list(query.get('fq_list') or [])
+        for fq in fqs:
+            fq_clauses, fields, _ = _parse_filters(fq)
+            clauses.extend(fq_clauses)
+            filtered_fields.update(fields)
+
+        q = query.get('q') or u''
+        if q in ('""', "''", '*:*'):
+            q = u''
+        q_clauses, fields, q = _parse_filters(q)
+        clauses.extend(q_clauses)
+        filtered_fields.update(fields)
+        words = [word for word in q.split() if word not in ('AND', 'OR')]
+
+        if 'state' not in filtered_fields:
+            clauses.append(package.c.state == 'active')
+
+        rank = None
+        if words:
+            ts_query = func.plainto_tsquery(FTS_LANG, u' '.join(words))
+            indexed = exists().where(index.c.package_id == package.c.id)
+            clauses.append(or_(
+                package.c.id.in_(select([index.c.package_id]).where(
+                    index.c.document.op('@@')(ts_query))),
+                and_(not_(indexed),
+                     _fallback_document().op('@@')(ts_query))))
+            rank = func.ts_rank(
+                func.coalesce(select([index.c.document]).where(
+                    index.c.package_id == package.c.id).as_scalar(),
+                    _fallback_document()),
+                ts_query)
+
+        matching = select([package.c.id]).where(and_(*clauses))
+
+        self.count = model.Session.execute(
+            select([func.count()]).select_from(matching.alias())).scalar()
+
+        rows = min(1000, int(query.get('rows', 10)))
+        cursor = query.get('cursorMark')
+        if cursor is not None:
+            if int(query.get('start', 0) or 0):
+                raise SearchQueryError('start cannot be used with a cursor')
+            try:
+                start = 0 if cursor == '*' else int(cursor)
+            except ValueError:
+                raise SearchQueryError('Invalid cursor: %s' % cursor)
+        else:
+            start = int(query.get('start', 0) or 0)
+
+        results_q = select([package.c.id, package.c.name]).where(
+            and_(*clauses))
+        results_q = results_q.order_by(*self._order_by(
+            query.get('sort'), rank))
+        results_q = results_q.offset(start).limit(rows)
+        rows_found = model.Session.execute(results_q).fetchall()
+
+        if query.get('fl') in ['id', 'name']:
+            self.results = [row[query['fl']] for row in rows_found]
+        else:
+            self.results = [{'id': row['id']} for row in rows_found]
+
+        self.next_cursor = None
+        if cursor is not None and rows and len(rows_found) == rows:
+            self.next_cursor = str(start + rows)
+
         self.facets = {}
-        limit = min(1000, int(query.get('rows', 10)))
-
-        q = query.get('q')
-        ourq = model.Session.query(model.Package.id).filter_by(state='active')
-
-        def makelike(field):
-            _attr = getattr(model.Package, field)
-            return _attr.ilike('%' + term + '%')
-        if q and q not in ('""', "''", '*:*'):
-            terms = q.split()
-            # TODO: tags ...?
-            fields = ['name', 'title', 'notes']
-            for term in terms:
-                args = [makelike(field) for field in fields]
-                subq = or_(*args)
-                ourq = ourq.filter(subq)
-        self.count = ourq.count()
-        ourq = ourq.limit(limit)
-        self.results = [{'id': r[0]} for r in ourq.all()]
+        if query.get('facet', 'true') == 'true':
+            self.facets = self._facets(query, matching)
 
         return {'results': self.results, 'count': self.count}
 
+    def _order_by(self, sort, rank):
+        package = model.package_table
+        columns = {
+            'name': package.c.name,
+            'title_string': package.c.title,
+            'metadata_modified': package.c.metadata_modified,
+            'metadata_created': package.c.metadata_created,
+        }
+        order_by = []
+        for part in (sort or '').split(','):
+            part = part.split()
+            if not part:
+                continue
+            field = part[0]
+            direction = desc if part[-1].lower() == 'desc' else asc
+            if field == 'score':
+                if rank is not None:
+                    order_by.append(direction(rank))
+            elif field in columns:
+                order_by.append(direction(columns[field]))
+        # datasets with the same sort values are always in the same order
+        order_by.append(package.c.id)
+        return order_by
+
+    def _facets(self, query, matching):
+        fields = query.get('facet.field') or []
+        if isinstance(fields, basestring):
+            fields = [fields]
+        limit = int(query.get('facet.limit', 50))
+        mincount = int(query.get('facet.mincount', 1))
+
+        facets = {}
+        for field in fields:
+            if field not in FACET_FIELDS:
+                log.debug('Ignoring facet on unsupported field %s', field)
+                facets[field] = {}
+                continue
+            value, facet_q = self._facet_query(field, matching)
+            count = func.count(func.distinct(facet_q.c.package_id))
+            facet_q = select([value, count]).select_from(facet_q).group_by(
+                value).having(count >= mincount).order_by(
+                desc(count), value)
+            if limit >= 0:
+                facet_q = facet_q.limit(limit)
+            facets[field] = dict(
+                (row[0], row[1])
+                for row in model.Session.execute(facet_q))
+        return facets
+
+    def _facet_query(self, field, matching):
+        '''Return the facet value column and a subquery of
+        (package_id, value) for the given facet field.'''
+        package = model.package_table
+        group = model.group_table
+        if field == 'tags':
+            package_tag = model.package_tag_table
+            tag = model.tag_table
+            columns = [package_tag.c.package_id, tag.c.name]
+            conditions = [package_tag.c.tag_id == tag.c.id,
+                          package_tag.c.state == 'active',
+                          tag.c.vocabulary_id.is_(None)]
+        elif field == 'organization':
+            columns = [package.c.id, group.c.name]
+            conditions = [package.c.owner_org == group.c.id]
+        elif field == 'groups':
+            member = model.member_table
+            columns = [member.c.table_id, group.c.name]
+            conditions = [member.c.group_id == group.c.id,
+                          member.c.table_name == 'package',
+                          member.c.state == 'active',
+                          group.c.is_organization.is_(False)]
+        elif field == 'res_format':
+            resource = model.resource_table
+            columns = [resource.c.package_id, resource.c.format]
+            conditions = [resource.c.state == 'active',
+                          resource.c.format.isnot(None),
+                          resource.c.format != '']
+        else:
+            columns = [package.c.id, package.c[field]]
+            conditions = [package.c[field].isnot(None)]
+        package_id, value = columns
+        q = select([package_id.label('package_id'),
+                    value.label('value')]).where(
+            and_(package_id.in_(matching), *conditions))
+        q = q.alias()
+        return q.c.value, q
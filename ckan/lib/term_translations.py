@@ -0,0 +1,150 @@
+'''A process-wide cache of term translations.
+
+Term translations are looked up for every field of every dataset that is
+indexed or viewed when the multilingual plugins are enabled. The cache keeps
+the most recently used translations in memory, keyed by ``(term,
+lang_code)``, so that a page of results or a batch of datasets costs at most
+one query for the terms that are not cached yet.
+
+Misses are cached too, as most terms have no translation. The
+``term_translation_update`` actions invalidate the terms they write; other
+processes see the change when their cached entries expire after
+``ckan.term_translation_cache_ttl`` seconds.
+
+'''
+import threading
+import time
+
+from pylons import config
+
+from ckan.common import OrderedDict
+
+
+_CACHE_SIZE = 10000
+_CACHE_TTL = 300
+
+# Marks a cached term that has no translation into a language.
+_MISSING = object()
+
+
+class TermTranslationCache(object):
+    '''A bounded LRU cache of term translations.
+
+    :param size: the maximum number of (term, lang_code) entries to keep,
+        or 0 to disable caching
+    :param ttl: how long in seconds an entry is valid for, or 0 for ever
+
+    '''
+    def __init__(self, size=None, ttl=None):
+        self._size = size
+        self._ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def size(self):
+        if self._size is None:
+            return int(config.get('ckan.term_translation_cache_size',
+                                  _CACHE_SIZE))
+        return self._size
+
+    @property
+    def ttl(self):
+        if self._ttl is None:
+            return int(config.get('ckan.term_translation_cache_ttl',
+                                  _CACHE_TTL))
+        return self._ttl
+
+    def get_translations(self, terms, lang_codes):
+        '''Return the translations of the given terms into the given
+        languages.
+
+        The translations are returned as a list of dicts with the keys
+        ``'term'``, ``'term_translation'`` and ``'lang_code'``, like the
+        ones returned by the ``term_translation_show`` action. Terms that
+        are not cached are fetched with a single query.
+
+        '''
+        terms = set(term for term in terms
+                    if isinstance(term, basestring))
+        lang_codes = set(lang_codes)
+        cached = self._get_cached(terms, lang_codes)
+
+        missing_terms = set(term for (term, lang_code) in _terms_and_langs(
+            terms, lang_codes) if (term, lang_code) not in cached)
+        if missing_terms:
+            fetched = self._fetch(missing_terms, lang_codes)
+            self._store(fetched)
+            cached.update(fetched)
+
+        return [{'term': term, 'term_translation': translation,
+                 'lang_code': lang_code}
+                for (term, lang_code), translation in cached.iteritems()
+                if translation is not _MISSING]
+
+    def prefetch(self, terms, lang_codes):
+        '''Load the translations of the given terms into the cache, e.g. for
+        all the datasets of a search results page at once.'''
+        self.get_translations(terms, lang_codes)
+
+    def invalidate(self, terms):
+        '''Remove the given terms from the cache, in all languages.'''
+        terms = set(terms)
+        with self._lock:
+            for key in [key for key in self._entries if key[0] in terms]:
+                del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def _get_cached(self, terms, lang_codes):
+        cached = {}
+        if not self.size:
+            return cached
+        now = time.time()
+        with self._lock:
+            for key in _terms_and_langs(terms, lang_codes):
+                entry = self._entries.pop(key, None)
+                if entry is None:
+                    continue
+                translation, expires = entry
+                if expires and expires < now:
+                    continue
+                # re-insert the entry to mark it as the most recently used
+                self._entries[key] = entry
+                cached[key] = translation
+        return cached
+
+    def _store(self, translations):
+        size = self.size
+        if not size:
+            return
+        expires = time.time() + self.ttl if self.ttl else None
+        with self._lock:
+            for key, translation in translations.iteritems():
+                self._entries.pop(key, None)
+                self._entries[key] = (translation, expires)
+            while len(self._entries) > size:
+                self._entries.popitem(last=False)
+
+    def _fetch(self, terms, lang_codes):
+        import ckan.model as model
+        trans_table = model.term_translation_table
+        q = trans_table.select().where(
+            trans_table.c.term.in_(list(terms))).where(
+            trans_table.c.lang_code.in_(list(lang_codes)))
+
+        translations = dict((key, _MISSING)
+                            for key in _terms_and_langs(terms, lang_codes))
+        for row in model.Session.connection().execute(q):
+            translations[(row['term'], row['lang_code'])] = (
+                row['term_translation'])
+        return translations
+
+
+def _terms_and_langs(terms, lang_codes):
+    return [(term, lang_code) for term in terms for lang_code in lang_codes]
+
+
+cache = TermTranslationCache()
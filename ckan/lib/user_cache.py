@@ -0,0 +1,142 @@
+'''A cache of the users that make API requests, by API key.
+
+Every request authenticated with an API key needs the user that owns the
+key. Looking it up costs a query per request, which adds up for clients that
+make many API calls in a row, so when ``ckan.user_cache_ttl`` is set each
+process keeps the column values of the users of the latest API keys for that
+many seconds. It is off by default.
+
+A cached user is attached to the database session of the request without
+querying the database. The users changed in this process are dropped from
+the cache as soon as the change is committed (e.g. by ``user_update``,
+``user_delete`` or ``user_generate_apikey``). Changes made by other
+processes are only seen once the cached values expire, so a revoked API key
+or a deleted user keeps working on the other processes until then.
+
+'''
+import collections
+import threading
+import time
+
+from paste.deploy.converters import asint
+from pylons import config
+import sqlalchemy.orm as orm
+
+DEFAULT_TTL = 0
+DEFAULT_SIZE = 1000
+
+
+class UserCache(object):
+    '''The column values of up to ``size`` users, by API key, each kept for
+    ``ttl`` seconds. The least recently used users are dropped first.'''
+
+    def __init__(self, size=DEFAULT_SIZE, ttl=DEFAULT_TTL):
+        self.size = size
+        self.ttl = ttl
+        self._users = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, apikey):
+        with self._lock:
+            try:
+                expires, values = self._users.pop(apikey)
+            except KeyError:
+                return None
+            if expires <= time.time():
+                return None
+            self._users[apikey] = (expires, values)
+            return values
+
+    def set(self, apikey, values):
+        with self._lock:
+            self._users.pop(apikey, None)
+            self._users[apikey] = (time.time() + self.ttl, values)
+            while len(self._users) > self.size:
+                self._users.popitem(last=False)
+
+    def invalidate(self, user_ids):
+        user_ids = set(user_ids)
+        with self._lock:
+            for apikey, (expires, values) in self._users.items():
+                if values['id'] in user_ids:
+                    del self._users[apikey]
+
+    def clear(self):
+        with self._lock:
+            self._users.clear()
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def _get_cache():
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = UserCache(
+                asint(config.get('ckan.user_cache_size', DEFAULT_SIZE)),
+                asint(config.get('ckan.user_cache_ttl', DEFAULT_TTL)))
+    return _cache
+
+
+def _enabled():
+    return asint(config.get('ckan.user_cache_ttl', DEFAULT_TTL)) > 0
+
+
+def _values(user):
+    mapper = orm.object_mapper(user)
+    return dict((prop.key, getattr(user, prop.key))
+                for prop in mapper.column_attrs)
+
+
+def _attach(values):
+    import ckan.model as model
+    mapper = orm.class_mapper(model.User)
+    # the session may already have the user, with changes of its own
+    user = model.Session.identity_map.get(
+        mapper.identity_key_from_primary_key([values['id']]))
+    if user is None:
+        user = mapper.class_manager.new_instance()
+        for key, value in values.iteritems():
+            setattr(user, key, value)
+        # as if it had been loaded from the database, so that merging it
+        # does not query the database
+        orm.make_transient_to_detached(user)
+        user = model.Session.merge(user, load=False)
+    return user
+
+
+def user_by_apikey(apikey):
+    '''Return the user with the given API key, or None.'''
+    import ckan.model as model
+    if not _enabled():
+        return model.User.by_apikey(apikey)
+    cache = _get_cache()
+    values = cache.get(apikey)
+    if values is None:
+        user = model.User.by_apikey(apikey)
+        if user is not None:
+            cache.set(apikey, _values(user))
+        return user
+    user = _attach(values)
+    model.User.remember(user, ('apikey', apikey))
+    return user
+
+
+def invalidate_changed(objects):
+    '''Drop the changed users among the given domain objects from the
+    cache.'''
+    if _cache is None:
+        return
+    user_ids = [obj.id for obj in objects
+                if obj.__class__.__name__ == 'User']
+    if user_ids:
+        _cache.invalidate(user_ids)
+
+
+def clear():
+    '''Forget the cached users, and the cache's settings.'''
+    global _cache
+    with _cache_lock:
+        _cache = None
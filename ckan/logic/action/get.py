@@ -20,6 +20,7 @@ import ckan.model as model
 import ckan.model.misc as misc
 import ckan.plugins as plugins
 import ckan.lib.search as search
+import ckan.lib.profiler as profiler
 import ckan.lib.plugins as lib_plugins
 import ckan.lib.activity_streams as activity_streams
 import ckan.authz as authz
@@ -83,11 +84,8 @@ def _activity_stream_get_filtered_users():
 
 
 def _package_list_with_resources(context, package_revision_list):
-    package_list = []
-    for package in package_revision_list:
-        result_dict = model_dictize.package_dictize(package,context)
-        package_list.append(result_dict)
-    return package_list
+    return model_dictize.package_list_dictize(
+        [package.id for package in package_revision_list], context)
 
 
 def site_read(context, data_dict=None):
@@ -453,22 +451,135 @@ def _group_or_org_list(context, data_dict, is_org=False):
     groups = query.all()
 
     if all_fields:
-        action = 'organization_show' if is_org else 'group_show'
-        group_list = []
-        for group in groups:
-            data_dict['id'] = group.id
-            for key in ('include_extras', 'include_tags', 'include_users',
-                        'include_groups', 'include_followers'):
-                if key not in data_dict:
-                    data_dict[key] = False
-
-            group_list.append(logic.get_action(action)(context, data_dict))
+        for key in ('include_extras', 'include_tags', 'include_users',
+                    'include_groups', 'include_followers'):
+            if key not in data_dict:
+                data_dict[key] = False
+        if any(asbool(data_dict[key]) for key in (
+                'include_tags', 'include_users', 'include_groups',
+                'include_followers')):
+            action = 'organization_show' if is_org else 'group_show'
+            group_list = []
+            for group in groups:
+                data_dict['id'] = group.id
+                group_list.append(logic.get_action(action)(context, data_dict))
+        else:
+            group_list = _group_list_dictize(
+                context, [group.id for group in groups],
+                asbool(data_dict['include_extras']), is_org)
     else:
         group_list = [getattr(group, ref_group_by) for group in groups]
 
     return group_list
 
 
+def _group_list_dictize(context, group_ids, include_extras, is_org):
+    '''Return the dicts of the given groups, as group_show or
+    organization_show would with no tags, users, sub-groups or followers.
+
+    The groups and their extras are fetched with one query each and the
+    dataset counts of all the groups come from a single (cached) Solr facet
+    query of the public datasets, rather than one action call per group. The
+    counts of the organizations whose private datasets the user can read come
+    from one more facet query, made in the user's context.
+    '''
+    model = context['model']
+    groups = dict((group.id, group) for group in model.Session.query(
+        model.Group).filter(model.Group.id.in_(group_ids)))
+
+    extras = {}
+    if include_extras and group_ids:
+        for extra in model.Session.query(model.GroupExtra).filter(
+                model.GroupExtra.group_id.in_(group_ids)):
+            extras.setdefault(extra.group_id, {})[extra.key] = extra
+
+    dataset_counts = model_dictize.get_cached_group_dataset_counts()
+    if is_org:
+        dataset_counts = _add_private_dataset_counts(
+            context, dataset_counts, group_ids)
+    dictize_context = dict(context)
+    dictize_context['dataset_counts'] = dataset_counts
+
+    if is_org:
+        action = 'organization_show'
+        plugin_type = plugins.IOrganizationController
+    else:
+        action = 'group_show'
+        plugin_type = plugins.IGroupController
+
+    group_list = []
+    for group_id in group_ids:
+        _check_access(action, context, {'id': group_id})
+        group = groups[group_id]
+        dictize_context['group'] = group
+        group_dict = model_dictize.group_dictize(
+            group, dictize_context, packages_field='dataset_count',
+            include_tags=False, include_extras=False, include_groups=False,
+            include_users=False)
+        if include_extras:
+            group_dict['extras'] = model_dictize.extras_dict_dictize(
+                extras.get(group_id, {}), dictize_context)
+        group_dict['num_followers'] = 0
+
+        for item in plugins.PluginImplementations(plugin_type):
+            item.read(group)
+
+        group_list.append(
+            _validate_group_show_dict(dictize_context, group_dict, is_org))
+    return group_list
+
+
+def _add_private_dataset_counts(context, dataset_counts, org_ids):
+    '''Return the dataset counts with those of the given organizations that
+    the user can read the private datasets of (as organization_show counts
+    them) replaced by counts of their public and private datasets.'''
+    model = context['model']
+    user = context.get('user')
+    if not user or not org_ids:
+        return dataset_counts
+
+    if authz.is_sysadmin(user):
+        member_org_ids = set(org_ids)
+    else:
+        user_id = authz.get_user_id_for_username(user, allow_none=True)
+        if not user_id:
+            return dataset_counts
+        roles = authz.get_roles_with_permission('read')
+        roles_that_cascade = \
+            authz.check_config_permission('roles_that_cascade_to_sub_groups')
+        q = model.Session.query(model.Member.group_id,
+                                model.Member.capacity) \
+            .filter(model.Member.table_name == 'user') \
+            .filter(model.Member.capacity.in_(roles)) \
+            .filter(model.Member.table_id == user_id) \
+            .filter(model.Member.state == 'active')
+        member_org_ids = set()
+        for group_id, capacity in q:
+            if capacity in roles_that_cascade:
+                member_org_ids |= authz.get_group_descendant_ids(
+                    group_id, type='organization')
+            member_org_ids.add(group_id)
+        member_org_ids &= set(org_ids)
+        if not member_org_ids:
+            return dataset_counts
+
+    search_context = dict((k, v) for (k, v) in context.items()
+                          if k != 'schema')
+    search_context['ignore_capacity_check'] = True
+    result = logic.get_action('package_search')(search_context, {
+        'fq': 'owner_org:({0})'.format(' OR '.join(
+            '"{0}"'.format(org_id) for org_id in member_org_ids)),
+        'facet.field': ['owner_org'],
+        'facet.limit': -1,
+        'rows': 0,
+    })
+    org_counts = dict(dataset_counts['owner_org'])
+    for org_id in member_org_ids:
+        org_counts[org_id] = result['facets'].get('owner_org', {}).get(
+            org_id, 0)
+    return dict(dataset_counts, owner_org=org_counts)
+
+
 def group_list(context, data_dict):
     '''Return a list of the names of the site's groups.
 
@@ -493,7 +604,10 @@ def group_list(context, data_dict):
         core fields are returned - get some more using the include_* options.
         Returning a list of packages is too expensive, so the `packages`
         property for each group is deprecated, but there is a count of the
-        packages in the `package_count` property.
+        packages in the `package_count` property. Unless any of the
+        include_tags, include_groups, include_users or include_followers
+        options are given, the count is of public datasets only and may be
+        up to ``ckan.group_dataset_counts_cache_ttl`` seconds out of date.
         (optional, default: ``False``)
     :type all_fields: boolean
     :param include_extras: if all_fields, include the group extra fields
@@ -542,7 +656,12 @@ def organization_list(context, data_dict):
         core fields are returned - get some more using the include_* options.
         Returning a list of packages is too expensive, so the `packages`
         property for each group is deprecated, but there is a count of the
-        packages in the `package_count` property.
+        packages in the `package_count` property, which includes the
+        private datasets of the organizations the user is a member of.
+        Unless any of the include_tags, include_groups, include_users or
+        include_followers options are given, the counts of the other
+        organizations may be up to ``ckan.group_dataset_counts_cache_ttl``
+        seconds out of date.
         (optional, default: ``False``)
     :type all_fields: boolean
     :param include_extras: if all_fields, include the organization extra fields
@@ -703,10 +822,8 @@ def organization_list_for_user(context, data_dict):
             authz.check_config_permission('roles_that_cascade_to_sub_groups')
         for member, group in q.all():
             if member.capacity in roles_that_cascade:
-                group_ids |= set([
-                    grp_tuple[0] for grp_tuple
-                    in group.get_children_group_hierarchy(type='organization')
-                    ])
+                group_ids |= authz.get_group_descendant_ids(
+                    group.id, type='organization')
             group_ids.add(group.id)
 
         if not group_ids:
@@ -1199,6 +1316,18 @@ def _group_or_org_show(context, data_dict, is_org=False):
     for item in plugins.PluginImplementations(plugin_type):
         item.read(group)
 
+    if include_followers:
+        group_dict['num_followers'] = logic.get_action('group_follower_count')(
+            {'model': model, 'session': model.Session},
+            {'id': group_dict['id']})
+    else:
+        group_dict['num_followers'] = 0
+
+    return _validate_group_show_dict(context, group_dict, is_org)
+
+
+def _validate_group_show_dict(context, group_dict, is_org):
+    '''Convert a dictized group with the show schema of its group plugin.'''
     group_plugin = lib_plugins.lookup_group_plugin(group_dict['type'])
     try:
         schema = group_plugin.db_to_form_schema_options({
@@ -1208,13 +1337,6 @@ def _group_or_org_show(context, data_dict, is_org=False):
     except AttributeError:
         schema = group_plugin.db_to_form_schema()
 
-    if include_followers:
-        group_dict['num_followers'] = logic.get_action('group_follower_count')(
-            {'model': model, 'session': model.Session},
-            {'id': group_dict['id']})
-    else:
-        group_dict['num_followers'] = 0
-
     if schema is None:
         schema = logic.schema.default_show_group_schema()
     group_dict, errors = lib_plugins.plugin_validate(
@@ -1670,6 +1792,11 @@ def package_search(context, data_dict):
     :param start: the offset in the complete result for where the set of
         returned datasets should begin.
     :type start: int
+    :param cursor: page through the results with a cursor instead of
+        ``start``, which stays fast however deep the page is. Pass ``'*'``
+        for the first page and then the ``next_cursor`` of each page to get
+        the next one. Needs Solr 4.7 or later. Optional.
+    :type cursor: string
     :param facet: whether to enable faceted results.  Default: ``True``.
     :type facet: string
     :param facet.mincount: the minimum counts for facet fields should be
@@ -1687,6 +1814,10 @@ def package_search(context, data_dict):
         sysadmin will be returned all draft datasets. Optional, the default is
         ``False``.
     :type include_drafts: boolean
+    :param debug: if ``True``, the result includes a ``debug`` dict with the
+        number of SQL queries made by the search (``sql_queries``). Optional,
+        the default is ``False``.
+    :type debug: boolean
 
     The following advanced Solr parameters are supported as well. Note that
     some of these are only available on particular Solr versions. See Solr's
@@ -1717,6 +1848,9 @@ def package_search(context, data_dict):
     :param results: ordered list of datasets matching the query, where the
         ordering defined by the sort parameter used in the query.
     :type results: list of dictized datasets.
+    :param next_cursor: if a ``cursor`` was given, the cursor of the next
+        page of results, or ``None`` if this was the last page.
+    :type next_cursor: string
     :param facets: DEPRECATED.  Aggregated information about facet counts.
     :type facets: DEPRECATED dict
     :param search_facets: aggregated information about facet counts.  The outer
@@ -1765,12 +1899,23 @@ def package_search(context, data_dict):
     if errors:
         raise ValidationError(errors)
 
+    _check_access('package_search', context, data_dict)
+
+    # Solr doesn't need 'debug', so pop it.
+    if asbool(data_dict.pop('debug', False)):
+        with context['model'].meta.QueryCounter() as query_counter:
+            search_results = _package_search(context, data_dict)
+        search_results['debug'] = {'sql_queries': query_counter.count}
+        return search_results
+
+    return _package_search(context, data_dict)
+
+
+def _package_search(context, data_dict):
     model = context['model']
     session = context['session']
     user = context['user']
 
-    _check_access('package_search', context, data_dict)
-
     # Move ext_ params to extras and remove them from the root of the search
     # params, so they don't cause and error
     data_dict['extras'] = data_dict.get('extras', {})
@@ -1822,23 +1967,37 @@ def package_search(context, data_dict):
         # Pop these ones as Solr does not need them
         extras = data_dict.pop('extras', None)
 
+        # Solr calls the cursor cursorMark
+        cursor = data_dict.pop('cursor', None)
+        if cursor is not None:
+            data_dict['cursorMark'] = cursor
+        sort = data_dict['sort']
+
         query = search.query_for(model.Package)
         query.run(data_dict)
+        data_dict['sort'] = sort
 
         # Add them back so extensions can use them on after_search
         data_dict['extras'] = extras
 
+        # check that all the packages returned still exist with one query
+        result_ids = [package['id'] for package in query.results]
+        existing_ids = set()
+        if result_ids:
+            existing_ids = set(
+                row[0] for row in session.query(model.Package.id)
+                .filter(model.Package.id.in_(result_ids))
+                .filter(model.Package.state.in_((u'active', u'draft'))))
+
+        # results not cached in the index get dictized together at the end
+        to_dictize = {}
+        to_view = set()
         for package in query.results:
-            # get the package object
             package, package_dict = package['id'], package.get(data_source)
-            pkg_query = session.query(model.Package)\
-                .filter(model.Package.id == package)\
-                .filter(model.Package.state.in_((u'active', u'draft')))
-            pkg = pkg_query.first()
 
             # if the index has got a package that is not in ckan then
             # ignore it.
-            if not pkg:
+            if package not in existing_ids:
                 log.warning('package %s in index but not in database'
                             % package)
                 continue
@@ -1847,19 +2006,26 @@ def package_search(context, data_dict):
                 # the package_dict still needs translating when being viewed
                 package_dict = json.loads(package_dict)
                 if context.get('for_view'):
-                    for item in plugins.PluginImplementations(
-                            plugins.IPackageController):
-                        package_dict = item.before_view(package_dict)
+                    to_view.add(package)
                 results.append(package_dict)
             else:
-                results.append(model_dictize.package_dictize(pkg, context))
+                to_dictize[package] = len(results)
+                results.append(None)
+
+        if to_dictize:
+            for package_dict in model_dictize.package_list_dictize(
+                    to_dictize.keys(), context):
+                results[to_dictize[package_dict['id']]] = package_dict
 
         count = query.count
         facets = query.facets
+        next_cursor = query.next_cursor
     else:
         count = 0
         facets = {}
         results = []
+        next_cursor = None
+        to_view = set()
 
     search_results = {
         'count': count,
@@ -1867,6 +2033,25 @@ def package_search(context, data_dict):
         'results': results,
         'sort': data_dict['sort']
     }
+    if 'cursorMark' in data_dict or 'cursor' in data_dict:
+        search_results['next_cursor'] = next_cursor
+
+    # Get the display names of all the group and organization facet values
+    # at once
+    group_names = set()
+    for key in ('groups', 'organization'):
+        group_names.update(facets.get(key, {}).keys())
+    group_display_names = {}
+    if group_names:
+        group_query = session.query(model.Group.id, model.Group.name,
+                                    model.Group.title)\
+            .filter(_or_(model.Group.id.in_(group_names),
+                         model.Group.name.in_(group_names)))
+        for group_id, group_name, group_title in group_query:
+            display_name = group_title if group_title else group_name
+            group_display_names.setdefault(group_name, display_name)
+            # ids take precedence over names, as in Group.get()
+            group_display_names[group_id] = display_name
 
     # Transform facets into a more useful data structure.
     restructured_facets = {}
@@ -1879,11 +2064,8 @@ def package_search(context, data_dict):
             new_facet_dict = {}
             new_facet_dict['name'] = key_
             if key in ('groups', 'organization'):
-                group = model.Group.get(key_)
-                if group:
-                    new_facet_dict['display_name'] = group.display_name
-                else:
-                    new_facet_dict['display_name'] = key_
+                new_facet_dict['display_name'] = group_display_names.get(
+                    key_, key_)
             elif key == 'license_id':
                 license = model.Package.get_license_register().get(key_)
                 if license:
@@ -1900,6 +2082,17 @@ def package_search(context, data_dict):
     for item in plugins.PluginImplementations(plugins.IPackageController):
         search_results = item.after_search(search_results, data_dict)
 
+    # The results are only prepared for viewing once every after_search has
+    # run, so extensions can fetch what the whole page needs in one go
+    if to_view:
+        for i, package_dict in enumerate(search_results['results']):
+            if not package_dict or package_dict.get('id') not in to_view:
+                continue
+            for item in plugins.PluginImplementations(
+                    plugins.IPackageController):
+                package_dict = item.before_view(package_dict)
+            search_results['results'][i] = package_dict
+
     # After extensions have had a chance to modify the facets, sort them by
     # display name.
     for facet in search_results['search_facets']:
@@ -3380,9 +3573,15 @@ def dashboard_new_activities_count(context, data_dict):
 
     '''
     _check_access('dashboard_new_activities_count', context, data_dict)
-    activities = logic.get_action('dashboard_activity_list')(
-        context, data_dict)
-    return len([activity for activity in activities if activity['is_new']])
+
+    model = context['model']
+    user_id = model.User.get(context['user']).id
+    limit = int(
+        data_dict.get('limit', config.get('ckan.activity_list_limit', 31)))
+    last_viewed = model.Dashboard.get(user_id).activity_stream_last_viewed
+
+    return model.activity.dashboard_new_activities_count(
+        user_id, last_viewed, limit, _activity_stream_get_filtered_users())
 
 
 def _unpick_search(sort, allowed_fields=None, total=None):
@@ -3505,3 +3704,31 @@ def config_option_list(context, data_dict):
     schema = ckan.logic.schema.update_configuration_schema()
 
     return schema.keys()
+
+
+def action_profile_list(context, data_dict):
+    '''Return the latest request profiles kept by the action profiler of the
+    process handling this request.
+
+    The profiler is only active when the ``ckan.action_profiler.enabled``
+    config option is on. Each profile lists the action calls made while
+    handling a request, with their nesting, wall time, number of SQL
+    statements and number of Solr calls. Only sysadmins can see them.
+
+    :param limit: the maximum number of profiles to return, newest first
+        (optional)
+    :type limit: int
+
+    :rtype: list of dictionaries
+    '''
+    _check_access('action_profile_list', context, data_dict)
+
+    profiles = profiler.profiles()
+    limit = data_dict.get('limit')
+    if limit is not None:
+        try:
+            limit = int(limit)
+        except ValueError:
+            raise ValidationError({'limit': [_('Invalid integer')]})
+        profiles = profiles[:limit]
+    return profiles
@@ -20,6 +20,7 @@ import ckan.lib.plugins as lib_plugins
 import ckan.lib.search as search
 import ckan.lib.uploader as uploader
 import ckan.lib.app_globals as app_globals
+import ckan.lib.term_translations as term_translations
 
 
 from ckan.common import _, request
@@ -779,6 +780,7 @@ def term_translation_update(context, data_dict):
 
     if not context.get('defer_commit'):
         model.Session.commit()
+    term_translations.cache.invalidate([data['term']])
 
     return data
 
@@ -810,6 +812,9 @@ def term_translation_update_many(context, data_dict):
         action(context, row)
 
     model.Session.commit()
+    # drop anything cached from other threads before the commit
+    term_translations.cache.invalidate(
+        [row.get('term') for row in data_dict['data']])
 
     return {'success': '%s rows updated' % (num + 1)}
 
@@ -1279,6 +1284,7 @@ def config_option_update(context, data_dict):
 
     # Update the config update timestamp
     model.set_system_info('ckan.config_update', str(time.time()))
+    app_globals.publish_config_update()
 
     log.info('Updated config options: {0}'.format(data))
 
@@ -315,3 +315,8 @@ def config_option_show(context, data_dict):
 def config_option_list(context, data_dict):
     '''List runtime-editable configuration options. Only sysadmins.'''
     return {'success': False}
+
+
+def action_profile_list(context, data_dict):
+    '''List the latest request profiles. Only sysadmins.'''
+    return {'success': False}
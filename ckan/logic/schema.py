@@ -592,6 +592,7 @@ def default_package_search_schema():
         'rows': [ignore_missing, natural_number_validator],
         'sort': [ignore_missing, unicode],
         'start': [ignore_missing, natural_number_validator],
+        'cursor': [ignore_missing, unicode],
         'qf': [ignore_missing, unicode],
         'facet': [ignore_missing, unicode],
         'facet.mincount': [ignore_missing, natural_number_validator],
@@ -0,0 +1,20 @@
+def upgrade(migrate_engine):
+    migrate_engine.execute(
+        '''
+        CREATE TABLE activity_fanout (
+            target_id text NOT NULL,
+            activity_id text NOT NULL,
+            timestamp timestamp without time zone,
+            CONSTRAINT activity_fanout_pkey
+                PRIMARY KEY (target_id, activity_id),
+            CONSTRAINT activity_fanout_activity_id_fkey
+                FOREIGN KEY (activity_id)
+                REFERENCES activity(id) ON DELETE CASCADE
+        );
+
+        CREATE INDEX idx_activity_fanout_target_id_timestamp
+            ON activity_fanout (target_id, timestamp DESC);
+        CREATE INDEX idx_activity_fanout_activity_id
+            ON activity_fanout (activity_id);
+        '''
+    )
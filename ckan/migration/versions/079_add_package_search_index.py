@@ -0,0 +1,13 @@
+def upgrade(migrate_engine):
+    migrate_engine.execute(
+        '''
+        CREATE TABLE package_search_index (
+            package_id text NOT NULL,
+            document tsvector,
+            CONSTRAINT package_search_index_pkey PRIMARY KEY (package_id)
+        );
+
+        CREATE INDEX idx_package_search_index_document
+            ON package_search_index USING gin (document);
+        '''
+    )
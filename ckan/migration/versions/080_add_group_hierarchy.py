@@ -0,0 +1,31 @@
+def upgrade(migrate_engine):
+    migrate_engine.execute(
+        '''
+        CREATE TABLE group_hierarchy (
+            ancestor_id text NOT NULL,
+            descendant_id text NOT NULL,
+            depth integer NOT NULL,
+            CONSTRAINT group_hierarchy_pkey
+                PRIMARY KEY (ancestor_id, descendant_id)
+        );
+
+        CREATE INDEX idx_group_hierarchy_descendant_id
+            ON group_hierarchy (descendant_id);
+
+        INSERT INTO group_hierarchy (ancestor_id, descendant_id, depth)
+        WITH RECURSIVE path(descendant_id, ancestor_id, depth) AS
+        (
+            SELECT group_id, table_id, 1 FROM member
+            WHERE table_name = 'group' AND state = 'active'
+            UNION
+            SELECT path.descendant_id, member.table_id, path.depth + 1
+            FROM path, member
+            WHERE member.group_id = path.ancestor_id
+                  AND member.table_name = 'group'
+                  AND member.state = 'active' AND path.depth <= 8
+        )
+        SELECT ancestor_id, descendant_id, min(depth) FROM path
+            WHERE ancestor_id <> descendant_id
+            GROUP BY ancestor_id, descendant_id;
+        '''
+    )
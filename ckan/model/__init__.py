@@ -129,10 +129,17 @@ from activity import (
     ActivityDetail,
     activity_table,
     activity_detail_table,
+    activity_fanout_table,
 )
 from term_translation import (
     term_translation_table,
 )
+from search_index import (
+    package_search_index_table,
+)
+from group_hierarchy import (
+    group_hierarchy_table,
+)
 from follower import (
     UserFollowingUser,
     UserFollowingDataset,
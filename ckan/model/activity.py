@@ -1,7 +1,8 @@
 import datetime
 
 from sqlalchemy import (
-    orm, types, Column, Table, ForeignKey, desc, or_, union_all)
+    orm, types, Column, Table, ForeignKey, desc, or_, and_, union_all,
+    select, exists, true)
 
 import ckan.model
 import meta
@@ -10,6 +11,7 @@ import domain_object
 
 __all__ = ['Activity', 'activity_table',
            'ActivityDetail', 'activity_detail_table',
+           'activity_fanout_table',
            ]
 
 activity_table = Table(
@@ -33,6 +35,16 @@ activity_detail_table = Table(
     Column('data', _types.JsonDictType),
     )
 
+# One row for each activity stream an activity appears in: the stream of the
+# activity's object, of its user and of each group its dataset belongs to.
+activity_fanout_table = Table(
+    'activity_fanout', meta.metadata,
+    Column('target_id', types.UnicodeText, primary_key=True),
+    Column('activity_id', types.UnicodeText,
+           ForeignKey('activity.id', ondelete='CASCADE'), primary_key=True),
+    Column('timestamp', types.DateTime),
+    )
+
 class Activity(domain_object.DomainObject):
 
     def __init__(self, user_id, object_id, revision_id, activity_type,
@@ -69,12 +81,112 @@ class ActivityDetail(domain_object.DomainObject):
         return ckan.model.Session.query(cls) \
                 .filter_by(activity_id = activity_id).all()
 
+    @classmethod
+    def by_activity_ids(cls, activity_ids):
+        '''Return the details of all the given activities in one query.'''
+        if not activity_ids:
+            return []
+        return ckan.model.Session.query(cls) \
+                .filter(cls.activity_id.in_(activity_ids)).all()
+
 
 meta.mapper(ActivityDetail, activity_detail_table, properties = {
     'activity':orm.relation ( Activity, backref=orm.backref('activity_detail'))
     })
 
 
+_FANOUT_COLUMNS = ['target_id', 'activity_id', 'timestamp']
+
+
+def _group_fanout_select(activity_filter):
+    '''
+    Return a select of the missing activity_fanout rows of the groups of the
+    datasets whose activities match activity_filter.
+
+    As in group.packages(), only active, public datasets are included.
+    '''
+    import ckan.model as model
+    member = model.member_table
+    package = model.package_table
+    fanout = activity_fanout_table
+    return select([member.c.group_id, activity_table.c.id,
+                   activity_table.c.timestamp]).where(and_(
+        activity_filter,
+        member.c.table_id == activity_table.c.object_id,
+        member.c.table_name == 'package',
+        member.c.state == 'active',
+        package.c.id == activity_table.c.object_id,
+        package.c.state == 'active',
+        package.c.private == False,
+        ~exists().where(and_(fanout.c.target_id == member.c.group_id,
+                             fanout.c.activity_id == activity_table.c.id)),
+        )).distinct()
+
+
+def fan_out_activities(session, activities):
+    '''
+    Add the activity_fanout rows of newly created activities.
+
+    Each activity is added to the streams of its object and its user and,
+    for datasets, of the groups the dataset belongs to.
+    '''
+    rows = []
+    for activity in activities:
+        for target_id in set([activity.object_id, activity.user_id]):
+            if target_id:
+                rows.append({'target_id': target_id,
+                             'activity_id': activity.id,
+                             'timestamp': activity.timestamp})
+    if not rows:
+        return
+    session.execute(activity_fanout_table.insert(), rows)
+    session.execute(activity_fanout_table.insert().from_select(
+        _FANOUT_COLUMNS, _group_fanout_select(
+            activity_table.c.id.in_([activity.id
+                                     for activity in activities]))))
+
+
+def refresh_package_fanout(session, package_ids):
+    '''
+    Rebuild the group activity_fanout rows of the given datasets' activities.
+
+    Call this when datasets are added to or removed from groups, or are
+    deleted or made private, so that group streams keep showing the
+    activities of the group's current datasets.
+    '''
+    import ckan.model as model
+    package_activities = select([activity_table.c.id]).where(
+        activity_table.c.object_id.in_(package_ids))
+    session.execute(activity_fanout_table.delete().where(and_(
+        activity_fanout_table.c.activity_id.in_(package_activities),
+        activity_fanout_table.c.target_id.in_(
+            select([model.group_table.c.id])))))
+    session.execute(activity_fanout_table.insert().from_select(
+        _FANOUT_COLUMNS, _group_fanout_select(
+            activity_table.c.object_id.in_(package_ids))))
+
+
+def rebuild_activity_fanout(session):
+    '''
+    Rebuild the activity_fanout table from all the existing activities.
+    '''
+    session.execute(activity_fanout_table.delete())
+    session.execute(activity_fanout_table.insert().from_select(
+        _FANOUT_COLUMNS,
+        select([activity_table.c.object_id, activity_table.c.id,
+                activity_table.c.timestamp]).where(
+            activity_table.c.object_id != None)))
+    session.execute(activity_fanout_table.insert().from_select(
+        _FANOUT_COLUMNS,
+        select([activity_table.c.user_id, activity_table.c.id,
+                activity_table.c.timestamp]).where(and_(
+            activity_table.c.user_id != None,
+            or_(activity_table.c.object_id == None,
+                activity_table.c.user_id != activity_table.c.object_id)))))
+    session.execute(activity_fanout_table.insert().from_select(
+        _FANOUT_COLUMNS, _group_fanout_select(true())))
+
+
 def _activities_limit(q, limit, offset=None):
     '''
     Return an SQLAlchemy query for all activities at an offset with a limit.
@@ -170,24 +282,14 @@ def _group_activity_query(group_id):
     '''Return an SQLAlchemy query for all activities about group_id.
 
     Returns a query for all activities whose object is either the group itself
-    or one of the group's datasets.
+    or one of the group's datasets, read from the activity_fanout table.
 
     '''
     import ckan.model as model
-
-    group = model.Group.get(group_id)
-    if not group:
-        # Return a query with no results.
-        return model.Session.query(model.Activity).filter("0=1")
-
-    dataset_ids = [dataset.id for dataset in group.packages()]
-
     q = model.Session.query(model.Activity)
-    if dataset_ids:
-        q = q.filter(or_(model.Activity.object_id == group_id,
-            model.Activity.object_id.in_(dataset_ids)))
-    else:
-        q = q.filter(model.Activity.object_id == group_id)
+    q = q.join(activity_fanout_table,
+               activity_fanout_table.c.activity_id == model.Activity.id)
+    q = q.filter(activity_fanout_table.c.target_id == group_id)
     return q
 
 
@@ -202,8 +304,9 @@ def group_activity_list(group_id, limit, offset):
     etc.
 
     '''
-    q = _group_activity_query(group_id)
-    return _activities_at_offset(q, limit, offset)
+    q = _fanout_activities_query(
+        activity_fanout_table.c.target_id == group_id, limit, offset)
+    return q.all()
 
 
 def _activites_from_users_followed_by_user_query(user_id, limit):
@@ -278,11 +381,61 @@ def activities_from_everything_followed_by_user(user_id, limit, offset):
     return _activities_at_offset(q, limit, offset)
 
 
-def _dashboard_activity_query(user_id, limit):
-    '''Return an SQLAlchemy query for user_id's dashboard activity stream.'''
-    q1 = _user_activity_query(user_id, limit)
-    q2 = _activities_from_everything_followed_by_user_query(user_id, limit)
-    return _activities_union_all(q1, q2)
+def _fanout_activities_query(target_filter, limit, offset, distinct=False):
+    '''Return an SQLAlchemy query for a page of the activities of the
+    activity_fanout rows matching target_filter, newest first.
+
+    The page is taken from the activity_fanout rows, in the order of their
+    timestamp, before the activities are joined, so that it is read with
+    range scans of the (target_id, timestamp) index. Use distinct when an
+    activity may have rows for more than one of the targets.
+
+    '''
+    import ckan.model as model
+    fanout = activity_fanout_table
+    page = select([fanout.c.activity_id, fanout.c.timestamp]).where(
+        target_filter)
+    if distinct:
+        page = page.distinct()
+    page = page.order_by(desc(fanout.c.timestamp))
+    if offset:
+        page = page.offset(offset)
+    if limit:
+        page = page.limit(limit)
+    page = page.alias('fanout_page')
+    q = model.Session.query(model.Activity)
+    q = q.join(page, page.c.activity_id == model.Activity.id)
+    return q.order_by(desc(page.c.timestamp))
+
+
+def _dashboard_target_filter(user_id):
+    '''Return the filter of the activity_fanout rows of user_id's dashboard,
+    i.e. the rows of the user and of everything the user follows.'''
+    import ckan.model as model
+    fanout = activity_fanout_table
+    followees = union_all(*[
+        select([table.c.object_id]).where(table.c.follower_id == user_id)
+        for table in (model.follower.user_following_user_table,
+                      model.follower.user_following_dataset_table,
+                      model.follower.user_following_group_table)])
+    return or_(fanout.c.target_id == user_id,
+               fanout.c.target_id.in_(followees))
+
+
+def _dashboard_activity_query(user_id):
+    '''Return an SQLAlchemy query for user_id's dashboard activity stream.
+
+    The activities are read from the activity_fanout rows of the user and
+    of everything the user follows, so this is a single query however many
+    users, datasets and groups are followed.
+
+    '''
+    import ckan.model as model
+    activity_ids = select([activity_fanout_table.c.activity_id]).where(
+        _dashboard_target_filter(user_id))
+    q = model.Session.query(model.Activity)
+    q = q.filter(model.Activity.id.in_(activity_ids))
+    return q
 
 
 def dashboard_activity_list(user_id, limit, offset):
@@ -295,8 +448,29 @@ def dashboard_activity_list(user_id, limit, offset):
     activities_from_everything_followed_by_user(user_id).
 
     '''
-    q = _dashboard_activity_query(user_id, limit + offset)
-    return _activities_at_offset(q, limit, offset)
+    # an activity may be fanned out to the user and to their followees
+    q = _fanout_activities_query(_dashboard_target_filter(user_id),
+                                 limit, offset, distinct=True)
+    return q.all()
+
+
+def dashboard_new_activities_count(user_id, since, limit,
+                                   hidden_user_ids=None):
+    '''Return the number of new activities in the user's dashboard.
+
+    Counts the activities in user_id's dashboard activity stream newer than
+    since, up to limit. The user's own activities and the activities of
+    hidden_user_ids are not counted.
+
+    '''
+    import ckan.model as model
+    q = _dashboard_activity_query(user_id)
+    q = q.filter(model.Activity.timestamp > since)
+    q = q.filter(model.Activity.user_id != user_id)
+    if hidden_user_ids:
+        q = q.filter(~model.Activity.user_id.in_(hidden_user_ids))
+    return q.limit(limit).count()
+
 
 def _changed_packages_activity_query():
     '''Return an SQLAlchemyu query for all changed package activities.
@@ -8,6 +8,7 @@ import core
 import package as _package
 import types as _types
 import domain_object
+import group_hierarchy as _group_hierarchy
 import user as _user
 
 __all__ = ['group_table', 'Group',
@@ -140,8 +141,11 @@ class Group(vdm.sqlalchemy.RevisionedObjectMixin,
     @classmethod
     def get(cls, reference):
         '''Returns a group object referenced by its id or name.'''
-        query = meta.Session.query(cls).filter(cls.id == reference)
-        group = query.first()
+        # by id from the session's identity map if it is there, as
+        # authorization looks the same groups up again and again
+        group = None
+        if reference:
+            group = meta.Session.query(cls).get(reference)
         if group is None:
             group = cls.by_name(reference)
         return group
@@ -202,11 +206,22 @@ class Group(vdm.sqlalchemy.RevisionedObjectMixin,
         [(u'8ac0...', u'national-health-service', u'National Health Service', u'e041...'),
          (u'b468...', u'nhs-wirral-ccg', u'NHS Wirral CCG', u'8ac0...')]
         '''
-        results = meta.Session.query(Group.id, Group.name, Group.title,
-                                     'parent_id').\
-            from_statement(HIERARCHY_DOWNWARDS_CTE).\
-            params(id=self.id, type=type).all()
-        return results
+        hierarchy = _group_hierarchy.group_hierarchy_table
+        descendant_ids = meta.Session.query(hierarchy.c.descendant_id).\
+            filter(hierarchy.c.ancestor_id == self.id)
+        return meta.Session.query(Group.id, Group.name, Group.title,
+                                  Member.table_id.label('parent_id')).\
+            join(hierarchy, hierarchy.c.descendant_id == Group.id).\
+            join(Member,
+                 and_(Member.group_id == Group.id,
+                      Member.table_name == 'group',
+                      Member.state == 'active')).\
+            filter(hierarchy.c.ancestor_id == self.id).\
+            filter(or_(Member.table_id == self.id,
+                       Member.table_id.in_(descendant_ids.subquery()))).\
+            filter(Group.type == type).\
+            filter(Group.state == 'active').\
+            order_by(hierarchy.c.depth).all()
 
     def get_parent_groups(self, type='group'):
         '''Returns this group's parent groups.
@@ -226,9 +241,13 @@ class Group(vdm.sqlalchemy.RevisionedObjectMixin,
     def get_parent_group_hierarchy(self, type='group'):
         '''Returns this group's parent, parent's parent, parent's parent's
         parent etc.. Sorted with the top level parent first.'''
+        hierarchy = _group_hierarchy.group_hierarchy_table
         return meta.Session.query(Group).\
-            from_statement(HIERARCHY_UPWARDS_CTE).\
-            params(id=self.id, type=type).all()
+            join(hierarchy, hierarchy.c.ancestor_id == Group.id).\
+            filter(hierarchy.c.descendant_id == self.id).\
+            filter(Group.type == type).\
+            filter(Group.state == 'active').\
+            order_by(hierarchy.c.depth.desc()).all()
 
     @classmethod
     def get_top_level_groups(cls, type='group'):
@@ -248,19 +267,19 @@ class Group(vdm.sqlalchemy.RevisionedObjectMixin,
     def groups_allowed_to_be_its_parent(self, type='group'):
         '''Returns a list of the groups (of the specified type) which are
         allowed to be this group's parent. It excludes ones which would
-        create a loop in the hierarchy, causing the recursive CTE to
-        be in an infinite loop.
+        create a loop in the hierarchy, i.e. this group and the ones
+        underneath it.
 
         :returns: A list of group objects ordered by group title
 
         '''
-        all_groups = self.all(group_type=type)
-        excluded_groups = set(group_name
-                              for group_id, group_name, group_title, parent in
-                              self.get_children_group_hierarchy(type=type))
-        excluded_groups.add(self.name)
-        return [group for group in all_groups
-                if group.name not in excluded_groups]
+        hierarchy = _group_hierarchy.group_hierarchy_table
+        excluded_ids = set(row[0] for row in meta.Session.query(
+            hierarchy.c.descendant_id).filter(
+                hierarchy.c.ancestor_id == self.id))
+        excluded_ids.add(self.id)
+        return [group for group in self.all(group_type=type)
+                if group.id not in excluded_ids]
 
     def packages(self, with_private=False, limit=None,
             return_query=False, context=None):
@@ -397,41 +416,5 @@ MemberRevision = vdm.sqlalchemy.create_object_version(meta.mapper, Member,
 #TODO
 MemberRevision.related_packages = lambda self: [self.continuity.package]
 
-# Should there arise a bug that allows loops in the group hierarchy, then it
-# will lead to infinite recursion, tieing up postgres processes at 100%, and
-# the server will suffer. To avoid ever failing this badly, we put in this
-# limit on recursion.
-MAX_RECURSES = 8
-
-HIERARCHY_DOWNWARDS_CTE = """WITH RECURSIVE child(depth) AS
-(
-    -- non-recursive term
-    SELECT 0, * FROM member
-    WHERE table_id = :id AND table_name = 'group' AND state = 'active'
-    UNION ALL
-    -- recursive term
-    SELECT c.depth + 1, m.* FROM member AS m, child AS c
-    WHERE m.table_id = c.group_id AND m.table_name = 'group'
-          AND m.state = 'active' AND c.depth < {max_recurses}
-)
-SELECT G.id, G.name, G.title, child.depth, child.table_id as parent_id FROM child
-    INNER JOIN public.group G ON G.id = child.group_id
-    WHERE G.type = :type AND G.state='active'
-    ORDER BY child.depth ASC;""".format(max_recurses=MAX_RECURSES)
-
-HIERARCHY_UPWARDS_CTE = """WITH RECURSIVE parenttree(depth) AS (
-    -- non-recursive term
-    SELECT 0, M.* FROM public.member AS M
-    WHERE group_id = :id AND M.table_name = 'group' AND M.state = 'active'
-    UNION
-    -- recursive term
-    SELECT PG.depth + 1, M.* FROM parenttree PG, public.member M
-    WHERE PG.table_id = M.group_id AND M.table_name = 'group'
-          AND M.state = 'active' AND PG.depth < {max_recurses}
-    )
-
-SELECT G.*, PT.depth FROM parenttree AS PT
-    INNER JOIN public.group G ON G.id = PT.table_id
-    WHERE G.type = :type AND G.state='active'
-    ORDER BY PT.depth DESC;""".format(max_recurses=MAX_RECURSES)
-
+# The limit on the depth of the hierarchy, see ckan.model.group_hierarchy
+MAX_RECURSES = _group_hierarchy.MAX_RECURSES
@@ -0,0 +1,126 @@
+'''The group hierarchy, as a closure table.
+
+The table has a row for every group above another one in the hierarchy, i.e.
+for each of its parents, parents' parents etc., with the number of levels
+between them (1 for a parent). It follows the active memberships of groups
+in groups (the ``member`` rows with ``table_name = 'group'``) through any
+group, so the hierarchy of a type of group is read by joining the ``group``
+table and filtering on its type and state.
+
+The rows are updated when the session flushes changes to the memberships of
+groups (see :py:func:`flushed`). ``paster group-hierarchy`` checks and
+rebuilds the table.
+
+'''
+import itertools
+
+from sqlalchemy import Column, Index, Table, select, text
+from sqlalchemy.types import Integer, UnicodeText
+import sqlalchemy.orm as orm
+
+import meta
+
+__all__ = ['group_hierarchy_table']
+
+group_hierarchy_table = Table(
+    'group_hierarchy', meta.metadata,
+    Column('ancestor_id', UnicodeText, primary_key=True),
+    Column('descendant_id', UnicodeText, primary_key=True),
+    Column('depth', Integer, nullable=False),
+)
+
+Index('idx_group_hierarchy_descendant_id',
+      group_hierarchy_table.c.descendant_id)
+
+# Should there arise a bug that allows loops in the group hierarchy, then
+# following them would never end. To avoid ever failing this badly, only the
+# groups up to MAX_RECURSES levels above a group's parents are recorded.
+MAX_RECURSES = 8
+
+# The rows of the groups whose parent memberships match the condition
+PATHS_QUERY = '''WITH RECURSIVE path(descendant_id, ancestor_id, depth) AS
+(
+    SELECT group_id, table_id, 1 FROM member
+    WHERE table_name = 'group' AND state = 'active' {condition}
+    UNION
+    SELECT path.descendant_id, member.table_id, path.depth + 1
+    FROM path, member
+    WHERE member.group_id = path.ancestor_id AND member.table_name = 'group'
+          AND member.state = 'active' AND path.depth <= {max_recurses}
+)
+SELECT ancestor_id, descendant_id, min(depth) AS depth FROM path
+    WHERE ancestor_id <> descendant_id
+    GROUP BY ancestor_id, descendant_id'''
+
+
+def _paths_query(condition=''):
+    return PATHS_QUERY.format(condition=condition,
+                              max_recurses=MAX_RECURSES)
+
+
+def _insert(session, condition='', params=None):
+    session.execute(text(
+        'INSERT INTO group_hierarchy (ancestor_id, descendant_id, depth) '
+        + _paths_query(condition)), params or {})
+
+
+def update(session, group_ids):
+    '''Recompute the rows of the given groups, and of the groups underneath
+    them, from the memberships.'''
+    table = group_hierarchy_table
+    group_ids = set(group_ids)
+    if not group_ids:
+        return
+    # Changing the parents of a group changes what is above the groups
+    # underneath it too, but not what is underneath it
+    rows = session.execute(select([table.c.descendant_id]).where(
+        table.c.ancestor_id.in_(group_ids)))
+    group_ids.update(row[0] for row in rows)
+    group_ids = list(group_ids)
+
+    session.execute(table.delete().where(
+        table.c.descendant_id.in_(group_ids)))
+    _insert(session, 'AND group_id = ANY(:ids)', {'ids': group_ids})
+
+
+def flushed(session):
+    '''Update the rows of the groups whose memberships of groups the
+    session flushed.'''
+    group_ids = set()
+    for obj in itertools.chain(session.new, session.dirty, session.deleted):
+        if obj.__class__.__name__ != 'Member':
+            continue
+        table_names = orm.attributes.get_history(obj, 'table_name').sum()
+        if 'group' in table_names:
+            # the group it was a member of too, if that changed
+            group_ids.update(
+                orm.attributes.get_history(obj, 'group_id').sum())
+    group_ids.discard(None)
+    update(session, group_ids)
+
+
+def rebuild(session):
+    '''Recompute the whole table from the memberships. Returns the number of
+    rows.'''
+    session.execute(group_hierarchy_table.delete())
+    _insert(session)
+    return session.execute(
+        'SELECT count(*) FROM group_hierarchy').scalar()
+
+
+def check(session):
+    '''Compare the table with the memberships. Returns a list of the rows
+    that are wrong, as tuples of the ancestor and descendant ids, the
+    expected depth and the recorded depth (None for a missing or an extra
+    row).'''
+    rows = session.execute(text(
+        '''SELECT coalesce(expected.ancestor_id, gh.ancestor_id),
+                  coalesce(expected.descendant_id, gh.descendant_id),
+                  expected.depth, gh.depth
+           FROM ({paths}) AS expected
+           FULL OUTER JOIN group_hierarchy AS gh
+               ON gh.ancestor_id = expected.ancestor_id
+               AND gh.descendant_id = expected.descendant_id
+           WHERE expected.depth IS DISTINCT FROM gh.depth
+           ORDER BY 1, 2'''.format(paths=_paths_query())))
+    return [tuple(row) for row in rows]
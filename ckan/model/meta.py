@@ -1,33 +1,32 @@
 import datetime
+import threading
 
 from paste.deploy.converters import asbool
 from pylons import config
 """SQLAlchemy Metadata and Session object"""
-from sqlalchemy import MetaData, and_
+from sqlalchemy import MetaData, and_, event
 import sqlalchemy.orm as orm
 from sqlalchemy.orm.session import SessionExtension
 
 import extension
 import ckan.lib.activity_streams_session_extension as activity
+import ckan.lib.helper_cache as helper_cache
+import ckan.lib.page_cache as page_cache
+import ckan.lib.permission_cache as permission_cache
+import ckan.lib.user_cache as user_cache
 
-__all__ = ['Session', 'engine_is_sqlite', 'engine_is_pg']
+__all__ = ['Session', 'engine_is_sqlite', 'engine_is_pg', 'QueryCounter']
 
 
 class CkanCacheExtension(SessionExtension):
     ''' This extension checks what tables have been affected by
     database access and allows us to act on them. Currently this is
     used by the page cache to flush the cache when data in the database
-    is altered. '''
-
-    def __init__(self, *args, **kw):
-        super(CkanCacheExtension, self).__init__(*args, **kw)
-        # Setup Redis support if needed.
-        self.use_redis = asbool(config.get('ckan.page_cache_enabled'))
-        if self.use_redis:
-            import redis
-            self.redis = redis
-            self.redis_connection is None
-            self.redis_exception = redis.exceptions.ConnectionError
+    is altered, and to invalidate the cached values of template helpers,
+    users and permissions. '''
+
+    def after_flush(self, session, flush_context):
+        permission_cache.flushed(session)
 
     def after_commit(self, session):
         if hasattr(session, '_object_cache'):
@@ -38,18 +37,17 @@ class CkanCacheExtension(SessionExtension):
             objs = set()
             for item in oc_list:
                 objs.add(item.__class__.__name__)
+            helper_cache.invalidate_changed(objs)
+            user_cache.invalidate_changed(oc_list)
+            permission_cache.committed(session, oc_list)
+
+            # Purge the cached pages showing the changed objects
+            if asbool(config.get('ckan.page_cache_enabled')):
+                page_cache.purge_changed(oc_list)
+
+    def after_rollback(self, session):
+        permission_cache.rolled_back(session)
 
-        # Flush Redis
-        if self.use_redis:
-            if self.redis_connection is None:
-                try:
-                    self.redis_connection = self.redis.StrictRedis()
-                except self.redis_exception:
-                    pass
-            try:
-                self.redis_connection.flushdb()
-            except self.redis_exception:
-                pass
 
 class CkanSessionExtension(SessionExtension):
 
@@ -66,6 +64,11 @@ class CkanSessionExtension(SessionExtension):
         session._object_cache['deleted'].update(session.deleted)
         session._object_cache['changed'].update(changed)
 
+    def after_flush(self, session, flush_context):
+        # imported here, as the module defines its table on this module's
+        # metadata
+        import group_hierarchy
+        group_hierarchy.flushed(session)
 
     def before_commit(self, session):
         session.flush()
@@ -130,7 +133,8 @@ Session = orm.scoped_session(orm.sessionmaker(
     extension=[CkanCacheExtension(),
                CkanSessionExtension(),
                extension.PluginSessionExtension(),
-               activity.DatasetActivitySessionExtension()],
+               activity.DatasetActivitySessionExtension(),
+               activity.ActivityFanoutSessionExtension()],
 ))
 
 create_local_session = orm.sessionmaker(
@@ -140,7 +144,8 @@ create_local_session = orm.sessionmaker(
     extension=[CkanCacheExtension(),
                CkanSessionExtension(),
                extension.PluginSessionExtension(),
-               activity.DatasetActivitySessionExtension()],
+               activity.DatasetActivitySessionExtension(),
+               activity.ActivityFanoutSessionExtension()],
 )
 
 #mapper = Session.mapper
@@ -161,3 +166,33 @@ def engine_is_pg(sa_engine=None):
     # According to http://docs.sqlalchemy.org/en/latest/core/engines.html#postgresql
     # all Postgres driver names start with `postgres`
     return (sa_engine or engine).url.drivername.startswith('postgres')
+
+
+class QueryCounter(object):
+    '''Counts the SQL statements executed by the current thread on the
+    engine while it is active, e.g.::
+
+        with QueryCounter() as counter:
+            ...
+        print counter.count
+
+    '''
+    def __init__(self, sa_engine=None):
+        self.engine = sa_engine or engine
+        self.count = 0
+        self._thread = None
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters,
+                               context, executemany):
+        if threading.current_thread() is self._thread:
+            self.count += 1
+
+    def __enter__(self):
+        self._thread = threading.current_thread()
+        event.listen(self.engine, 'before_cursor_execute',
+                     self._before_cursor_execute)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        event.remove(self.engine, 'before_cursor_execute',
+                     self._before_cursor_execute)
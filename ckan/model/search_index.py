@@ -0,0 +1,15 @@
+from sqlalchemy import Column, Table
+from sqlalchemy.types import UnicodeText
+from sqlalchemy.dialects.postgresql import TSVECTOR
+
+import meta
+
+__all__ = ['package_search_index_table']
+
+# The full text documents of the datasets, used by the SQL search backend
+# (see ckan.lib.search.sql) when ckan.simple_search is on.
+package_search_index_table = Table(
+    'package_search_index', meta.metadata,
+    Column('package_id', UnicodeText, primary_key=True),
+    Column('document', TSVECTOR),
+)
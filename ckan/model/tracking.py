@@ -36,6 +36,24 @@ class TrackingSummary(domain_object.DomainObject):
 
         return {'total' : 0, 'recent' : 0}
 
+    @classmethod
+    def get_for_packages(cls, package_ids):
+        '''Return the tracking summaries of several packages, as
+        get_for_package would, with one query.'''
+        summaries = dict((package_id, {'total': 0, 'recent': 0})
+                         for package_id in package_ids)
+        if not summaries:
+            return summaries
+        q = meta.Session.query(cls.package_id, cls.running_total,
+                               cls.recent_views).autoflush(False)
+        q = q.filter(cls.package_id.in_(summaries.keys()))
+        q = q.distinct(cls.package_id).order_by(
+            cls.package_id, cls.tracking_date.desc())
+        for package_id, running_total, recent_views in q:
+            summaries[package_id] = {'total': running_total,
+                                     'recent': recent_views}
+        return summaries
+
 
     @classmethod
     def get_for_resource(cls, url):
@@ -57,11 +57,61 @@ class User(vdm.sqlalchemy.StatefulObjectMixin,
         # by browsers, so correct that for the openid lookup
         corrected_openid_user_ref = cls.DOUBLE_SLASH.sub('://\\1',
                                                          user_reference)
-        query = meta.Session.query(cls).autoflush(False)
-        query = query.filter(or_(cls.name == user_reference,
-                                 cls.openid == corrected_openid_user_ref,
-                                 cls.id == user_reference))
-        return query.first()
+        user = cls._get_known(
+            user_reference,
+            lambda user: user_reference in (user.name, user.id) or
+            user.openid == corrected_openid_user_ref)
+        if user is None:
+            query = meta.Session.query(cls).autoflush(False)
+            query = query.filter(or_(cls.name == user_reference,
+                                     cls.openid == corrected_openid_user_ref,
+                                     cls.id == user_reference))
+            user = query.first()
+            cls.remember(user, user_reference)
+        return user
+
+    @classmethod
+    def by_name(cls, name, autoflush=True):
+        user = cls._get_known(name, lambda user: user.name == name)
+        if user is None:
+            user = super(User, cls).by_name(name, autoflush)
+            cls.remember(user, name)
+        return user
+
+    @classmethod
+    def by_apikey(cls, apikey):
+        user = cls._get_known(('apikey', apikey),
+                              lambda user: user.apikey == apikey)
+        if user is None:
+            user = meta.Session.query(cls).filter_by(apikey=apikey).first()
+            cls.remember(user, ('apikey', apikey))
+        return user
+
+    @classmethod
+    def remember(cls, user, *references):
+        '''Remember the user found by the given references (names, ids,
+        ...) until the end of the current request, so that looking them up
+        again does not query the database.'''
+        if user is None:
+            return
+        known = meta.Session().info.setdefault('ckan.users', {})
+        for reference in references + (user.id, user.name,
+                                       ('apikey', user.apikey)):
+            known[reference] = user.id
+
+    @classmethod
+    def _get_known(cls, reference, matches):
+        # The session is removed at the end of each request, and with it
+        # the users remembered during the request. The user is taken from
+        # the session's identity map, and is only returned if it still
+        # matches the reference, e.g. it has not been renamed since.
+        user_id = meta.Session().info.get('ckan.users', {}).get(reference)
+        if user_id is None:
+            return None
+        user = meta.Session.query(cls).autoflush(False).get(user_id)
+        if user is not None and matches(user):
+            return user
+        return None
 
     @classmethod
     def all(cls):
@@ -546,6 +546,10 @@ class IPackageController(Interface):
             from fields starting with `ext_`, so extensions can receive user
             input from specific fields.
 
+            When the results are going to be displayed, before_view is
+            called on each of them after after_search, so this is the place
+            to fetch anything the whole page of results will need.
+
         '''
 
         return search_results
@@ -560,6 +564,15 @@ class IPackageController(Interface):
         '''
         return pkg_dict
 
+    def before_index_batch(self, pkg_dicts):
+        '''
+             Extensions will receive the list of dicts of a batch of
+             datasets indexed together, before before_index is called on
+             each of them, so they can fetch what the whole batch needs at
+             once. The dicts should not be modified here.
+        '''
+        pass
+
     def before_view(self, pkg_dict):
         '''
              Extensions will recieve this before the dataset gets
@@ -1,4 +1,10 @@
+import os
+
+import mock
+
+import ckan.lib.page_cache as page_cache
 import ckan.tests.helpers as helpers
+from ckan.config.middleware import PageCacheMiddleware, TrackingBuffer
 
 from nose.tools import assert_equals, assert_not_equals
 from routes import url_for
@@ -8,3 +14,151 @@ class TestPylonsResponseCleanupMiddleware(helpers.FunctionalTestBase):
     @classmethod
     def _apply_config_changes(cls, config):
         config['ckan.use_pylons_response_cleanup_middleware'] = True
+
+
+class TestTrackingBuffer(object):
+    def _buffer(self, **kwargs):
+        engine = mock.Mock()
+        tracking_buffer = TrackingBuffer(engine, **kwargs)
+        # don't start the background thread, so that the events are only
+        # written by flush()
+        tracking_buffer._pid = os.getpid()
+        return tracking_buffer, engine
+
+    def test_events_are_written_in_one_insert(self):
+        tracking_buffer, engine = self._buffer()
+
+        tracking_buffer.add('key1', '/dataset/a', 'page')
+        tracking_buffer.add('key2', '/dataset/b', 'page')
+        written = tracking_buffer.flush()
+
+        assert_equals(written, 2)
+        assert_equals(engine.execute.call_count, 1)
+        params = engine.execute.call_args[0][1:]
+        assert_equals(params[0:3], ('key1', '/dataset/a', 'page'))
+        assert_equals(params[4:7], ('key2', '/dataset/b', 'page'))
+
+    def test_flush_writes_batches_of_buffer_size(self):
+        tracking_buffer, engine = self._buffer(size=2)
+
+        for i in range(3):
+            tracking_buffer.add('key', '/dataset/{0}'.format(i), 'page')
+        tracking_buffer.flush()
+
+        assert_equals(engine.execute.call_count, 2)
+
+    def test_flush_empties_the_buffer(self):
+        tracking_buffer, engine = self._buffer()
+
+        tracking_buffer.add('key', '/dataset/a', 'page')
+        tracking_buffer.flush()
+
+        assert_equals(tracking_buffer.flush(), 0)
+        assert_equals(engine.execute.call_count, 1)
+
+    def test_events_over_max_size_are_dropped(self):
+        tracking_buffer, engine = self._buffer(max_size=2)
+
+        for i in range(5):
+            tracking_buffer.add('key', '/dataset/{0}'.format(i), 'page')
+
+        assert_equals(tracking_buffer.dropped, 3)
+        assert_equals(tracking_buffer.flush(), 2)
+
+    def test_failed_writes_are_counted_as_dropped(self):
+        tracking_buffer, engine = self._buffer()
+        engine.execute.side_effect = Exception('database down')
+
+        tracking_buffer.add('key', '/dataset/a', 'page')
+        tracking_buffer.flush()
+
+        assert_equals(tracking_buffer.dropped, 1)
+
+
+class TestPageCacheMiddleware(object):
+    def setup(self):
+        self.calls = []
+        self.environ_updates = {'CKAN_PAGE_CACHABLE': True}
+        self.backend = page_cache.MemoryBackend()
+        with mock.patch('ckan.lib.page_cache.get_backend',
+                        return_value=self.backend):
+            self.middleware = PageCacheMiddleware(self._app, {})
+
+    def _app(self, environ, start_response):
+        self.calls.append(environ['PATH_INFO'])
+        environ.update(self.environ_updates)
+        start_response('200 OK', [('Content-Type', 'text/html')])
+        return ['<html>', 'page %s' % len(self.calls), '</html>']
+
+    def _get(self, path='/dataset', **environ):
+        environ.update({'REQUEST_METHOD': 'GET', 'PATH_INFO': path,
+                        'QUERY_STRING': ''})
+        response = {}
+
+        def start_response(status, headers, exc_info=None):
+            response['status'] = status
+            response['headers'] = dict(headers)
+
+        response['body'] = ''.join(self.middleware(environ, start_response))
+        return response
+
+    def test_pages_are_cached(self):
+        first = self._get()
+        second = self._get()
+
+        assert_equals(self.calls, ['/dataset'])
+        assert_equals(second['body'], first['body'])
+        assert_equals(second['status'], '200 OK')
+        assert_equals(second['headers']['Content-Type'], 'text/html')
+
+    def test_logged_in_users_are_not_served_cached_pages(self):
+        self._get()
+        self._get(HTTP_COOKIE='auth_tkt="abc"')
+        self._get(REMOTE_USER='someone')
+
+        assert_equals(len(self.calls), 3)
+
+    def test_uncachable_pages_are_not_cached(self):
+        self.environ_updates = {'CKAN_PAGE_CACHABLE': False}
+        self._get()
+        self._get()
+
+        assert_equals(len(self.calls), 2)
+
+    def test_uncachable_responses_are_passed_on_untouched(self):
+        page = iter(['streamed'])
+        self.middleware.app = mock.Mock(return_value=page)
+        environ = {'REQUEST_METHOD': 'GET', 'PATH_INFO': '/export',
+                   'QUERY_STRING': ''}
+
+        assert self.middleware(environ, mock.Mock()) is page
+
+    def test_conditional_requests(self):
+        self._get()
+        etag = self._get()['headers']['ETag']
+
+        response = self._get(HTTP_IF_NONE_MATCH=etag)
+
+        assert_equals(response['status'], '304 Not Modified')
+        assert_equals(response['body'], '')
+
+    def test_tagged_pages_are_purged(self):
+        self.environ_updates['CKAN_PAGE_CACHE_TAGS'] = ['dataset:1']
+        self._get('/dataset/1')
+        self.environ_updates['CKAN_PAGE_CACHE_TAGS'] = ['dataset:2']
+        self._get('/dataset/2')
+
+        self.backend.purge(['dataset:1'])
+        self._get('/dataset/1')
+        self._get('/dataset/2')
+
+        assert_equals(self.calls, ['/dataset/1', '/dataset/2', '/dataset/1'])
+
+    def test_route_ttls(self):
+        self.middleware.route_ttls = {'package.search': 0}
+        self.environ_updates['wsgiorg.routing_args'] = (
+            (), {'controller': 'package', 'action': 'search'})
+        self._get()
+        self._get()
+
+        assert_equals(len(self.calls), 2)
@@ -4,6 +4,7 @@ controller itself.
 '''
 import json
 
+import mock
 from routes import url_for
 from nose.tools import assert_equal
 
@@ -166,3 +167,114 @@ class TestApiController(helpers.FunctionalTestBase):
         results = json.loads(response.body)
         assert_equal(len(results), 1)
         assert_equal(results[0]['title'], 'Simple dummy org')
+
+    @mock.patch('ckan.controllers.api.EXPORT_PAGE_SIZE', 2)
+    def test_dataset_export_reads_every_page(self):
+        names = sorted(factories.Dataset()['name'] for n in range(5))
+        app = self._get_test_app()
+
+        response = app.get('/api/util/dataset/export', status=200)
+
+        assert response.headers['Content-Type'].startswith(
+            'application/x-ndjson')
+        assert_equal(sorted(json.loads(line)['name']
+                            for line in response.body.splitlines()),
+                     names)
+
+
+class TestConditionalRequests(helpers.FunctionalTestBase):
+
+    def test_show_with_matching_etag_is_not_modified(self):
+        dataset = factories.Dataset()
+        app = self._get_test_app()
+        url = '/api/action/package_show?id={0}'.format(dataset['id'])
+
+        etag = app.get(url).headers['ETag']
+        response = app.get(url, headers={'If-None-Match': etag}, status=304)
+
+        assert_equal(response.body, '')
+
+    def test_changed_dataset_is_modified(self):
+        dataset = factories.Dataset()
+        app = self._get_test_app()
+        url = '/api/action/package_show?id={0}'.format(dataset['id'])
+
+        etag = app.get(url).headers['ETag']
+        helpers.call_action('package_patch', id=dataset['id'],
+                            title=u'New title')
+        response = app.get(url, headers={'If-None-Match': etag}, status=200)
+
+        assert_equal(json.loads(response.body)['result']['title'],
+                     u'New title')
+
+    def test_new_member_modifies_organization(self):
+        org = factories.Organization()
+        user = factories.User()
+        app = self._get_test_app()
+        url = '/api/action/organization_show?id={0}'.format(org['id'])
+
+        etag = app.get(url).headers['ETag']
+        helpers.call_action('organization_member_create', id=org['id'],
+                            username=user['name'], role='editor')
+
+        app.get(url, headers={'If-None-Match': etag}, status=200)
+
+    def test_changed_organization_modifies_its_datasets(self):
+        org = factories.Organization()
+        dataset = factories.Dataset(owner_org=org['id'])
+        app = self._get_test_app()
+        url = '/api/action/package_show?id={0}'.format(dataset['id'])
+
+        response = app.get(url)
+        helpers.call_action('organization_patch', id=org['id'],
+                            title=u'New title')
+
+        app.get(url, headers={'If-None-Match': response.headers['ETag']},
+                status=200)
+        # the dataset's own stamps do not show the change
+        assert 'Last-Modified' not in response.headers
+
+    def test_show_if_modified_since(self):
+        dataset = factories.Dataset()
+        app = self._get_test_app()
+        url = '/api/action/package_show?id={0}'.format(dataset['id'])
+
+        last_modified = app.get(url).headers['Last-Modified']
+
+        app.get(url, headers={'If-Modified-Since': last_modified},
+                status=304)
+        app.get(url, headers={'If-Modified-Since':
+                              'Thu, 01 Jan 2015 00:00:00 GMT'},
+                status=200)
+
+    def test_search_etag_depends_on_the_results(self):
+        factories.Dataset()
+        app = self._get_test_app()
+        url = '/api/action/package_search'
+
+        etag = app.get(url).headers['ETag']
+        app.get(url, headers={'If-None-Match': etag}, status=304)
+        factories.Dataset()
+
+        app.get(url, headers={'If-None-Match': etag}, status=200)
+
+    def test_etag_depends_on_the_parameters(self):
+        dataset = factories.Dataset()
+        app = self._get_test_app()
+        url = '/api/action/package_show?id={0}'.format(dataset['id'])
+
+        etag = app.get(url).headers['ETag']
+
+        app.get(url + '&callback=jsonp', headers={'If-None-Match': etag},
+                status=200)
+
+    def test_actions_with_side_effects_have_no_etag(self):
+        app = self._get_test_app()
+        sysadmin = factories.Sysadmin()
+
+        response = app.post(
+            '/api/action/package_create',
+            params=json.dumps({'name': 'rivers'}),
+            extra_environ={'Authorization': str(sysadmin['apikey'])})
+
+        assert 'ETag' not in response.headers
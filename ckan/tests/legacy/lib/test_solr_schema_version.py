@@ -51,3 +51,12 @@ class TestSolrSchemaVersionCheck(TestController):
             assert 'SOLR schema version not supported' in str(e)
 
 
+
+    def test_current_schema_supports_atomic_updates(self):
+
+        from ckan.lib.search import (get_solr_schema_version,
+                                     ATOMIC_UPDATES_SCHEMA_VERSIONS)
+
+        version = get_solr_schema_version(self._get_current_schema())
+
+        assert version in ATOMIC_UPDATES_SCHEMA_VERSIONS
@@ -16,6 +16,18 @@ class TestSimpleDump(TestController):
     def setup_class(self):
         model.repo.rebuild_db()
         CreateTestData.create()
+        # a dataset in an organization, which is in its groups in as_dict
+        rev = model.repo.new_revision()
+        org = model.Group(name=u'dumper-org', title=u'Dumper Org',
+                          type=u'organization', is_organization=True)
+        model.Session.add(org)
+        model.Session.flush()
+        pkg = model.Package.by_name(u'warandpeace')
+        pkg.owner_org = org.id
+        model.Session.add(model.Member(group=org, table_id=pkg.id,
+                                       table_name='package',
+                                       capacity='organization'))
+        model.repo.commit_and_remove()
 
     @classmethod
     def teardown_class(self):
@@ -49,6 +61,19 @@ class TestSimpleDump(TestController):
         assert 'joeadmin' not in res, res
         self.assert_correct_field_order(res)
 
+    def test_package_dicts_match_as_dict(self):
+        query = model.Session.query(model.Package) \
+            .filter_by(state=model.State.ACTIVE)
+        dumped = dict((pkg_dict['id'], pkg_dict)
+                      for pkg_dict in simple_dumper.package_dicts(query))
+        assert len(dumped) == query.count(), dumped
+        for pkg in query:
+            expected = json.loads(json.dumps(pkg.as_dict()))
+            got = json.loads(json.dumps(dumped[pkg.id]))
+            assert got == expected, (got, expected)
+        assert u'dumper-org' in dumped[
+            model.Package.by_name(u'warandpeace').id]['groups']
+
     def assert_correct_field_order(self, res):
         correct_field_order = ('id', 'name', 'title', 'version', 'url')
         field_position = [res.find('"%s"' % field) for field in correct_field_order]
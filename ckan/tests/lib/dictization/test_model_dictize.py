@@ -499,6 +499,66 @@ class TestPackageDictize:
         self.assert_equals_expected(expected_dict, result['organization'])
 
 
+class TestPackageListDictize:
+
+    def setup(self):
+        helpers.reset_db()
+
+    def test_package_list_dictize_same_as_package_dictize(self):
+        org = factories.Organization()
+        group = factories.Group()
+        dataset = factories.Dataset(owner_org=org['id'],
+                                    groups=[{'name': group['name']}],
+                                    tags=[{'name': 'fish'}],
+                                    extras=[{'key': 'latitude',
+                                             'value': '54.6'}])
+        factories.Resource(package_id=dataset['id'])
+        dataset_obj = model.Package.get(dataset['id'])
+        context = {'model': model, 'session': model.Session}
+
+        result = model_dictize.package_list_dictize([dataset['id']], context)
+
+        assert_equal(result,
+                     [model_dictize.package_dictize(dataset_obj, context)])
+
+    def test_package_list_dictize_keeps_order(self):
+        datasets = [factories.Dataset() for i in range(3)]
+        ids = [datasets[2]['id'], datasets[0]['id'], datasets[1]['id']]
+        context = {'model': model, 'session': model.Session}
+
+        result = model_dictize.package_list_dictize(ids, context)
+
+        assert_equal([pkg_dict['id'] for pkg_dict in result], ids)
+
+    def test_package_list_dictize_related_objects_not_mixed(self):
+        dataset1 = factories.Dataset(tags=[{'name': 'fish'}])
+        dataset2 = factories.Dataset(tags=[{'name': 'chips'}])
+        factories.Resource(package_id=dataset2['id'])
+        context = {'model': model, 'session': model.Session}
+
+        result = model_dictize.package_list_dictize(
+            [dataset1['id'], dataset2['id']], context)
+
+        assert_equal([tag['name'] for tag in result[0]['tags']], ['fish'])
+        assert_equal([tag['name'] for tag in result[1]['tags']], ['chips'])
+        assert_equal(result[0]['resources'], [])
+        assert_equal(len(result[1]['resources']), 1)
+
+    def test_package_list_dictize_ignores_missing_ids(self):
+        dataset = factories.Dataset()
+        context = {'model': model, 'session': model.Session}
+
+        result = model_dictize.package_list_dictize(
+            ['not-a-real-id', dataset['id']], context)
+
+        assert_equal([pkg_dict['id'] for pkg_dict in result], [dataset['id']])
+
+    def test_package_list_dictize_empty(self):
+        context = {'model': model, 'session': model.Session}
+
+        assert_equal(model_dictize.package_list_dictize([], context), [])
+
+
 def assert_equal_for_keys(dict1, dict2, *keys):
     for key in keys:
         assert key in dict1, 'Dict 1 misses key "%s"' % key
@@ -1,5 +1,5 @@
 import nose
-from ckan.lib.navl.dictization_functions import validate
+from ckan.lib.navl.dictization_functions import validate, compile_schema
 
 
 eq_ = nose.tools.eq_
@@ -47,3 +47,80 @@ class TestValidate(object):
         context = {}
 
         data, errors = validate(data_dict, schema, context)
+
+
+class TestCompiledSchema(object):
+
+    def _schema(self):
+        return {
+            'name': [unicode],
+            'resources': {
+                'url': [unicode],
+                '__extras': [lambda key, data, errors, context: None],
+            },
+            '__junk': [lambda key, data, errors, context: None],
+        }
+
+    def test_compile_schema_is_cached(self):
+
+        schema = self._schema()
+
+        eq_(id(compile_schema(schema)), id(compile_schema(schema)))
+        # the lambdas of another copy are other converters
+        assert compile_schema(schema) is not compile_schema(self._schema())
+
+    def test_equal_schemas_share_their_compiled_schema(self):
+
+        def my_validator(key, data, errors, context):
+            pass
+
+        eq_(id(compile_schema({'name': [unicode, my_validator]})),
+            id(compile_schema({'name': [unicode, my_validator]})))
+        assert compile_schema({'name': [unicode]}) is not \
+            compile_schema({'name': [unicode, my_validator]})
+
+    def test_default_schemas_are_compiled_once(self):
+
+        import ckan.logic.schema as schema
+
+        assert compile_schema(schema.default_create_package_schema()) is \
+            compile_schema(schema.default_create_package_schema())
+
+    def test_compile_schema_of_compiled_schema(self):
+
+        compiled = compile_schema(self._schema())
+
+        assert compile_schema(compiled) is compiled
+
+    def test_validate_with_compiled_schema(self):
+
+        data_dict = {
+            'name': 'test',
+            'resources': [{'url': 'http://example.com', 'format': 'CSV'}],
+        }
+
+        eq_(validate(data_dict, compile_schema(self._schema())),
+            validate(data_dict, self._schema()))
+
+    def test_validate_with_compiled_schema_adds_schema_keys_to_context(self):
+
+        def my_validator(key, data, errors, context):
+
+            eq_(context['schema_keys'], ['my_field'])
+
+        schema = compile_schema({'my_field': [my_validator]})
+
+        validate({'my_field': 'test'}, schema, {})
+
+    def test_full_schema(self):
+
+        data = {
+            ('name',): 'test',
+            ('resources', 0, 'url'): 'http://example.com',
+        }
+
+        full_schema = compile_schema(self._schema()).full_schema(data)
+
+        eq_(sorted(full_schema.keys()),
+            [('__junk',), ('name',),
+             ('resources', 0, '__extras'), ('resources', 0, 'url')])
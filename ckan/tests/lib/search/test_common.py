@@ -0,0 +1,106 @@
+import socket
+
+import mock
+import nose.tools
+
+import ckan.lib.search.common as common
+
+assert_equal = nose.tools.assert_equal
+assert_raises = nose.tools.assert_raises
+
+
+@mock.patch('ckan.lib.search.common.make_connection')
+class TestSolrConnectionPool(object):
+
+    def test_connections_are_reused(self, make_connection):
+        pool = common.SolrConnectionPool(size=2, timeout=1, max_idle=60)
+
+        with pool.connection() as first:
+            pass
+        with pool.connection() as second:
+            pass
+
+        assert first is second
+        assert_equal(make_connection.call_count, 1)
+        assert not first.close.called
+
+    def test_pool_size_is_a_maximum(self, make_connection):
+        make_connection.side_effect = lambda: mock.Mock()
+        pool = common.SolrConnectionPool(size=2, timeout=0.1, max_idle=60)
+
+        pool.checkout()
+        pool.checkout()
+
+        assert_raises(common.SearchError, pool.checkout)
+        assert_equal(pool.stats()['checkout_timeouts'], 1)
+
+    def test_idle_connections_are_evicted(self, make_connection):
+        make_connection.side_effect = lambda: mock.Mock()
+        pool = common.SolrConnectionPool(size=2, timeout=1, max_idle=0)
+
+        with pool.connection() as first:
+            pass
+        with pool.connection() as second:
+            pass
+
+        assert first is not second
+        assert first.close.called
+        assert_equal(pool.stats()['connections_evicted'], 1)
+
+    def test_broken_connections_are_discarded(self, make_connection):
+        make_connection.side_effect = lambda: mock.Mock()
+        pool = common.SolrConnectionPool(size=1, timeout=1, max_idle=60)
+
+        with assert_raises(socket.error):
+            with pool.connection() as conn:
+                raise socket.error('Connection reset by peer')
+
+        assert conn.close.called
+        assert_equal(pool.stats()['open'], 0)
+        with pool.connection() as new_conn:
+            assert new_conn is not conn
+
+    def test_disabled_pool(self, make_connection):
+        make_connection.side_effect = lambda: mock.Mock()
+        pool = common.SolrConnectionPool(size=0, timeout=1, max_idle=60)
+
+        with pool.connection() as conn:
+            pass
+
+        assert conn.close.called
+        assert_equal(pool.stats()['idle'], 0)
+
+    def test_stats(self, make_connection):
+        pool = common.SolrConnectionPool(size=2, timeout=1, max_idle=60)
+
+        for n in range(3):
+            with pool.connection():
+                pass
+
+        stats = pool.stats()
+        assert_equal(stats['checkouts'], 3)
+        assert_equal(stats['connections_opened'], 1)
+        assert_equal(stats['idle'], 1)
+        assert stats['mean_wait_time'] >= 0
+
+
+@mock.patch('ckan.lib.search.common.make_connection')
+class TestNetworkErrors(object):
+
+    def setup(self):
+        common.reset_connection_pool()
+
+    def teardown(self):
+        common.reset_connection_pool()
+
+    def test_connections_that_failed_are_not_reused(self, make_connection):
+        import ckan.lib.search.index as index
+        make_connection.side_effect = lambda: mock.Mock()
+
+        with common.solr_connection() as conn:
+            conn.delete_query.side_effect = socket.error('Broken pipe')
+        assert_raises(common.SearchIndexError, index.clear_index)
+
+        assert conn.close.called
+        with common.solr_connection() as new_conn:
+            assert new_conn is not conn
@@ -1,6 +1,7 @@
 import datetime
 import hashlib
 import json
+import mock
 import nose.tools
 import nose
 
@@ -158,6 +159,60 @@ class TestSearchIndex(object):
 
         assert 'test_empty_date' not in response.results[0]
 
+    def test_index_packages_batch(self):
+
+        pkg_dicts = []
+        for i in range(3):
+            pkg_dict = self.base_package_dict.copy()
+            pkg_dict.update({
+                'id': 'test-index-{0}'.format(i),
+                'name': 'monkey-{0}'.format(i),
+            })
+            pkg_dicts.append(pkg_dict)
+
+        count = self.package_index.index_packages(pkg_dicts)
+
+        assert_equal(count, 3)
+
+        response = self.solr_client.query('title:Monkey', fq=self.fq)
+
+        assert_equal(len(response), 3)
+        assert_equal(sorted([r['name'] for r in response.results]),
+                     ['monkey-0', 'monkey-1', 'monkey-2'])
+
+    def test_index_packages_batch_reuses_connection(self):
+
+        conn = search.make_connection()
+        try:
+            self.package_index.index_packages([self.base_package_dict],
+                                              conn=conn)
+            # the connection is left open for the next batch
+            conn.commit()
+        finally:
+            conn.close()
+
+        response = self.solr_client.query('name:monkey', fq=self.fq)
+
+        assert_equal(len(response), 1)
+
+    def test_index_packages_batch_skips_deleted(self):
+
+        deleted_pkg_dict = self.base_package_dict.copy()
+        deleted_pkg_dict.update({
+            'id': 'test-index-deleted',
+            'name': 'monkey-deleted',
+            'state': 'deleted',
+        })
+
+        count = self.package_index.index_packages(
+            [self.base_package_dict, deleted_pkg_dict])
+
+        assert_equal(count, 1)
+
+        response = self.solr_client.query('name:monkey-deleted', fq=self.fq)
+
+        assert_equal(len(response), 0)
+
 
 class TestPackageSearchIndex:
     @staticmethod
@@ -283,3 +338,31 @@ class TestPackageSearchIndex:
 
         # Resource types are indexed
         assert_equal(indexed_pkg['res_type'], ['doc', 'file'])
+
+
+def _index_batch(indexed):
+    def index_batch(package_index, context, package_ids, conn):
+        if 'bad' in package_ids:
+            raise Exception('Cannot index this dataset')
+        indexed.extend(package_ids)
+        return len(package_ids)
+    return index_batch
+
+
+class TestRebuildInBatches(object):
+
+    def test_failed_batch_is_retried_one_dataset_at_a_time(self):
+        indexed = []
+        with mock.patch.object(search, '_index_batch',
+                               side_effect=_index_batch(indexed)):
+            search._rebuild_in_batches(mock.Mock(), ['a', 'bad', 'b', 'c'],
+                                       2, force=True, defer_commit=True)
+
+        assert_equal(indexed, ['a', 'b', 'c'])
+
+    @nose.tools.raises(Exception)
+    def test_failed_batch_raises_without_force(self):
+        with mock.patch.object(search, '_index_batch',
+                               side_effect=_index_batch([])):
+            search._rebuild_in_batches(mock.Mock(), ['a', 'bad'], 2,
+                                       force=False, defer_commit=True)
@@ -0,0 +1,164 @@
+import nose.tools
+
+import ckan.lib.search.sql as sql
+import ckan.model as model
+import ckan.tests.factories as factories
+import ckan.tests.helpers as helpers
+
+assert_equal = nose.tools.assert_equal
+
+
+class TestPackageSearchQuery(object):
+
+    def setup(self):
+        helpers.reset_db()
+        self.package_index = sql.PackageSearchIndex()
+        self.package_index.clear()
+
+    def _index(self, *datasets):
+        self.package_index.index_packages(
+            [helpers.call_action('package_show', id=dataset['id'])
+             for dataset in datasets])
+
+    def test_full_text_search(self):
+        river = factories.Dataset(title=u'River levels',
+                                  notes=u'Measured hourly at the gauges')
+        factories.Dataset(title=u'Bus stops')
+        self._index(river)
+
+        res = sql.PackageSearchQuery().run({'q': u'gauge'})
+
+        assert_equal(res, {'results': [{'id': river['id']}], 'count': 1})
+
+    def test_unindexed_datasets_are_found_by_title(self):
+        river = factories.Dataset(title=u'River levels')
+
+        res = sql.PackageSearchQuery().run({'q': u'rivers'})
+
+        assert_equal(res['results'], [{'id': river['id']}])
+
+    def test_title_matches_rank_first(self):
+        in_notes = factories.Dataset(title=u'Water',
+                                     notes=u'Levels of the river')
+        in_title = factories.Dataset(title=u'River levels')
+        self._index(in_notes, in_title)
+
+        query = sql.PackageSearchQuery()
+        query.run({'q': u'river', 'sort': 'score desc', 'fl': 'id'})
+
+        assert_equal(query.results, [in_title['id'], in_notes['id']])
+
+    def test_filters(self):
+        org = factories.Organization()
+        in_org = factories.Dataset(owner_org=org['id'],
+                                   tags=[{'name': u'water'}])
+        factories.Dataset(tags=[{'name': u'water'}])
+
+        query = sql.PackageSearchQuery()
+        query.run({'q': u'', 'fl': 'id',
+                   'fq': u'+organization:{0} +tags:"water"'.format(
+                       org['name'])})
+
+        assert_equal(query.results, [in_org['id']])
+
+    def test_negated_filter(self):
+        factories.Dataset(tags=[{'name': u'water'}])
+        other = factories.Dataset()
+
+        query = sql.PackageSearchQuery()
+        query.run({'q': u'-tags:water', 'fl': 'id'})
+
+        assert_equal(query.results, [other['id']])
+
+    def test_or_groups(self):
+        user = factories.User()
+        own_draft = factories.Dataset(user=user, state='draft')
+        factories.Dataset(state='draft')
+        active = factories.Dataset()
+
+        # the filter package_search uses for include_drafts
+        query = sql.PackageSearchQuery()
+        query.run({'q': u'', 'fl': 'id', 'sort': 'name asc',
+                   'fq': u'((creator_user_id:{0} AND +state:(draft OR '
+                         u'active)) OR state:active)'.format(user['id'])})
+
+        assert_equal(sorted(query.results),
+                     sorted([own_draft['id'], active['id']]))
+
+    def test_ignored_filters_match_every_dataset(self):
+        water = factories.Dataset(tags=[{'name': u'water'}])
+        other = factories.Dataset()
+
+        query = sql.PackageSearchQuery()
+        query.run({'q': u'', 'fl': 'id',
+                   'fq': u'tags:water OR unknown_field:value'})
+
+        assert_equal(sorted(query.results),
+                     sorted([water['id'], other['id']]))
+
+    def test_get_all_entity_ids_returns_the_indexed_datasets(self):
+        indexed = factories.Dataset()
+        factories.Dataset()
+        self._index(indexed)
+
+        assert_equal(sql.PackageSearchQuery().get_all_entity_ids(),
+                     [indexed['id']])
+
+    def test_facets(self):
+        org = factories.Organization()
+        factories.Dataset(owner_org=org['id'],
+                          tags=[{'name': u'water'}, {'name': u'rivers'}])
+        factories.Dataset(tags=[{'name': u'water'}])
+
+        query = sql.PackageSearchQuery()
+        query.run({'q': u'', 'facet.field': ['tags', 'organization'],
+                   'facet.limit': 50, 'facet.mincount': 1})
+
+        assert_equal(query.facets, {
+            'tags': {u'water': 2, u'rivers': 1},
+            'organization': {org['name']: 1},
+        })
+
+    def test_cursor(self):
+        datasets = [factories.Dataset() for n in range(3)]
+
+        query = sql.PackageSearchQuery()
+        query.run({'q': u'', 'fl': 'id', 'rows': 2, 'cursorMark': '*',
+                   'sort': 'name asc'})
+        first_page = query.results
+        query.run({'q': u'', 'fl': 'id', 'rows': 2,
+                   'cursorMark': query.next_cursor, 'sort': 'name asc'})
+
+        assert_equal(first_page + query.results,
+                     [d['id'] for d in sorted(datasets,
+                                              key=lambda d: d['name'])])
+        assert_equal(query.next_cursor, None)
+
+
+class TestPackageSearchIndex(object):
+
+    def setup(self):
+        helpers.reset_db()
+        self.package_index = sql.PackageSearchIndex()
+        self.package_index.clear()
+
+    def _documents(self):
+        return [row['package_id'] for row in model.Session.execute(
+            model.package_search_index_table.select())]
+
+    def test_deleted_datasets_are_removed(self):
+        dataset = factories.Dataset()
+        self.package_index.index_packages([dataset])
+
+        dataset['state'] = 'deleted'
+        self.package_index.update_dict(dataset)
+
+        assert_equal(self._documents(), [])
+
+    def test_clear(self):
+        self.package_index.index_packages([factories.Dataset(),
+                                           factories.Dataset()])
+
+        self.package_index.clear()
+
+        assert_equal(self._documents(), [])
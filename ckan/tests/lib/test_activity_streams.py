@@ -0,0 +1,50 @@
+import nose.tools
+
+import ckan.lib.activity_streams as activity_streams
+import ckan.model as model
+import ckan.tests.factories as factories
+import ckan.tests.helpers as helpers
+
+
+assert_equal = nose.tools.assert_equal
+
+
+class TestPlaceholders(object):
+
+    def test_placeholders_are_parsed(self):
+        assert_equal(activity_streams._placeholders(
+            u'{actor} updated the resource {resource} in {dataset}'),
+            (u'actor', u'resource', u'dataset'))
+
+    def test_placeholders_are_cached(self):
+        msg = u'{actor} did something to {dataset}'
+        placeholders = activity_streams._placeholders(msg)
+
+        assert activity_streams._placeholders(msg) is placeholders
+
+
+class TestActivityListToHtml(object):
+
+    def setup(self):
+        helpers.reset_db()
+
+    def test_activity_details_are_fetched_in_one_query(self):
+        user = factories.User()
+        dataset = factories.Dataset(user=user)
+        for n in range(3):
+            helpers.call_action('package_patch', id=dataset['id'],
+                                notes='Updated {0} times'.format(n))
+        activity_stream = helpers.call_action('package_activity_list',
+                                              id=dataset['id'])
+        context = {'model': model, 'session': model.Session}
+
+        with model.meta.QueryCounter() as counter:
+            details = activity_streams._activity_details(context,
+                                                         activity_stream)
+
+        assert_equal(counter.count, 1)
+        changed = [activity['id'] for activity in activity_stream
+                   if activity['activity_type'] == 'changed package']
+        assert_equal(sorted(details.keys()), sorted(changed))
+        for activity_id in changed:
+            assert_equal(len(details[activity_id]), 1)
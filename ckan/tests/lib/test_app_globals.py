@@ -1,5 +1,15 @@
+import os
+import time
+
+import mock
+import nose.tools
+
+import ckan.lib.app_globals as app_globals
+import ckan.tests.helpers as helpers
 from ckan.lib.app_globals import app_globals as g
 
+assert_equals = nose.tools.assert_equals
+
 
 class TestGlobals(object):
     def test_config_not_set(self):
@@ -11,3 +21,83 @@ class TestGlobals(object):
         # ckan.site_description is configured but with no value.
         # Behaviour has always been to return an empty string.
         assert g.site_description == ''
+
+
+@mock.patch('ckan.lib.app_globals.reset')
+@mock.patch('ckan.model.get_system_info')
+class TestCheckUptodate(object):
+    def setup(self):
+        self._original_config_update = g._config_update
+        self._original_last_check = g._last_check
+
+    def teardown(self):
+        g._config_update = self._original_config_update
+        g._last_check = self._original_last_check
+
+    @helpers.change_config('ckan.config_update_ttl', '60')
+    def test_database_not_read_within_ttl(self, get_system_info, reset):
+        g._last_check = time.time()
+
+        g._check_uptodate()
+
+        assert not get_system_info.called
+        assert not reset.called
+
+    @helpers.change_config('ckan.config_update_ttl', '60')
+    def test_reset_after_ttl_if_updated(self, get_system_info, reset):
+        get_system_info.return_value = 'updated'
+        g._last_check = time.time() - 61
+
+        g._check_uptodate()
+
+        get_system_info.assert_called_once_with('ckan.config_update')
+        assert reset.called
+        assert_equals(g._config_update, 'updated')
+
+    @helpers.change_config('ckan.config_update_ttl', '60')
+    def test_publish_makes_this_process_check(self, get_system_info, reset):
+        g._last_check = time.time()
+
+        with mock.patch.object(app_globals, '_config_update_channel',
+                               app_globals.ConfigUpdateChannel()):
+            app_globals.publish_config_update()
+            g._check_uptodate()
+
+        assert get_system_info.called
+
+    @helpers.change_config('ckan.config_update_ttl', '60')
+    def test_channel_notification_makes_process_check(self, get_system_info,
+                                                      reset):
+        channel = app_globals.LocalConfigUpdateChannel()
+        g._last_check = time.time()
+
+        with mock.patch.object(app_globals, '_config_update_channel',
+                               channel):
+            channel.publish()
+            g._check_uptodate()
+            g._check_uptodate()
+
+        # only the first check follows a notification
+        assert_equals(get_system_info.call_count, 1)
+
+
+class TestPostgresConfigUpdateChannel(object):
+
+    def test_publish_does_not_commit_the_session(self):
+        channel = app_globals.PostgresConfigUpdateChannel()
+
+        with mock.patch('ckan.model.Session.commit') as commit:
+            channel.publish()
+
+        assert not commit.called
+
+    def test_poll_closes_a_broken_connection(self):
+        channel = app_globals.PostgresConfigUpdateChannel()
+        connection = mock.Mock()
+        connection.connection.poll.side_effect = Exception('closed')
+        channel._connection, channel._pid = connection, os.getpid()
+
+        # a notification may have been missed
+        assert channel.poll()
+        assert connection.close.called
+        assert channel._connection is None
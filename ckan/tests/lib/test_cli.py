@@ -1,10 +1,14 @@
 # -*- coding: utf-8 -*-
 
+import datetime
 import logging
 
-from nose.tools import assert_raises
+import mock
+from nose.tools import assert_equal, assert_raises
 
-from ckan.lib.cli import UserCmd
+from ckan.lib.cli import Tracking, UserCmd
+import ckan.model as model
+import ckan.tests.factories as factories
 import ckan.tests.helpers as helpers
 
 log = logging.getLogger(__name__)
@@ -70,3 +74,80 @@ class TestUserAdd(object):
             self.user_cmd.add()
         except SystemExit:
             assert False, "SystemExit exception shouldn't be raised"
+
+
+class TestTrackingUpdate(object):
+
+    '''Tests for Tracking.update_tracking'''
+
+    @classmethod
+    def setup_class(cls):
+        cls.tracking_cmd = Tracking('tracking-command')
+
+    def setup(self):
+        helpers.reset_db()
+
+    def _view(self, url, user_key, date, tracking_type='page'):
+        model.Session.execute(model.tracking_raw_table.insert().values(
+            url=url, user_key=user_key, tracking_type=tracking_type,
+            access_timestamp=date))
+        model.Session.commit()
+
+    def _summaries(self, **filters):
+        q = model.Session.query(model.TrackingSummary).filter_by(**filters)
+        return [(s.tracking_date.date(), s.count, s.running_total,
+                 s.recent_views)
+                for s in q.order_by(model.TrackingSummary.tracking_date)]
+
+    def test_totals_carry_on_from_previous_days(self):
+        dataset = factories.Dataset()
+        url = '/dataset/' + dataset['name']
+        days = [datetime.datetime(2015, 1, 1), datetime.datetime(2015, 1, 10),
+                datetime.datetime(2015, 1, 20)]
+        for day, user_keys in zip(days, (['a', 'b'], ['a'], ['a', 'b', 'c'])):
+            for user_key in user_keys:
+                self._view(url, user_key, day)
+            self._view('/en' + url, 'd', day)
+
+        for day in days:
+            self.tracking_cmd.update_tracking(model.meta.engine, day)
+
+        summaries = self._summaries(package_id=dataset['id'], url=url)
+        assert_equal(summaries, [
+            (days[0].date(), 2, 3, 3),
+            (days[1].date(), 1, 5, 5),
+            # the views of the first day are no longer recent
+            (days[2].date(), 3, 9, 6),
+        ])
+
+    def test_resource_totals(self):
+        url = 'http://example.com/data.csv'
+        days = [datetime.datetime(2015, 1, 1), datetime.datetime(2015, 1, 2)]
+        for day in days:
+            self._view(url, 'a', day, tracking_type='resource')
+
+        for day in days:
+            self.tracking_cmd.update_tracking(model.meta.engine, day)
+
+        assert_equal(self._summaries(url=url), [
+            (days[0].date(), 1, 1, 1),
+            (days[1].date(), 1, 2, 2),
+        ])
+
+    @helpers.change_config('ckan.search.solr_atomic_updates', 'true')
+    @mock.patch('ckan.lib.search.rebuild')
+    @mock.patch('ckan.lib.search.PackageSearchIndex.update_views')
+    @mock.patch('ckan.lib.search.get_solr_schema_version',
+                return_value='2.3')
+    def test_old_schemas_are_reindexed_instead_of_updated(
+            self, get_version, update_views, rebuild):
+        dataset = factories.Dataset()
+        day = datetime.datetime(2015, 1, 1)
+        self._view('/dataset/' + dataset['name'], 'a', day)
+        self.tracking_cmd.update_tracking(model.meta.engine, day)
+
+        self.tracking_cmd.update_tracking_solr(model.meta.engine, day)
+
+        assert not update_views.called
+        rebuild.assert_called_once_with(package_ids=[dataset['id']],
+                                        batch_size=mock.ANY)
@@ -0,0 +1,83 @@
+import nose.tools
+
+import ckan.lib.helper_cache as helper_cache
+import ckan.lib.helpers as h
+import ckan.tests.factories as factories
+import ckan.tests.helpers as helpers
+
+assert_equal = nose.tools.assert_equal
+
+
+calls = []
+
+
+@helper_cache.cached(expire=600, topics=['package'])
+def _count_calls(value):
+    calls.append(value)
+    return {'value': value}
+
+
+class TestCached(object):
+
+    def setup(self):
+        helpers.reset_db()
+        del calls[:]
+        helper_cache.invalidate(*helper_cache.TOPICS)
+
+    @helpers.change_config('ckan.helper_cache_enabled', 'true')
+    def test_values_are_cached_by_arguments(self):
+        _count_calls(1)
+        _count_calls(1)
+        _count_calls(2)
+
+        assert_equal(calls, [1, 2])
+
+    @helpers.change_config('ckan.helper_cache_enabled', 'true')
+    def test_cached_values_are_copies(self):
+        _count_calls(1)['value'] = 'changed'
+
+        assert_equal(_count_calls(1), {'value': 1})
+
+    @helpers.change_config('ckan.helper_cache_enabled', 'true')
+    def test_topic_changes_invalidate(self):
+        _count_calls(1)
+
+        factories.Dataset()
+        _count_calls(1)
+
+        assert_equal(calls, [1, 1])
+
+    @helpers.change_config('ckan.helper_cache_enabled', 'true')
+    def test_other_changes_do_not_invalidate(self):
+        _count_calls(1)
+
+        factories.User()
+        _count_calls(1)
+
+        assert_equal(calls, [1])
+
+    @helpers.change_config('ckan.helper_cache_enabled', 'false')
+    def test_disabled(self):
+        _count_calls(1)
+        _count_calls(1)
+
+        assert_equal(calls, [1, 1])
+
+
+class TestGetSiteStatistics(object):
+
+    def setup(self):
+        helpers.reset_db()
+        helper_cache.invalidate(*helper_cache.TOPICS)
+
+    @helpers.change_config('ckan.helper_cache_enabled', 'true')
+    def test_statistics_are_updated_when_datasets_change(self):
+        factories.Dataset()
+        assert_equal(h.get_site_statistics()['dataset_count'], 1)
+
+        factories.Dataset()
+        factories.Group()
+
+        stats = h.get_site_statistics()
+        assert_equal(stats['dataset_count'], 2)
+        assert_equal(stats['group_count'], 1)
@@ -0,0 +1,111 @@
+import nose.tools
+
+import ckan.lib.page_cache as page_cache
+import ckan.tests.factories as factories
+import ckan.tests.helpers as helpers
+
+assert_equal = nose.tools.assert_equal
+
+
+def _entry(body='page'):
+    return {'status': '200 OK', 'headers': [], 'etag': 'abc', 'body': body,
+            'stored': 0}
+
+
+class TestMemoryBackend(object):
+
+    def test_entries_expire(self):
+        backend = page_cache.MemoryBackend()
+        backend.set('/a', _entry(), 0, ['site'])
+        backend.set('/b', _entry(), 60, ['site'])
+
+        assert_equal(backend.get('/a'), None)
+        assert_equal(backend.get('/b')['body'], 'page')
+
+    def test_least_recently_used_entries_are_dropped(self):
+        backend = page_cache.MemoryBackend(max_entries=2)
+        backend.set('/a', _entry(), 60, ['site'])
+        backend.set('/b', _entry(), 60, ['site'])
+        backend.get('/a')
+        backend.set('/c', _entry(), 60, ['site'])
+
+        assert_equal(backend.get('/b'), None)
+        assert backend.get('/a')
+        assert backend.get('/c')
+
+    def test_purge(self):
+        backend = page_cache.MemoryBackend()
+        backend.set('/dataset/a', _entry(), 60, ['dataset:a'])
+        backend.set('/dataset/b', _entry(), 60, ['dataset:b'])
+
+        backend.purge(['dataset:a'])
+
+        assert_equal(backend.get('/dataset/a'), None)
+        assert backend.get('/dataset/b')
+
+    def test_purge_all(self):
+        backend = page_cache.MemoryBackend()
+        backend.set('/dataset/a', _entry(), 60, ['dataset:a'])
+
+        backend.purge([page_cache.ALL_TAG])
+
+        assert_equal(backend.get('/dataset/a'), None)
+
+
+class TestTags(object):
+
+    def test_dataset_tags(self):
+        tags = page_cache.dataset_tags({'id': 'a', 'owner_org': 'o',
+                                        'groups': [{'id': 'g'}]})
+
+        assert_equal(tags, ['dataset:a', 'organization:o', 'group:g'])
+
+    def test_etag_matches(self):
+        assert page_cache.etag_matches('"abc"', 'abc')
+        assert page_cache.etag_matches('"xyz", W/"abc"', 'abc')
+        assert page_cache.etag_matches('*', 'abc')
+        assert not page_cache.etag_matches('"xyz"', 'abc')
+        assert not page_cache.etag_matches(None, 'abc')
+
+
+class TestPurgeChanged(object):
+
+    def setup(self):
+        helpers.reset_db()
+        page_cache.reset_backend()
+
+    def teardown(self):
+        page_cache.reset_backend()
+
+    @helpers.change_config('ckan.page_cache_enabled', 'true')
+    @helpers.change_config('ckan.page_cache.backend', 'memory')
+    def test_dataset_changes_purge_their_pages(self):
+        dataset = factories.Dataset()
+        other = factories.Dataset()
+        backend = page_cache.get_backend()
+        backend.set('/dataset/a', _entry(), 60,
+                    page_cache.dataset_tags(dataset))
+        backend.set('/dataset/b', _entry(), 60,
+                    page_cache.dataset_tags(other))
+        backend.set('/', _entry(), 60, [page_cache.SITE_TAG])
+
+        helpers.call_action('package_patch', id=dataset['id'],
+                            title=u'New title')
+
+        assert_equal(backend.get('/dataset/a'), None)
+        assert_equal(backend.get('/'), None)
+        assert backend.get('/dataset/b')
+
+    @helpers.change_config('ckan.page_cache_enabled', 'true')
+    @helpers.change_config('ckan.page_cache.backend', 'memory')
+    def test_organization_changes_purge_their_datasets_pages(self):
+        org = factories.Organization()
+        dataset = factories.Dataset(owner_org=org['id'])
+        backend = page_cache.get_backend()
+        backend.set('/dataset/a', _entry(), 60,
+                    page_cache.dataset_tags(dataset))
+
+        helpers.call_action('organization_patch', id=org['id'],
+                            title=u'New title')
+
+        assert_equal(backend.get('/dataset/a'), None)
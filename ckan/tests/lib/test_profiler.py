@@ -0,0 +1,133 @@
+import nose.tools
+
+import ckan.lib.profiler as profiler
+import ckan.logic as logic
+import ckan.model as model
+import ckan.tests.factories as factories
+import ckan.tests.helpers as helpers
+
+assert_equal = nose.tools.assert_equal
+assert_raises = nose.tools.assert_raises
+
+
+class TestProfiler(object):
+
+    def setup(self):
+        helpers.reset_db()
+        profiler.clear()
+
+    def teardown(self):
+        profiler.discard()
+
+    @helpers.change_config('ckan.action_profiler.enabled', 'true')
+    def test_action_calls_are_recorded(self):
+        dataset = factories.Dataset()
+
+        profiler.start('GET', '/dataset')
+        helpers.call_action('package_show', id=dataset['id'])
+        profile = profiler.finish()
+
+        assert_equal([call['action'] for call in profile.calls],
+                     ['package_show'])
+        assert profile.calls[0]['queries'] > 0
+        assert_equal(profile.queries, profile.calls[0]['queries'])
+        assert profile.calls[0]['duration'] >= 0
+
+    @helpers.change_config('ckan.action_profiler.enabled', 'true')
+    def test_nesting(self):
+        profiler.start()
+        with profiler.action('outer'):
+            with profiler.action('inner'):
+                model.Session.execute('SELECT 1')
+            model.Session.execute('SELECT 1')
+        profile = profiler.finish()
+
+        outer, inner = profile.calls
+        assert_equal((outer['depth'], outer['parent']), (0, None))
+        assert_equal((inner['depth'], inner['parent']), (1, 0))
+        assert_equal((outer['queries'], inner['queries']), (2, 1))
+
+    @helpers.change_config('ckan.action_profiler.enabled', 'true')
+    def test_failed_calls_are_recorded(self):
+        profiler.start()
+        with assert_raises(logic.NotFound):
+            helpers.call_action('package_show', id='missing')
+        profile = profiler.finish()
+
+        assert_equal(profile.calls[0]['action'], 'package_show')
+        assert profile.calls[0]['duration'] is not None
+
+    @helpers.change_config('ckan.action_profiler.enabled', 'true')
+    def test_solr_calls_are_counted(self):
+        profiler.start()
+        with profiler.action('package_search'):
+            profiler.count_solr_call()
+        profile = profiler.finish()
+
+        assert_equal(profile.solr_calls, 1)
+        assert_equal(profile.calls[0]['solr_calls'], 1)
+
+    @helpers.change_config('ckan.action_profiler.enabled', 'false')
+    def test_disabled(self):
+        assert_equal(profiler.start(), None)
+        helpers.call_action('package_list')
+
+        assert_equal(profiler.finish(), None)
+        assert_equal(profiler.profiles(), [])
+
+    @helpers.change_config('ckan.action_profiler.enabled', 'true')
+    @helpers.change_config('ckan.action_profiler.buffer_size', '2')
+    def test_buffer_keeps_the_latest_profiles(self):
+        for url in ('/1', '/2', '/3'):
+            profiler.start('GET', url)
+            profiler.finish()
+
+        assert_equal([p['url'] for p in profiler.profiles()], ['/3', '/2'])
+
+
+class TestProfilerHeaders(helpers.FunctionalTestBase):
+
+    def setup(self):
+        super(TestProfilerHeaders, self).setup()
+        profiler.clear()
+
+    @helpers.change_config('ckan.action_profiler.enabled', 'true')
+    def test_headers(self):
+        app = self._get_test_app()
+        response = app.get('/api/action/package_list')
+
+        assert_equal(response.headers['X-CKAN-Actions'], '1')
+        assert int(response.headers['X-CKAN-Queries']) > 0
+        assert 'X-CKAN-Action-Time' in response.headers
+        assert_equal(profiler.profiles()[0]['calls'][0]['action'],
+                     'package_list')
+
+    def test_no_headers_when_disabled(self):
+        app = self._get_test_app()
+        response = app.get('/api/action/package_list')
+
+        assert 'X-CKAN-Actions' not in response.headers
+
+
+class TestActionProfileList(object):
+
+    def setup(self):
+        helpers.reset_db()
+        profiler.clear()
+
+    @helpers.change_config('ckan.action_profiler.enabled', 'true')
+    def test_limit(self):
+        for url in ('/1', '/2'):
+            profiler.start('GET', url)
+            profiler.finish()
+
+        profiles = helpers.call_action('action_profile_list', limit=1)
+
+        assert_equal([p['url'] for p in profiles], ['/2'])
+
+    def test_only_sysadmins(self):
+        user = factories.User()
+        context = {'user': user['name'], 'ignore_auth': False}
+
+        assert_raises(logic.NotAuthorized, helpers.call_action,
+                      'action_profile_list', context=context)
@@ -0,0 +1,69 @@
+import nose.tools
+
+import ckan.lib.term_translations as term_translations
+import ckan.model as model
+import ckan.tests.helpers as helpers
+
+
+assert_equal = nose.tools.assert_equal
+
+
+def _translations(translations):
+    return sorted((t['term'], t['lang_code'], t['term_translation'])
+                  for t in translations)
+
+
+class TestTermTranslationCache(object):
+
+    def setup(self):
+        helpers.reset_db()
+        term_translations.cache.clear()
+        helpers.call_action('term_translation_update_many', data=[
+            {'term': u'book', 'term_translation': u'Buch', 'lang_code': u'de'},
+            {'term': u'book', 'term_translation': u'livre',
+             'lang_code': u'fr'},
+            {'term': u'novel', 'term_translation': u'Roman',
+             'lang_code': u'de'},
+        ])
+
+    def test_get_translations(self):
+        cache = term_translations.TermTranslationCache(size=100, ttl=0)
+
+        translations = cache.get_translations([u'book', u'novel', u'poem'],
+                                              [u'de', u'fr'])
+
+        assert_equal(_translations(translations),
+                     [(u'book', u'de', u'Buch'), (u'book', u'fr', u'livre'),
+                      (u'novel', u'de', u'Roman')])
+
+    def test_cached_translations_need_no_query(self):
+        cache = term_translations.TermTranslationCache(size=100, ttl=0)
+        cache.prefetch([u'book', u'poem'], [u'de'])
+
+        with model.meta.QueryCounter() as counter:
+            translations = cache.get_translations([u'book', u'poem'], [u'de'])
+
+        assert_equal(counter.count, 0)
+        assert_equal(_translations(translations), [(u'book', u'de', u'Buch')])
+
+    def test_least_recently_used_entries_are_evicted(self):
+        cache = term_translations.TermTranslationCache(size=2, ttl=0)
+        cache.prefetch([u'book'], [u'de'])
+        cache.prefetch([u'book'], [u'fr'])
+        cache.prefetch([u'novel'], [u'de'])
+
+        with model.meta.QueryCounter() as counter:
+            cache.get_translations([u'book'], [u'de'])
+
+        assert_equal(counter.count, 1)
+
+    def test_update_invalidates_cache(self):
+        term_translations.cache.prefetch([u'book'], [u'de'])
+
+        helpers.call_action('term_translation_update', term=u'book',
+                            term_translation=u'Buecher', lang_code=u'de')
+
+        translations = term_translations.cache.get_translations([u'book'],
+                                                                [u'de'])
+        assert_equal(_translations(translations),
+                     [(u'book', u'de', u'Buecher')])
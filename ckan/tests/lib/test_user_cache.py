@@ -0,0 +1,106 @@
+import nose.tools
+
+import ckan.lib.user_cache as user_cache
+import ckan.model as model
+import ckan.tests.factories as factories
+import ckan.tests.helpers as helpers
+
+assert_equal = nose.tools.assert_equal
+
+
+class TestUserByApikey(object):
+
+    def setup(self):
+        helpers.reset_db()
+        user_cache.clear()
+
+    def teardown(self):
+        user_cache.clear()
+
+    @helpers.change_config('ckan.user_cache_ttl', '60')
+    def test_users_are_cached_between_requests(self):
+        user = factories.User()
+        user_cache.user_by_apikey(user['apikey'])
+        model.Session.remove()
+
+        with model.meta.QueryCounter() as counter:
+            user_obj = user_cache.user_by_apikey(user['apikey'])
+            same_user = model.User.by_name(user['name'])
+
+        assert_equal(counter.count, 0)
+        assert_equal(user_obj.id, user['id'])
+        assert user_obj is same_user
+        assert user_obj in model.Session
+
+    @helpers.change_config('ckan.user_cache_ttl', '60')
+    def test_cached_users_can_be_changed(self):
+        user = factories.User()
+        user_cache.user_by_apikey(user['apikey'])
+        model.Session.remove()
+
+        user_obj = user_cache.user_by_apikey(user['apikey'])
+        user_obj.fullname = u'New name'
+        model.Session.commit()
+        model.Session.remove()
+
+        assert_equal(model.User.get(user['id']).fullname, u'New name')
+
+    @helpers.change_config('ckan.user_cache_ttl', '60')
+    def test_user_update_invalidates(self):
+        user = factories.User()
+        user_cache.user_by_apikey(user['apikey'])
+
+        helpers.call_action('user_update', id=user['id'],
+                            email=user['email'], fullname=u'New name')
+        model.Session.remove()
+
+        assert_equal(user_cache.user_by_apikey(user['apikey']).fullname,
+                     u'New name')
+
+    @helpers.change_config('ckan.user_cache_ttl', '60')
+    def test_new_apikey_invalidates_the_old_one(self):
+        user = factories.User()
+        user_cache.user_by_apikey(user['apikey'])
+
+        helpers.call_action('user_generate_apikey', id=user['id'])
+        model.Session.remove()
+
+        assert_equal(user_cache.user_by_apikey(user['apikey']), None)
+
+    @helpers.change_config('ckan.user_cache_ttl', '0')
+    def test_disabled(self):
+        user = factories.User()
+        user_cache.user_by_apikey(user['apikey'])
+        model.Session.remove()
+
+        with model.meta.QueryCounter() as counter:
+            user_cache.user_by_apikey(user['apikey'])
+
+        assert_equal(counter.count, 1)
+
+
+class TestUserCache(object):
+
+    def test_size_is_bounded(self):
+        cache = user_cache.UserCache(size=2, ttl=60)
+        for apikey in ('a', 'b', 'c'):
+            cache.set(apikey, {'id': apikey})
+
+        assert_equal(cache.get('a'), None)
+        assert_equal(cache.get('c'), {'id': 'c'})
+
+    def test_entries_expire(self):
+        cache = user_cache.UserCache(size=2, ttl=0)
+        cache.set('a', {'id': 'a'})
+
+        assert_equal(cache.get('a'), None)
+
+    def test_invalidate(self):
+        cache = user_cache.UserCache(size=2, ttl=60)
+        cache.set('a', {'id': 'user-1'})
+        cache.set('b', {'id': 'user-2'})
+
+        cache.invalidate(['user-1'])
+
+        assert_equal(cache.get('a'), None)
+        assert_equal(cache.get('b'), {'id': 'user-2'})
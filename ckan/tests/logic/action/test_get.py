@@ -1,6 +1,9 @@
 import nose.tools
 
 import ckan.logic as logic
+import ckan.lib.dictization.model_dictize as model_dictize
+import ckan.lib.search as search
+import ckan.model as model
 import ckan.plugins as p
 import ckan.tests.helpers as helpers
 import ckan.tests.factories as factories
@@ -180,6 +183,42 @@ class TestGroupList(helpers.FunctionalTestBase):
 
         eq([g['name'] for g in child_group_returned['groups']], [expected_parent_group['name']])
 
+    def test_group_list_all_fields_package_count(self):
+        group = factories.Group()
+        factories.Dataset(groups=[{'name': group['name']}])
+        factories.Dataset(groups=[{'name': group['name']}])
+
+        group_list = helpers.call_action('group_list', all_fields=True)
+
+        eq(group_list[0]['package_count'], 2)
+
+    def test_group_list_all_fields_query_count_is_constant(self):
+        factories.Group(extras=[{'key': 'key1', 'value': 'val1'}])
+        with model.meta.QueryCounter() as one_group:
+            helpers.call_action('group_list', all_fields=True,
+                                include_extras=True)
+
+        for n in range(3):
+            factories.Group(extras=[{'key': 'key1', 'value': 'val1'}])
+        with model.meta.QueryCounter() as four_groups:
+            group_list = helpers.call_action('group_list', all_fields=True,
+                                             include_extras=True)
+
+        eq(len(group_list), 4)
+        eq(four_groups.count, one_group.count)
+
+    @helpers.change_config('ckan.group_dataset_counts_cache_ttl', '60')
+    def test_group_list_all_fields_caches_dataset_counts(self):
+        group = factories.Group()
+        model_dictize._group_dataset_counts['expires'] = 0
+        helpers.call_action('group_list', all_fields=True)
+
+        factories.Dataset(groups=[{'name': group['name']}])
+        group_list = helpers.call_action('group_list', all_fields=True)
+
+        eq(group_list[0]['package_count'], 0)
+        model_dictize._group_dataset_counts['expires'] = 0
+
     def test_group_list_limit(self):
 
         group1 = factories.Group()
@@ -411,6 +450,24 @@ class TestOrganizationList(helpers.FunctionalTestBase):
         assert (sorted(org_list) ==
                 sorted([g['name'] for g in [org1, org2]]))
 
+    def test_organization_list_all_fields_counts_private_datasets_of_members(
+            self):
+        user = factories.User()
+        org = factories.Organization(users=[{'name': user['name'],
+                                             'capacity': 'member'}])
+        factories.Dataset(owner_org=org['id'])
+        factories.Dataset(owner_org=org['id'], private=True)
+
+        member_list = helpers.call_action(
+            'organization_list', context={'user': user['name']},
+            all_fields=True)
+        other_list = helpers.call_action(
+            'organization_list', context={'user': factories.User()['name']},
+            all_fields=True)
+
+        eq(member_list[0]['package_count'], 2)
+        eq(other_list[0]['package_count'], 1)
+
 
 class TestOrganizationShow(helpers.FunctionalTestBase):
 
@@ -1125,6 +1182,85 @@ class TestPackageSearch(helpers.FunctionalTestBase):
         eq(len(results), 1)
         eq(results[0]['name'], private_dataset['name'])
 
+    def test_package_search_facet_display_names(self):
+        org = factories.Organization(name='test-org-facet',
+                                     title='Test Org Facet')
+        group = factories.Group(name='test-group-facet',
+                                title='Test Group Facet')
+        factories.Dataset(owner_org=org['id'],
+                          groups=[{'name': group['name']}])
+
+        search_facets = helpers.call_action(
+            'package_search',
+            **{'facet.field': ['organization', 'groups']})['search_facets']
+
+        eq(search_facets['organization']['items'][0]['display_name'],
+           'Test Org Facet')
+        eq(search_facets['groups']['items'][0]['display_name'],
+           'Test Group Facet')
+
+    def test_package_search_debug_query_count(self):
+        factories.Dataset()
+        factories.Dataset()
+
+        search_result = helpers.call_action('package_search', debug=True)
+
+        eq(search_result['count'], 2)
+        assert search_result['debug']['sql_queries'] > 0
+
+    def test_package_search_no_debug_by_default(self):
+        factories.Dataset()
+
+        search_result = helpers.call_action('package_search')
+
+        assert 'debug' not in search_result
+
+    def test_package_search_with_cursor(self):
+        names = sorted(factories.Dataset()['name'] for n in range(5))
+
+        found = []
+        cursor = '*'
+        while cursor:
+            search_result = helpers.call_action('package_search', rows=2,
+                                                cursor=cursor)
+            eq(search_result['count'], 5)
+            found.extend(r['name'] for r in search_result['results'])
+            cursor = search_result['next_cursor']
+
+        eq(sorted(found), names)
+
+    def test_package_search_without_cursor_has_no_next_cursor(self):
+        factories.Dataset()
+
+        search_result = helpers.call_action('package_search')
+
+        assert 'next_cursor' not in search_result
+
+    def test_package_search_cursor_and_start_not_allowed(self):
+        factories.Dataset()
+
+        assert_raises(search.SearchQueryError, helpers.call_action,
+                      'package_search', cursor='*', start=1)
+
+    def test_iter_package_search(self):
+        names = sorted(factories.Dataset()['name'] for n in range(5))
+
+        datasets = search.iter_package_search({}, {}, page_size=2)
+
+        eq(sorted(d['name'] for d in datasets), names)
+
+    def test_get_all_entity_ids_pages_through_the_index(self):
+        ids = sorted(factories.Dataset()['id'] for n in range(3))
+        query = search.query_for('package')
+
+        page_size = search.query.ENTITY_IDS_PAGE_SIZE
+        search.query.ENTITY_IDS_PAGE_SIZE = 2
+        try:
+            eq(sorted(query.get_all_entity_ids()), ids)
+            eq(len(query.get_all_entity_ids(max_results=1)), 1)
+        finally:
+            search.query.ENTITY_IDS_PAGE_SIZE = page_size
+
 
 class TestBadLimitQueryParameters(helpers.FunctionalTestBase):
     '''test class for #1258 non-int query parameters cause 500 errors
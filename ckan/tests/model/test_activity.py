@@ -0,0 +1,120 @@
+import datetime
+
+import nose.tools
+
+import ckan.model as model
+import ckan.tests.factories as factories
+import ckan.tests.helpers as helpers
+
+
+assert_equal = nose.tools.assert_equal
+
+
+def _fanout_rows():
+    return sorted(model.Session.execute(
+        model.activity_fanout_table.select()).fetchall())
+
+
+class TestActivityFanout(object):
+
+    def setup(self):
+        helpers.reset_db()
+
+    def test_dataset_activity_is_fanned_out(self):
+        user = factories.User()
+        group = factories.Group(user=user)
+        dataset = factories.Dataset(user=user, groups=[{'id': group['id']}])
+
+        activity = model.Session.query(model.Activity).filter_by(
+            object_id=dataset['id']).one()
+        targets = [row['target_id'] for row in _fanout_rows()
+                   if row['activity_id'] == activity.id]
+
+        assert_equal(sorted(targets),
+                     sorted([dataset['id'], user['id'], group['id']]))
+
+    def test_group_activity_list(self):
+        user = factories.User()
+        group = factories.Group(user=user)
+        dataset = factories.Dataset(user=user, groups=[{'id': group['id']}])
+        factories.Dataset(user=user)
+
+        activities = model.activity.group_activity_list(group['id'], 10, 0)
+
+        assert_equal(sorted([a.object_id for a in activities]),
+                     sorted([group['id'], dataset['id']]))
+
+    def test_removing_dataset_from_group_removes_its_activities(self):
+        user = factories.User()
+        group = factories.Group(user=user)
+        dataset = factories.Dataset(user=user, groups=[{'id': group['id']}])
+
+        helpers.call_action('member_delete', id=group['id'],
+                            object=dataset['id'], object_type='package')
+
+        activities = model.activity.group_activity_list(group['id'], 10, 0)
+        assert_equal([a.object_id for a in activities], [group['id']])
+
+    def test_adding_dataset_to_group_adds_its_activities(self):
+        user = factories.User()
+        group = factories.Group(user=user)
+        dataset = factories.Dataset(user=user)
+
+        helpers.call_action('member_create', id=group['id'],
+                            object=dataset['id'], object_type='package',
+                            capacity='public')
+
+        activities = model.activity.group_activity_list(group['id'], 10, 0)
+        assert dataset['id'] in [a.object_id for a in activities]
+
+    def test_private_dataset_activities_are_not_in_group_stream(self):
+        user = factories.User()
+        org = factories.Organization(user=user)
+        dataset = factories.Dataset(user=user, owner_org=org['id'])
+
+        helpers.call_action('package_patch', id=dataset['id'], private=True)
+
+        activities = model.activity.group_activity_list(org['id'], 10, 0)
+        assert dataset['id'] not in [a.object_id for a in activities]
+
+    def test_dashboard_activity_list_of_followed_group(self):
+        user = factories.User()
+        follower = factories.User()
+        group = factories.Group(user=user)
+        helpers.call_action('follow_group', context={'user': follower['name']},
+                            id=group['id'])
+        dataset = factories.Dataset(user=user, groups=[{'id': group['id']}])
+
+        activities = model.activity.dashboard_activity_list(follower['id'],
+                                                            10, 0)
+
+        object_ids = [a.object_id for a in activities]
+        assert dataset['id'] in object_ids
+        assert group['id'] in object_ids
+
+    def test_dashboard_new_activities_count(self):
+        user = factories.User()
+        follower = factories.User()
+        helpers.call_action('follow_user', context={'user': follower['name']},
+                            id=user['id'])
+        since = datetime.datetime.now()
+        for n in range(3):
+            factories.Dataset(user=user)
+
+        assert_equal(model.activity.dashboard_new_activities_count(
+            follower['id'], since, 10), 3)
+        assert_equal(model.activity.dashboard_new_activities_count(
+            follower['id'], since, 2), 2)
+        assert_equal(model.activity.dashboard_new_activities_count(
+            follower['id'], since, 10, [user['id']]), 0)
+
+    def test_rebuild_activity_fanout(self):
+        user = factories.User()
+        group = factories.Group(user=user)
+        factories.Dataset(user=user, groups=[{'id': group['id']}])
+        rows = _fanout_rows()
+
+        model.activity.rebuild_activity_fanout(model.Session)
+        model.Session.commit()
+
+        assert_equal(_fanout_rows(), rows)
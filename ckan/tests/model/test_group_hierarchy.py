@@ -0,0 +1,91 @@
+import nose.tools
+
+import ckan.tests.helpers as helpers
+import ckan.tests.factories as factories
+
+from ckan import model
+from ckan.model import group_hierarchy
+
+
+assert_equals = nose.tools.assert_equals
+
+
+def _rows():
+    table = group_hierarchy.group_hierarchy_table
+    return set(tuple(row) for row in model.Session.execute(table.select()))
+
+
+class TestGroupHierarchy(object):
+
+    def setup(self):
+        helpers.reset_db()
+
+    def _tree(self):
+        parent = factories.Organization()
+        child = factories.Organization(groups=[{'name': parent['name']}])
+        grandchild = factories.Organization(groups=[{'name': child['name']}])
+        return parent, child, grandchild
+
+    def test_new_memberships_are_recorded(self):
+        parent, child, grandchild = self._tree()
+
+        assert_equals(_rows(), set([(parent['id'], child['id'], 1),
+                                    (child['id'], grandchild['id'], 1),
+                                    (parent['id'], grandchild['id'], 2)]))
+
+    def test_deleted_memberships_are_removed(self):
+        parent, child, grandchild = self._tree()
+
+        helpers.call_action('member_delete', id=child['id'],
+                            object=parent['id'], object_type='group')
+
+        assert_equals(_rows(), set([(child['id'], grandchild['id'], 1)]))
+
+    def test_moving_a_group_moves_the_groups_underneath_it(self):
+        parent, child, grandchild = self._tree()
+        other = factories.Organization()
+
+        helpers.call_action('member_delete', id=child['id'],
+                            object=parent['id'], object_type='group')
+        helpers.call_action('member_create', id=child['id'],
+                            object=other['id'], object_type='group',
+                            capacity='public')
+
+        assert_equals(_rows(), set([(other['id'], child['id'], 1),
+                                    (child['id'], grandchild['id'], 1),
+                                    (other['id'], grandchild['id'], 2)]))
+        assert_equals(group_hierarchy.check(model.Session), [])
+
+    def test_hierarchy_methods(self):
+        parent, child, grandchild = self._tree()
+        parent_obj = model.Group.get(parent['id'])
+        grandchild_obj = model.Group.get(grandchild['id'])
+
+        assert_equals(
+            [g.name for g in grandchild_obj.get_parent_group_hierarchy(
+                type='organization')],
+            [parent['name'], child['name']])
+        assert_equals(
+            [(name, parent_id) for (id_, name, title, parent_id)
+             in parent_obj.get_children_group_hierarchy(
+                 type='organization')],
+            [(child['name'], parent['id']),
+             (grandchild['name'], child['id'])])
+        assert_equals(
+            [g.name for g in parent_obj.groups_allowed_to_be_its_parent(
+                type='organization')],
+            [])
+
+    def test_check_and_rebuild(self):
+        parent, child, grandchild = self._tree()
+        model.Session.execute('DELETE FROM group_hierarchy '
+                              'WHERE descendant_id = :id',
+                              {'id': grandchild['id']})
+
+        assert_equals(
+            sorted(group_hierarchy.check(model.Session)),
+            sorted([(parent['id'], grandchild['id'], 2, None),
+                    (child['id'], grandchild['id'], 1, None)]))
+
+        assert_equals(group_hierarchy.rebuild(model.Session), 3)
+        assert_equals(group_hierarchy.check(model.Session), [])
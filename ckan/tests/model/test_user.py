@@ -145,3 +145,30 @@ class TestPassword(unittest.TestCase):
         user_obj.save()
 
         nt.assert_true(user_obj.validate_password(password))
+
+
+class TestKnownUsers(object):
+
+    def setup(self):
+        helpers.reset_db()
+
+    def test_users_are_looked_up_once_per_session(self):
+        user = factories.User()
+        model.Session.remove()
+
+        with model.meta.QueryCounter() as counter:
+            by_name = model.User.by_name(user['name'])
+            by_id = model.User.get(user['id'])
+            by_apikey = model.User.by_apikey(user['apikey'])
+
+        nt.assert_equals(counter.count, 1)
+        nt.assert_true(by_name is by_id is by_apikey)
+
+    def test_renamed_users_are_not_found_by_their_old_name(self):
+        user = factories.User()
+        user_obj = model.User.by_name(user['name'])
+
+        user_obj.name = u'new-name'
+
+        nt.assert_equals(model.User.by_name(user['name']), None)
+        nt.assert_equals(model.User.get(u'new-name').id, user['id'])
@@ -1,8 +1,10 @@
 import nose
 
 from ckan import authz as auth
+from ckan import model
+import ckan.lib.permission_cache as permission_cache
 
-from ckan.tests import helpers
+from ckan.tests import factories, helpers
 
 
 assert_equals = nose.tools.assert_equals
@@ -64,3 +66,113 @@ class TestCheckConfigPermission(object):
         assert_equals(sorted(auth.check_config_permission(
             'roles_that_cascade_to_sub_groups')),
             sorted(['admin', 'editor']))
+
+
+class TestGroupPermissions(object):
+
+    def setup(self):
+        helpers.reset_db()
+        permission_cache.invalidate()
+
+    def _org_tree(self, user):
+        parent = factories.Organization(
+            users=[{'name': user['name'], 'capacity': 'admin'}])
+        child = factories.Organization(groups=[{'name': parent['name']}])
+        grandchild = factories.Organization(groups=[{'name': child['name']}])
+        return parent, child, grandchild
+
+    def test_permission_for_group(self):
+        user = factories.User()
+        org = factories.Organization(
+            users=[{'name': user['name'], 'capacity': 'editor'}])
+
+        assert auth.has_user_permission_for_group_or_org(
+            org['id'], user['name'], 'update_dataset')
+        assert not auth.has_user_permission_for_group_or_org(
+            org['id'], user['name'], 'admin')
+
+    def test_permissions_cascade_down_the_hierarchy(self):
+        user = factories.User()
+        parent, child, grandchild = self._org_tree(user)
+
+        assert auth.has_user_permission_for_group_or_org(
+            grandchild['id'], user['name'], 'update_dataset')
+
+    @helpers.change_config('ckan.auth.roles_that_cascade_to_sub_groups', '')
+    def test_permissions_do_not_cascade_when_disabled(self):
+        user = factories.User()
+        parent, child, grandchild = self._org_tree(user)
+
+        assert not auth.has_user_permission_for_group_or_org(
+            grandchild['id'], user['name'], 'update_dataset')
+
+    def test_hierarchy(self):
+        user = factories.User()
+        parent, child, grandchild = self._org_tree(user)
+
+        assert_equals(
+            auth.get_group_ancestor_ids(grandchild['id'], 'organization'),
+            set([parent['id'], child['id']]))
+        assert_equals(
+            auth.get_group_descendant_ids(parent['id'], 'organization'),
+            set([child['id'], grandchild['id']]))
+        assert_equals(auth.get_group_ancestor_ids(grandchild['id'], 'group'),
+                      set())
+
+    def test_checks_are_cached_in_the_session(self):
+        user = factories.User()
+        parent, child, grandchild = self._org_tree(user)
+        for org in (parent, child, grandchild):
+            auth.has_user_permission_for_group_or_org(
+                org['id'], user['name'], 'update_dataset')
+
+        with model.meta.QueryCounter() as counter:
+            for org in (parent, child, grandchild):
+                auth.has_user_permission_for_group_or_org(
+                    org['id'], user['name'], 'update_dataset')
+
+        assert_equals(counter.count, 0)
+
+    def test_new_memberships_are_seen(self):
+        user = factories.User()
+        org = factories.Organization()
+        assert not auth.has_user_permission_for_group_or_org(
+            org['id'], user['name'], 'read')
+
+        helpers.call_action('member_create', id=org['id'],
+                            object=user['id'], object_type='user',
+                            capacity='member')
+
+        assert auth.has_user_permission_for_group_or_org(
+            org['id'], user['name'], 'read')
+
+    @helpers.change_config('ckan.permission_cache_ttl', '60')
+    def test_shared_values_are_invalidated_by_commits(self):
+        user = factories.User()
+        org = factories.Organization(
+            users=[{'name': user['name'], 'capacity': 'member'}])
+        assert auth.has_user_permission_for_group_or_org(
+            org['id'], user['name'], 'read')
+        model.Session.remove()
+
+        helpers.call_action('member_delete', id=org['id'],
+                            object=user['id'], object_type='user')
+        model.Session.remove()
+
+        assert not auth.has_user_permission_for_group_or_org(
+            org['id'], user['name'], 'read')
+
+    @helpers.change_config('ckan.permission_cache_ttl', '60')
+    def test_values_are_shared_between_sessions(self):
+        user = factories.User()
+        org = factories.Organization(
+            users=[{'name': user['name'], 'capacity': 'member'}])
+        auth.has_user_permission_for_group_or_org(
+            org['id'], user['name'], 'read')
+        model.Session.remove()
+
+        with model.meta.QueryCounter() as counter:
+            auth.users_role_for_group_or_org(org['id'], user['name'])
+
+        # only the group and the user are looked up
+        assert_equals(counter.count, 2)
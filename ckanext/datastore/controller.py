@@ -1,3 +1,4 @@
+import json
 import StringIO
 import unicodecsv as csv
 
@@ -6,8 +7,15 @@ import pylons
 import ckan.plugins as p
 import ckan.lib.base as base
 import ckan.model as model
+import ckanext.datastore.db as db
 
-from ckan.common import request
+from ckan.common import request, OrderedDict
+
+
+DUMP_FORMATS = {
+    'csv': ('text/csv', 'csv'),
+    'jsonl': ('application/x-ndjson', 'jsonl'),
+}
 
 
 class DatastoreController(base.BaseController):
@@ -18,27 +26,69 @@ class DatastoreController(base.BaseController):
             'user': p.toolkit.c.user
         }
 
-        data_dict = {
-            'resource_id': resource_id,
-            'limit': request.GET.get('limit', 100000),
-            'offset': request.GET.get('offset', 0)
-        }
+        dump_format = request.GET.get('format', 'csv').lower()
+        if dump_format not in DUMP_FORMATS:
+            base.abort(400, p.toolkit._('Unsupported format: {0}').format(
+                dump_format))
 
+        try:
+            limit = request.GET.get('limit')
+            limit = int(limit) if limit is not None else None
+            offset = int(request.GET.get('offset', 0))
+        except ValueError:
+            base.abort(400, p.toolkit._('limit and offset must be integers'))
+
+        # an empty search checks access, resolves aliases and gets the
+        # fields; the records themselves are streamed from a named cursor
         action = p.toolkit.get_action('datastore_search')
         try:
-            result = action(context, data_dict)
+            result = action(context, {'resource_id': resource_id,
+                                      'limit': 0})
         except p.toolkit.ObjectNotFound:
             base.abort(404, p.toolkit._('DataStore resource not found'))
+        except p.toolkit.NotAuthorized:
+            base.abort(403, p.toolkit._('Not authorized to read resource'))
 
-        pylons.response.headers['Content-Type'] = 'text/csv'
+        # read through the read-only user, like datastore_search does
+        read_url = pylons.config.get('ckan.datastore.read_url')
+        write_url = pylons.config.get('ckan.datastore.write_url')
+        data_dict = {
+            'resource_id': result['resource_id'],
+            'fields': result['fields'],
+            'limit': limit,
+            'offset': offset,
+            'connection_url': read_url or write_url,
+        }
+
+        content_type, extension = DUMP_FORMATS[dump_format]
+        pylons.response.headers['Content-Type'] = content_type
         pylons.response.headers['Content-disposition'] = \
-            'attachment; filename="{name}.csv"'.format(name=resource_id)
+            'attachment; filename="{name}.{ext}"'.format(name=resource_id,
+                                                         ext=extension)
+
+        chunks = db.dump(context, data_dict)
+        header = [x['id'] for x in result['fields']]
+        if dump_format == 'jsonl':
+            return _jsonl_writer(header, chunks)
+        return _csv_writer(header, chunks)
+
+
+def _csv_writer(header, chunks):
+    '''Yield the CSV lines of a dump, one chunk of rows at a time.'''
+    f = StringIO.StringIO()
+    wr = csv.writer(f, encoding='utf-8')
+    wr.writerow(header)
+    yield f.getvalue()
+
+    for rows in chunks:
         f = StringIO.StringIO()
         wr = csv.writer(f, encoding='utf-8')
+        wr.writerows(rows)
+        yield f.getvalue()
 
-        header = [x['id'] for x in result['fields']]
-        wr.writerow(header)
 
-        for record in result['records']:
-            wr.writerow([record[column] for column in header])
-        return f.getvalue()
+def _jsonl_writer(header, chunks):
+    '''Yield a dump as JSON lines, one object per record.'''
+    for rows in chunks:
+        yield ''.join(json.dumps(OrderedDict(zip(header, row))) + '\n'
+                      for row in rows)
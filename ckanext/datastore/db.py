@@ -8,12 +8,15 @@ import logging
 import pprint
 import copy
 import hashlib
+import itertools
+import time
 
 import pylons
 import distutils.version
 import sqlalchemy
 from sqlalchemy.exc import (ProgrammingError, IntegrityError,
                             DBAPIError, DataError)
+import psycopg2.extensions
 import psycopg2.extras
 import ckan.lib.cli as cli
 import ckan.plugins as p
@@ -36,8 +39,13 @@ else:
 _pg_types = {}
 _type_names = set()
 _engines = {}
+_metadata_cache = {}  # resource_id: table metadata, see _get_metadata()
+_METADATA_CACHE_SIZE = 1000
 
 _TIMEOUT = 60000  # milliseconds
+_DUMP_CHUNK_SIZE = 10000  # rows fetched per round trip by dump()
+_BULK_LOAD_THRESHOLD = 1000  # records, see _use_bulk_load()
+_COPY_BUFFER_SIZE = 1000  # records encoded at a time for COPY
 
 # See http://www.postgresql.org/docs/9.2/static/errcodes-appendix.html
 _PG_ERR_CODE = {
@@ -225,18 +233,92 @@ def _guess_type(field):
     return 'text'
 
 
+def _get_metadata(context, resource_id):
+    '''Returns the cached metadata entry of a resource table.
+
+    Entries are kept per process and are dropped when this process creates,
+    alters or deletes the table. Changes made by other processes are noticed
+    by comparing a stamp of the table's catalogue rows, which is checked at
+    most once per action call and, if
+    ``ckan.datastore.metadata_cache_ttl`` is set, at most once every that
+    many seconds.
+    '''
+    checked = context.setdefault('datastore_metadata_checked', set())
+    entry = _metadata_cache.get(resource_id)
+    if entry is None or (resource_id not in checked and
+                         not _is_fresh(entry)):
+        stamp = _metadata_stamp(context['connection'], resource_id)
+        if entry is None or entry['stamp'] != stamp:
+            if len(_metadata_cache) >= _METADATA_CACHE_SIZE:
+                _metadata_cache.clear()
+            entry = {'stamp': stamp}
+            _metadata_cache[resource_id] = entry
+        entry['checked'] = time.time()
+    checked.add(resource_id)
+    return entry
+
+
+def _is_fresh(entry):
+    ttl = float(pylons.config.get('ckan.datastore.metadata_cache_ttl', 0))
+    return time.time() - entry['checked'] < ttl
+
+
+def _metadata_stamp(connection, resource_id):
+    '''Returns a value that changes whenever the table or its indexes change
+
+    The row of a table in pg_class gets a new xmin when the table is altered
+    and the index oids change when indexes are created or dropped. Returns
+    None if there is no such table or view.
+    '''
+    stamp = connection.execute(u'''
+        SELECT c.relkind, c.oid, c.xmin::text,
+               array_to_string(array(SELECT i.indexrelid FROM pg_index i
+                                     WHERE i.indrelid = c.oid
+                                     ORDER BY i.indexrelid), ',')
+        FROM pg_class c
+        WHERE c.relname = %s AND c.relkind IN ('r', 'v')
+        AND c.relnamespace = (SELECT oid FROM pg_namespace
+                              WHERE nspname = 'public')
+        ''', resource_id).fetchone()
+    return tuple(stamp) if stamp else None
+
+
+def _invalidate_metadata(context, resource_id):
+    '''Drops the cached metadata of a table that is being changed.'''
+    _metadata_cache.pop(resource_id, None)
+    context.get('datastore_metadata_checked', set()).discard(resource_id)
+
+
+def resource_is_active(engine, resource_id):
+    '''Returns True if there is a DataStore table for the resource.
+
+    Does not query the database if the cached metadata is still fresh.
+    '''
+    entry = _metadata_cache.get(resource_id)
+    if entry is None or not _is_fresh(entry):
+        connection = engine.connect()
+        try:
+            entry = _get_metadata({'connection': connection}, resource_id)
+        finally:
+            connection.close()
+    return entry['stamp'] is not None and entry['stamp'][0] == 'r'
+
+
 def _get_fields(context, data_dict):
-    fields = []
-    all_fields = context['connection'].execute(
-        u'SELECT * FROM "{0}" LIMIT 1'.format(data_dict['resource_id'])
-    )
-    for field in all_fields.cursor.description:
-        if not field[0].startswith('_'):
-            fields.append({
-                'id': field[0].decode('utf-8'),
-                'type': _get_type(context, field[1])
-            })
-    return fields
+    metadata = _get_metadata(context, data_dict['resource_id'])
+    if 'fields' not in metadata:
+        fields = []
+        all_fields = context['connection'].execute(
+            u'SELECT * FROM "{0}" LIMIT 1'.format(data_dict['resource_id'])
+        )
+        for field in all_fields.cursor.description:
+            if not field[0].startswith('_'):
+                fields.append({
+                    'id': field[0].decode('utf-8'),
+                    'type': _get_type(context, field[1])
+                })
+        metadata['fields'] = fields
+    return [dict(field) for field in metadata['fields']]
 
 
 def _get_fields_types(context, data_dict):
@@ -340,6 +422,7 @@ def create_table(context, data_dict):
     )
 
     context['connection'].execute(sql_string.replace('%', '%%'))
+    _invalidate_metadata(context, data_dict['resource_id'])
 
 
 def _get_aliases(context, data_dict):
@@ -456,6 +539,7 @@ def create_indexes(context, data_dict):
                      if sql_index_string.find(c) != -1]
         if not has_index:
             connection.execute(sql_index_string)
+    _invalidate_metadata(context, data_dict['resource_id'])
 
 
 def _build_fts_indexes(connection, data_dict, sql_index_str_method, fields):
@@ -601,6 +685,8 @@ def alter_table(context, data_dict):
             field['id'],
             field['type'])
         context['connection'].execute(sql.replace('%', '%%'))
+    if new_fields:
+        _invalidate_metadata(context, data_dict['resource_id'])
 
 
 def insert_data(context, data_dict):
@@ -624,6 +710,11 @@ def upsert_data(context, data_dict):
     fields = _get_fields(context, data_dict)
     field_names = _pluck('id', fields)
     records = data_dict['records']
+
+    if _use_bulk_load(records):
+        _bulk_upsert_data(context, data_dict, fields, method)
+        return
+
     sql_columns = ", ".join(['"%s"' % name.replace(
         '%', '%%') for name in field_names] + ['"_full_text"'])
 
@@ -651,7 +742,7 @@ def upsert_data(context, data_dict):
 
         try:
             context['connection'].execute(sql_string, rows)
-        except sqlalchemy.exc.DataError as err:
+        except sqlalchemy.exc.DataError:
             raise InvalidDataError(
                 toolkit._("The data was invalid (for example: a numeric value "
                           "is out of range or was inserted into a text field)."
@@ -750,6 +841,250 @@ def upsert_data(context, data_dict):
                     (used_values + [full_text] + unique_values) * 2)
 
 
+def _use_bulk_load(records):
+    '''Return True if the records should be loaded with COPY.
+
+    Set ``ckan.datastore.bulk_load_threshold`` to the number of records from
+    which bulk loading is used, or to 0 to disable it.
+    '''
+    threshold = int(pylons.config.get('ckan.datastore.bulk_load_threshold',
+                                      _BULK_LOAD_THRESHOLD))
+    return threshold > 0 and len(records) >= threshold
+
+
+def _bulk_upsert_data(context, data_dict, fields, method):
+    '''Insert, update or upsert records with COPY and set-based statements.
+
+    Records are validated as in :py:func:`upsert_data`, streamed into a
+    temporary staging table with ``COPY FROM STDIN`` and merged into the
+    resource table with one statement, which also builds ``_full_text``.
+    Updates and upserts are merged in runs of consecutive records that set
+    the same fields, keeping the last record of each key, so the result is
+    the same as applying the records one by one.
+    '''
+    field_names = _pluck('id', fields)
+    records = data_dict['records']
+
+    if method == _INSERT:
+        for num, record in enumerate(records):
+            _validate_record(record, num, field_names)
+        try:
+            _bulk_load(context, data_dict, fields, records, 0, method, [])
+        except sqlalchemy.exc.DataError:
+            raise InvalidDataError(
+                toolkit._("The data was invalid (for example: a numeric value "
+                          "is out of range or was inserted into a text field)."
+                          ))
+        return
+
+    unique_keys = _get_unique_key(context, data_dict)
+    if len(unique_keys) < 1:
+        raise ValidationError({
+            'table': [u'table does not have a unique key defined']
+        })
+
+    for record in records:
+        missing_fields = [field for field in unique_keys
+                          if field not in record]
+        if missing_fields:
+            raise ValidationError({
+                'key': [u'''fields "{fields}" are missing
+                    but needed as key'''.format(
+                        fields=', '.join(missing_fields))]
+            })
+
+        non_existing_filed_names = [field for field in record
+                                    if field not in field_names]
+        if non_existing_filed_names:
+            raise ValidationError({
+                'fields': [u'fields "{0}" do not exist'.format(
+                    ', '.join(non_existing_filed_names))]
+            })
+
+    start = 0
+    while start < len(records):
+        used_field_names = set(records[start])
+        end = start + 1
+        while end < len(records) and set(records[end]) == used_field_names:
+            end += 1
+        used_fields = [field for field in fields
+                       if field['id'] in used_field_names]
+        _bulk_load(context, data_dict, used_fields, records[start:end],
+                   start, method, unique_keys)
+        start = end
+
+
+def _bulk_load(context, data_dict, fields, records, first_row, method,
+               unique_keys):
+    '''Load records setting the given fields through a staging table.'''
+    connection = context['connection']
+    res_id = data_dict['resource_id']
+
+    column_types = dict(connection.execute(
+        u'''SELECT attname, format_type(atttypid, atttypmod)
+            FROM pg_attribute
+            WHERE attrelid = %s::regclass AND attnum > 0
+            AND NOT attisdropped''', u'"{0}"'.format(res_id)).fetchall())
+    nested_json_type = connection.execute(
+        u'''SELECT format_type(atttypid, atttypmod) FROM pg_attribute
+            WHERE attrelid = 'nested'::regclass AND attname = 'json'
+        ''').scalar()
+
+    staging_columns = []
+    values = []
+    for field in fields:
+        column = u'"{0}"'.format(field['id'])
+        if field['type'] == 'nested':
+            staging_columns.append(u'{0} text'.format(column))
+            value = u'''CASE WHEN s.{0} IS NULL THEN NULL
+                ELSE ROW(s.{0}::{1}, '')::nested END'''
+            values.append(value.format(column, nested_json_type))
+        else:
+            staging_columns.append(u'{0} {1}'.format(
+                column, column_types[field['id']]))
+            values.append(u's.{0}'.format(column))
+    staging_columns += [u'"_full_text" text', u'"_row" int']
+    values.append(u'to_tsvector(s."_full_text")')
+
+    staging_sql = u'''CREATE TEMPORARY TABLE "_datastore_staging" ({0})
+        ON COMMIT DROP'''.format(u', '.join(staging_columns))
+    connection.execute(staging_sql.replace('%', '%%'))
+
+    copy_sql = u'COPY "_datastore_staging" ({0}) FROM STDIN'.format(
+        u', '.join([u'"{0}"'.format(field['id']) for field in fields] +
+                   [u'"_full_text"', u'"_row"']))
+    raw_connection = connection.connection
+    encoding = psycopg2.extensions.encodings[raw_connection.encoding]
+    cursor = raw_connection.cursor()
+    try:
+        cursor.copy_expert(copy_sql, _CopyReader(
+            _copy_lines(fields, records, first_row), encoding))
+    except psycopg2.Error, e:
+        # raise the same SQLAlchemy errors as the INSERT statements
+        raise DBAPIError.instance(copy_sql, None, e, psycopg2.Error)
+    finally:
+        cursor.close()
+
+    sql_columns = u', '.join([u'"{0}"'.format(field['id'])
+                              for field in fields] + [u'"_full_text"'])
+    primary_key = u', '.join([u'"{0}"'.format(key) for key in unique_keys])
+    matches = u' AND '.join([u't."{0}" = s."{0}"'.format(key)
+                             for key in unique_keys])
+    # the last record of a repeated key wins, as when applied one by one
+    latest = u'''(SELECT DISTINCT ON ({key}) * FROM "_datastore_staging"
+                  ORDER BY {key}, "_row" DESC)'''.format(key=primary_key)
+
+    if method == _UPDATE:
+        missing_sql = u'''SELECT s."_row" FROM "_datastore_staging" s
+            WHERE NOT EXISTS (SELECT 1 FROM "{res_id}" t WHERE {matches})
+            ORDER BY s."_row" LIMIT 1'''.format(res_id=res_id,
+                                                matches=matches)
+        missing = connection.execute(
+            missing_sql.replace('%', '%%')).scalar()
+        if missing is not None:
+            record = records[missing - first_row]
+            raise ValidationError({
+                'key': [u'key "{0}" not found'.format(
+                    [record[key] for key in unique_keys])]
+            })
+
+    if method in [_UPDATE, _UPSERT]:
+        update_sql = u'''UPDATE "{res_id}" t SET ({columns}) = ({values})
+            FROM {latest} s WHERE {matches}'''
+        connection.execute(update_sql.format(
+            res_id=res_id, columns=sql_columns, values=u', '.join(values),
+            latest=latest, matches=matches).replace('%', '%%'))
+
+    if method == _INSERT:
+        insert_sql = u'''INSERT INTO "{res_id}" ({columns})
+            SELECT {values} FROM "_datastore_staging" s
+            ORDER BY s."_row"'''
+        connection.execute(insert_sql.format(
+            res_id=res_id, columns=sql_columns,
+            values=u', '.join(values)).replace('%', '%%'))
+    elif method == _UPSERT:
+        insert_sql = u'''INSERT INTO "{res_id}" ({columns})
+            SELECT {values} FROM {latest} s
+            WHERE NOT EXISTS (SELECT 1 FROM "{res_id}" t WHERE {matches})
+            ORDER BY s."_row"'''
+        connection.execute(insert_sql.format(
+            res_id=res_id, columns=sql_columns, values=u', '.join(values),
+            latest=latest, matches=matches).replace('%', '%%'))
+
+    connection.execute(u'DROP TABLE "_datastore_staging"')
+
+
+def _copy_lines(fields, records, first_row):
+    '''Yield the records as lines in the text format of COPY.'''
+    for num, record in enumerate(records, first_row):
+        row = []
+        for field in fields:
+            value = record.get(field['id'])
+            if value is not None and field['type'] == 'nested':
+                value = json.dumps(value)
+            row.append(_copy_escape(_copy_literal(value)))
+        row.append(_copy_escape(_to_full_text(fields, record)))
+        row.append(unicode(num))
+        yield u'\t'.join(row) + u'\n'
+
+
+def _copy_literal(value):
+    '''Return the PostgreSQL text representation of a JSON value.'''
+    if value is None or isinstance(value, basestring):
+        return value
+    if isinstance(value, bool):
+        return u'true' if value else u'false'
+    if isinstance(value, float):
+        return unicode(repr(value))
+    if isinstance(value, (int, long)):
+        return unicode(value)
+    if isinstance(value, (list, tuple)):
+        return u'{' + u','.join(_array_element(item) for item in value) + u'}'
+    return json.dumps(value)
+
+
+def _array_element(value):
+    if value is None:
+        return u'NULL'
+    if isinstance(value, (list, tuple)):
+        return _copy_literal(value)
+    value = _copy_literal(value)
+    return u'"' + value.replace(u'\\', u'\\\\').replace(u'"', u'\\"') + u'"'
+
+
+def _copy_escape(value):
+    if value is None:
+        return u'\\N'
+    return (value.replace(u'\\', u'\\\\').replace(u'\n', u'\\n')
+            .replace(u'\r', u'\\r').replace(u'\t', u'\\t'))
+
+
+class _CopyReader(object):
+    '''File-like object feeding COPY from an iterator of unicode lines.
+
+    Lines are encoded ``_COPY_BUFFER_SIZE`` at a time, so the COPY data is
+    never held in memory as a whole.
+    '''
+    def __init__(self, lines, encoding):
+        self.lines = lines
+        self.encoding = encoding
+        self.buffer = ''
+
+    def read(self, size=-1):
+        while size < 0 or len(self.buffer) < size:
+            chunk = list(itertools.islice(self.lines, _COPY_BUFFER_SIZE))
+            if not chunk:
+                break
+            self.buffer += u''.join(chunk).encode(self.encoding)
+        if size < 0:
+            size = len(self.buffer)
+        data, self.buffer = self.buffer[:size], self.buffer[size:]
+        return data
+
+    def readline(self, size=-1):
+        return self.read(size)
+
+
 def _get_unique_key(context, data_dict):
     sql_get_unique_key = '''
     SELECT
@@ -767,9 +1102,12 @@ def _get_unique_key(context, data_dict):
         AND idx.indisprimary = false
         AND t.relname = %s
     '''
-    key_parts = context['connection'].execute(sql_get_unique_key,
-                                              data_dict['resource_id'])
-    return [x[0] for x in key_parts]
+    metadata = _get_metadata(context, data_dict['resource_id'])
+    if 'unique_key' not in metadata:
+        key_parts = context['connection'].execute(sql_get_unique_key,
+                                                  data_dict['resource_id'])
+        metadata['unique_key'] = [x[0] for x in key_parts]
+    return list(metadata['unique_key'])
 
 
 def _validate_record(record, num, field_names):
@@ -833,7 +1171,10 @@ def _where(where_clauses_and_values):
 
 def _insert_links(data_dict, limit, offset):
     '''Adds link to the next/prev part (same limit, offset=offset+limit)
-    and the resource page.'''
+    and the resource page.
+
+    In cursor mode the next link continues from ``next_cursor`` instead, and
+    there is no previous link.'''
     data_dict['_links'] = {}
 
     # get the url from the request
@@ -862,6 +1203,18 @@ def _insert_links(data_dict, limit, offset):
     parsed_next[4] = urllib.urlencode(arguments_next)
     parsed_prev[4] = urllib.urlencode(arguments_prev)
 
+    if 'next_cursor' in data_dict:
+        arguments_start['cursor'] = '*'
+        arguments_next.pop('offset')
+        arguments_next['cursor'] = data_dict['next_cursor']
+        parsed_start[4] = urllib.urlencode(arguments_start)
+        parsed_next[4] = urllib.urlencode(arguments_next)
+
+        data_dict['_links']['start'] = urlparse.urlunparse(parsed_start)
+        if data_dict['next_cursor']:
+            data_dict['_links']['next'] = urlparse.urlunparse(parsed_next)
+        return
+
     # add the links to the data dict
     data_dict['_links']['start'] = urlparse.urlunparse(parsed_start)
     data_dict['_links']['next'] = urlparse.urlunparse(parsed_next)
@@ -951,6 +1304,18 @@ def search_data(context, data_dict):
     # FIXME: Remove duplicates on select columns
     select_columns = ', '.join(query_dict['select']).replace('%', '%%')
     ts_query = query_dict['ts_query'].replace('%', '%%')
+
+    # later cursor pages only see the remaining records, so they don't count
+    if data_dict.get('include_total', True) and \
+            data_dict.get('cursor', '*') == '*':
+        estimated_total = _estimate_total(context, data_dict, query_dict,
+                                          where_clause)
+        if estimated_total is None:
+            select_columns += u', count(*) over() as "_full_count"'
+        else:
+            data_dict['total'] = estimated_total
+            data_dict['total_was_estimated'] = True
+
     resource_id = data_dict['resource_id'].replace('%', '%%')
     sort = query_dict['sort']
     limit = query_dict['limit']
@@ -980,8 +1345,45 @@ def search_data(context, data_dict):
 
     results = _execute_single_statement(context, sql_string, where_values)
 
+    data_dict = format_results(context, results, data_dict,
+                               query_dict.get('cursor_keys'))
+    if data_dict.get('next_cursor'):
+        page_size = _as_int(limit)
+        if page_size is None or len(data_dict['records']) < page_size:
+            # a short page is the last one
+            data_dict['next_cursor'] = None
     _insert_links(data_dict, limit, offset)
-    return format_results(context, results, data_dict)
+    return data_dict
+
+
+def _as_int(limit):
+    '''Returns the limit of a query as an int, with None for ALL'''
+    try:
+        return int(limit)
+    except ValueError:
+        return None
+
+
+def _estimate_total(context, data_dict, query_dict, where_clause):
+    '''Returns the planner's estimate of the number of records, if usable.
+
+    Counting the records of a large table means scanning all of it, so when
+    ``total_estimation_threshold`` is given, the query doesn't filter the
+    records and PostgreSQL estimates there are at least that many of them
+    (from ``pg_class.reltuples``, updated by ``ANALYZE``), the estimate is
+    returned instead. Otherwise returns None and the records are counted.
+    '''
+    threshold = data_dict.get('total_estimation_threshold')
+    if threshold is None or where_clause or query_dict['ts_query'] \
+            or query_dict.get('distinct'):
+        return None
+
+    estimate = context['connection'].execute(
+        u'SELECT reltuples FROM pg_class WHERE oid = %s::regclass',
+        datastore_helpers.identifier(data_dict['resource_id'])).scalar()
+    if estimate is None or estimate < int(threshold):
+        return None
+    return int(estimate)
 
 
 def _execute_single_statement(context, sql_string, where_values):
@@ -995,7 +1397,7 @@ def _execute_single_statement(context, sql_string, where_values):
     return results
 
 
-def format_results(context, results, data_dict):
+def format_results(context, results, data_dict, cursor_keys=None):
     result_fields = []
     for field in results.cursor.description:
         result_fields.append({
@@ -1005,7 +1407,16 @@ def format_results(context, results, data_dict):
     if len(result_fields) and result_fields[-1]['id'] == '_full_count':
         result_fields.pop()  # remove _full_count
 
+    cursor_fields = []
+    if cursor_keys:
+        # the sort keys selected by the datastore_search cursor mode
+        cursor_fields = [field for field in result_fields
+                         if field['id'].startswith('_cursor_')]
+        result_fields = [field for field in result_fields
+                         if not field['id'].startswith('_cursor_')]
+
     records = []
+    row = None
     for row in results:
         converted_row = {}
         if '_full_count' in row:
@@ -1017,6 +1428,13 @@ def format_results(context, results, data_dict):
     data_dict['records'] = records
     data_dict['fields'] = result_fields
 
+    if cursor_keys:
+        data_dict['next_cursor'] = None
+        if row is not None:
+            data_dict['next_cursor'] = datastore_helpers.encode_cursor(
+                cursor_keys, [convert(row[field['id']], field['type'])
+                              for field in cursor_fields])
+
     return _unrename_json_field(data_dict)
 
 
@@ -1051,6 +1469,7 @@ def create(context, data_dict):
 
     _rename_json_field(data_dict)
 
+    committed = False
     trans = context['connection'].begin()
     try:
         # check if table already existes
@@ -1070,6 +1489,7 @@ def create(context, data_dict):
         if data_dict.get('private'):
             _change_privilege(context, data_dict, 'REVOKE')
         trans.commit()
+        committed = True
         return _unrename_json_field(data_dict)
     except IntegrityError, e:
         if e.orig.pgcode == _PG_ERR_CODE['unique_violation']:
@@ -1098,6 +1518,9 @@ def create(context, data_dict):
         trans.rollback()
         raise
     finally:
+        if not committed:
+            # the cache may hold metadata of the rolled back changes
+            _invalidate_metadata(context, data_dict['resource_id'])
         context['connection'].close()
 
 
@@ -1163,6 +1586,7 @@ def delete(context, data_dict):
             context['connection'].execute(
                 u'DROP TABLE "{0}" CASCADE'.format(data_dict['resource_id'])
             )
+            _invalidate_metadata(context, data_dict['resource_id'])
         else:
             delete_data(context, data_dict)
 
@@ -1202,6 +1626,65 @@ def search(context, data_dict):
         context['connection'].close()
 
 
+def dump(context, data_dict):
+    '''Yield the records of a DataStore table in chunks of rows.
+
+    Records are read through a server-side (named) cursor, so only one
+    chunk of ``context['chunk_size']`` rows is held in memory at a time,
+    whatever the size of the table. Each chunk is a list of rows and each
+    row is a list of values in the order of ``data_dict['fields']``.
+
+    ``data_dict`` must contain the real ``resource_id`` (not an alias), the
+    ``fields`` to dump (as returned by ``datastore_search``) and the
+    ``connection_url``. ``limit`` and ``offset`` are optional. Access checks
+    are the responsibility of the caller.
+    '''
+    chunk_size = context.get('chunk_size', _DUMP_CHUNK_SIZE)
+    timeout = context.get('query_timeout', _TIMEOUT)
+
+    select_columns = u', '.join(u'"{0}"'.format(field['id'])
+                                for field in data_dict['fields'])
+    sql_string = u'SELECT {select} FROM "{resource}"'.format(
+        select=select_columns,
+        resource=data_dict['resource_id'])
+    if '_id' in [field['id'] for field in data_dict['fields']]:
+        sql_string += u' ORDER BY _id'
+    if data_dict.get('limit') is not None:
+        sql_string += u' LIMIT {0:d}'.format(int(data_dict['limit']))
+    if data_dict.get('offset'):
+        sql_string += u' OFFSET {0:d}'.format(int(data_dict['offset']))
+
+    engine = _get_engine(data_dict)
+    context['connection'] = engine.connect()
+    _cache_types(context)
+
+    # named cursors only live inside a transaction, which is rolled back
+    # once all the rows have been read
+    trans = context['connection'].begin()
+    try:
+        context['connection'].execute(
+            u'SET LOCAL statement_timeout TO {0}'.format(timeout))
+        cursor = context['connection'].connection.cursor(
+            name='datastore_dump')
+        cursor.itersize = chunk_size
+        cursor.execute(sql_string)
+        types = None
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            if types is None:
+                types = [_get_type(context, column[1])
+                         for column in cursor.description]
+            yield [[convert(value, type_name)
+                    for value, type_name in zip(row, types)]
+                   for row in rows]
+        cursor.close()
+    finally:
+        trans.rollback()
+        context['connection'].close()
+
+
 def search_sql(context, data_dict):
     engine = _get_engine(data_dict)
     context['connection'] = engine.connect()
@@ -1,3 +1,4 @@
+import base64
 import logging
 import json
 
@@ -36,6 +37,27 @@ def validate_int(i, non_negative=False):
     return i >= 0 or not non_negative
 
 
+def encode_cursor(sort, values):
+    '''Returns an opaque datastore_search cursor for the given sort keys
+
+    :param sort: the (field, direction) pairs the records are sorted by
+    :param values: the values of those fields in the last record returned
+    '''
+    return base64.urlsafe_b64encode(json.dumps([sort, values]))
+
+
+def decode_cursor(cursor):
+    '''Returns the (sort, values) pair of a cursor, or None if invalid'''
+    try:
+        sort, values = json.loads(base64.urlsafe_b64decode(str(cursor)))
+        sort = [tuple(key) for key in sort]
+    except (TypeError, ValueError, UnicodeEncodeError):
+        return None
+    if not isinstance(values, list) or len(sort) != len(values):
+        return None
+    return sort, values
+
+
 def _strip(input):
     if isinstance(input, basestring) and len(input) and input[0] == input[-1]:
         return input.strip().strip('"')
@@ -365,6 +365,23 @@ def datastore_search(context, data_dict):
     :param sort: comma separated field names with ordering
                  e.g.: "fieldname1, fieldname2 desc"
     :type sort: string
+    :param cursor: page through the records with a cursor rather than an
+                   offset: pass ``*`` for the first page and then the
+                   ``next_cursor`` of the previous page. Each page costs the
+                   same however deep it is. The records are ordered by
+                   ``sort`` and then ``_id``, full text ranking is not used
+                   for ordering and ``distinct`` is not supported (optional)
+    :type cursor: string
+    :param include_total: count the total number of matching records
+                          (optional, default: true)
+    :type include_total: bool
+    :param total_estimation_threshold: if the query has no ``filters`` or
+                                       ``q`` and PostgreSQL estimates that
+                                       the resource has at least this many
+                                       records, return that estimate as the
+                                       total instead of counting them
+                                       (optional)
+    :type total_estimation_threshold: int
 
     Setting the ``plain`` flag to false enables the entire PostgreSQL `full text search query language`_.
 
@@ -387,10 +404,18 @@ def datastore_search(context, data_dict):
     :type limit: int
     :param filters: query filters
     :type filters: list of dictionaries
-    :param total: number of total matching records
+    :param total: number of total matching records, not included if
+                  ``include_total`` is false or after the first page in
+                  cursor mode
     :type total: int
+    :param total_was_estimated: true if ``total`` is an estimate (only
+                                included if so)
+    :type total_was_estimated: bool
     :param records: list of matching results
     :type records: list of dictionaries
+    :param next_cursor: the ``cursor`` of the next page, or null on the last
+                        page (only included in cursor mode)
+    :type next_cursor: string
 
     '''
     schema = context.get('schema', dsschema.datastore_search_schema())
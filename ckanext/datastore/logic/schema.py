@@ -146,6 +146,9 @@ def datastore_search_schema():
         'fields': [ignore_missing, list_of_strings_or_string],
         'sort': [ignore_missing, list_of_strings_or_string],
         'distinct': [ignore_missing, boolean_validator],
+        'cursor': [ignore_missing, unicode],
+        'include_total': [ignore_missing, boolean_validator],
+        'total_estimation_threshold': [ignore_missing, int_validator],
         '__junk': [empty],
         '__before': [rename('id', 'resource_id')]
     }
@@ -270,21 +270,8 @@ class DatastorePlugin(p.SingletonPlugin):
     def before_show(self, resource_dict):
         # Modify the resource url of datastore resources so that
         # they link to the datastore dumps.
-        connection = None
-
-        resource_dict['datastore_active'] = False
-
-        try:
-            connection = self.read_engine.connect()
-            result = connection.execute(
-                'SELECT 1 FROM "_table_metadata" WHERE name = %s AND alias_of IS NULL',
-                resource_dict['id']
-            ).fetchone()
-            if result:
-                resource_dict['datastore_active'] = True
-        finally:
-            if connection:
-                connection.close()
+        resource_dict['datastore_active'] = db.resource_is_active(
+            self.read_engine, resource_dict['id'])
         return resource_dict
 
     def datastore_validate(self, context, data_dict, fields_types):
@@ -343,6 +330,22 @@ class DatastorePlugin(p.SingletonPlugin):
             if is_positive_int:
                 del data_dict['offset']
 
+        cursor = data_dict.get('cursor')
+        if cursor:
+            if cursor == '*' or datastore_helpers.decode_cursor(cursor):
+                del data_dict['cursor']
+
+        include_total = data_dict.get('include_total')
+        if isinstance(include_total, bool):
+            del data_dict['include_total']
+
+        threshold = data_dict.get('total_estimation_threshold')
+        if threshold is not None:
+            is_positive_int = datastore_helpers.validate_int(threshold,
+                                                             non_negative=True)
+            if is_positive_int:
+                del data_dict['total_estimation_threshold']
+
         return data_dict
 
     def _parse_sort_clause(self, clause, fields_types):
@@ -380,8 +383,26 @@ class DatastorePlugin(p.SingletonPlugin):
         sort = self._sort(data_dict, fields_types)
         where = self._where(data_dict, fields_types)
 
-        select_cols = [u'"{0}"'.format(field_id) for field_id in field_ids] +\
-                      [u'count(*) over() as "_full_count" %s' % rank_column]
+        select_cols = [u'"{0}"'.format(field_id) for field_id in field_ids]
+        if rank_column:
+            select_cols.append(rank_column.lstrip(', '))
+
+        if 'cursor' in data_dict:
+            if data_dict.get('distinct'):
+                raise ValidationError({
+                    'cursor': [u'cursor can not be used with distinct']
+                })
+            keys = self._cursor_keys(data_dict, fields_types)
+            sort = [u'{0} {1}'.format(datastore_helpers.identifier(field),
+                                      direction)
+                    for field, direction in keys]
+            select_cols += [u'{0} AS "_cursor_{1}"'.format(
+                datastore_helpers.identifier(field), i)
+                for i, (field, direction) in enumerate(keys)]
+            if data_dict['cursor'] != '*':
+                where.append(self._cursor_clause(keys, data_dict['cursor']))
+            query_dict['cursor_keys'] = keys
+            offset = 0
 
         query_dict['distinct'] = data_dict.get('distinct', False)
         query_dict['select'] += select_cols
@@ -393,6 +414,61 @@ class DatastorePlugin(p.SingletonPlugin):
 
         return query_dict
 
+    def _cursor_keys(self, data_dict, fields_types):
+        '''Returns the (field, direction) pairs a cursor pages through.
+
+        These are the fields in ``sort`` followed by ``_id``, which makes the
+        order total so that no record is skipped or repeated between pages.
+        '''
+        keys = []
+        for clause in datastore_helpers.get_list(data_dict.get('sort'),
+                                                 False) or []:
+            keys.append(self._parse_sort_clause(clause, fields_types))
+        if '_id' not in [field for field, direction in keys]:
+            keys.append(('_id', 'asc'))
+        return keys
+
+    def _cursor_clause(self, keys, cursor):
+        '''Returns the where clause selecting the records after a cursor.
+
+        For keys (a asc, b desc) and last values (x, y) this is
+        ``a > x OR (a = x AND b < y)``, taking into account that nulls sort
+        after any value in ascending order and before it in descending order.
+        '''
+        sort, values = datastore_helpers.decode_cursor(cursor)
+        if sort != keys:
+            raise ValidationError({
+                'cursor': [u'cursor does not match the sort order']
+            })
+
+        alternatives = []
+        params = []
+        for i, ((field, direction), value) in enumerate(zip(keys, values)):
+            conditions = []
+            for (previous, _), previous_value in zip(keys[:i], values[:i]):
+                if previous_value is None:
+                    conditions.append(u'{0} IS NULL'.format(
+                        datastore_helpers.identifier(previous)))
+                else:
+                    conditions.append(u'{0} = %s'.format(
+                        datastore_helpers.identifier(previous)))
+                    params.append(previous_value)
+
+            column = datastore_helpers.identifier(field)
+            if direction == 'asc':
+                if value is None:
+                    continue
+                conditions.append(u'({0} > %s OR {0} IS NULL)'.format(column))
+                params.append(value)
+            elif value is None:
+                conditions.append(u'{0} IS NOT NULL'.format(column))
+            else:
+                conditions.append(u'{0} < %s'.format(column))
+                params.append(value)
+            alternatives.append(u'({0})'.format(u' AND '.join(conditions)))
+
+        return (u' OR '.join(alternatives) or u'FALSE',) + tuple(params)
+
     def _where(self, data_dict, fields_types):
         filters = data_dict.get('filters', {})
         clauses = []
@@ -169,6 +169,94 @@ def test_upsert_with_insert_method_and_invalid_data(
         db.InvalidDataError, db.upsert_data, context, data_dict)
 
 
+class TestMetadataCache(object):
+    def setup(self):
+        db._metadata_cache.clear()
+
+    def _connection(self, stamp):
+        connection = mock.MagicMock()
+        connection.execute.return_value.fetchone.return_value = stamp
+        connection.execute.return_value.cursor.description = [('author', 25)]
+        return connection
+
+    @mock.patch('ckanext.datastore.db._get_type', return_value='text')
+    def test_fields_are_cached_while_the_stamp_is_unchanged(self, _get_type):
+        data_dict = {'resource_id': 'resource_id'}
+        connection = self._connection(('r', 1, '100', ''))
+
+        fields = db._get_fields({'connection': connection}, data_dict)
+        connection.execute.reset_mock()
+        cached_fields = db._get_fields({'connection': connection}, data_dict)
+
+        assert_equal(cached_fields, [{'id': 'author', 'type': 'text'}])
+        assert_equal(cached_fields, fields)
+        # only the stamp was checked
+        assert_equal(connection.execute.call_count, 1)
+
+    @mock.patch('ckanext.datastore.db._get_type', return_value='text')
+    def test_stamp_is_checked_once_per_context(self, _get_type):
+        data_dict = {'resource_id': 'resource_id'}
+        context = {'connection': self._connection(('r', 1, '100', ''))}
+
+        db._get_fields(context, data_dict)
+        db._get_fields(context, data_dict)
+
+        assert_equal(context['connection'].execute.call_count, 2)
+
+    @mock.patch('ckanext.datastore.db._get_type', return_value='text')
+    def test_fields_are_reloaded_when_the_stamp_changes(self, _get_type):
+        data_dict = {'resource_id': 'resource_id'}
+        db._get_fields({'connection': self._connection(('r', 1, '100', ''))},
+                       data_dict)
+
+        connection = self._connection(('r', 1, '101', ''))
+        db._get_fields({'connection': connection}, data_dict)
+
+        # the stamp and the fields
+        assert_equal(connection.execute.call_count, 2)
+
+    @mock.patch('ckanext.datastore.db._get_type', return_value='text')
+    def test_invalidate_reloads_fields(self, _get_type):
+        data_dict = {'resource_id': 'resource_id'}
+        context = {'connection': self._connection(('r', 1, '100', ''))}
+        db._get_fields(context, data_dict)
+
+        db._invalidate_metadata(context, 'resource_id')
+        db._get_fields(context, data_dict)
+
+        assert_equal(context['connection'].execute.call_count, 4)
+
+    @helpers.change_config('ckan.datastore.metadata_cache_ttl', '60')
+    @mock.patch('ckanext.datastore.db._get_type', return_value='text')
+    def test_stamp_is_not_checked_within_ttl(self, _get_type):
+        data_dict = {'resource_id': 'resource_id'}
+        db._get_fields({'connection': self._connection(('r', 1, '100', ''))},
+                       data_dict)
+
+        connection = self._connection(('r', 1, '100', ''))
+        db._get_fields({'connection': connection}, data_dict)
+
+        assert_equal(connection.execute.call_count, 0)
+
+    def test_resource_is_active(self):
+        engine = mock.MagicMock()
+        engine.connect.return_value = self._connection(('r', 1, '100', ''))
+
+        assert db.resource_is_active(engine, 'resource_id')
+
+    def test_resource_is_not_active_without_table(self):
+        engine = mock.MagicMock()
+        engine.connect.return_value = self._connection(None)
+
+        assert not db.resource_is_active(engine, 'resource_id')
+
+    def test_alias_is_not_an_active_resource(self):
+        engine = mock.MagicMock()
+        engine.connect.return_value = self._connection(('v', 1, '100', ''))
+
+        assert not db.resource_is_active(engine, 'alias')
+
+
 class TestJsonGetValues(object):
     def test_returns_empty_list_if_called_with_none(self):
         assert_equal(db.json_get_values(None), [])
@@ -0,0 +1,108 @@
+import json
+
+import mock
+import nose
+import pylons
+
+import ckan.plugins as p
+import ckan.tests.legacy as tests
+import ckan.tests.helpers as helpers
+import ckan.tests.factories as factories
+import ckanext.datastore.db as db
+
+assert_equals = nose.tools.assert_equals
+
+
+class TestDatastoreDump(object):
+    @classmethod
+    def setup_class(cls):
+        if not tests.is_datastore_supported():
+            raise nose.SkipTest("Datastore not supported")
+        p.load('datastore')
+        cls.app = helpers._get_test_app()
+
+    @classmethod
+    def teardown_class(cls):
+        p.unload('datastore')
+        helpers.reset_db()
+
+    def _create_resource(self, records):
+        resource = factories.Resource()
+        helpers.call_action('datastore_create',
+                            resource_id=resource['id'],
+                            force=True,
+                            records=records)
+        return resource
+
+    def test_dump_csv(self):
+        resource = self._create_resource([
+            {'book': 'annakarenina', 'author': 'tolstoy'},
+            {'book': 'warandpeace', 'author': 'tolstoy'},
+        ])
+
+        response = self.app.get('/datastore/dump/{0}'.format(resource['id']))
+
+        assert_equals(response.content_type, 'text/csv')
+        assert_equals(response.body.splitlines(), [
+            '_id,book,author',
+            '1,annakarenina,tolstoy',
+            '2,warandpeace,tolstoy',
+        ])
+
+    def test_dump_is_not_truncated_by_chunk_size(self):
+        resource = self._create_resource(
+            [{'n': i} for i in range(25)])
+
+        original_chunk_size = db._DUMP_CHUNK_SIZE
+        db._DUMP_CHUNK_SIZE = 10
+        try:
+            response = self.app.get(
+                '/datastore/dump/{0}'.format(resource['id']))
+        finally:
+            db._DUMP_CHUNK_SIZE = original_chunk_size
+
+        lines = response.body.splitlines()
+        assert_equals(len(lines), 26)
+        assert_equals(lines[-1], '25,24')
+
+    def test_dump_limit_and_offset(self):
+        resource = self._create_resource(
+            [{'n': i} for i in range(5)])
+
+        response = self.app.get('/datastore/dump/{0}'.format(resource['id']),
+                                params={'limit': 2, 'offset': 1})
+
+        assert_equals(response.body.splitlines(), ['_id,n', '2,1', '3,2'])
+
+    def test_dump_jsonl(self):
+        resource = self._create_resource([
+            {'book': 'annakarenina', 'tags': ['russian', 'novel']},
+        ])
+
+        response = self.app.get('/datastore/dump/{0}'.format(resource['id']),
+                                params={'format': 'jsonl'})
+
+        assert_equals(response.content_type, 'application/x-ndjson')
+        records = [json.loads(line) for line in response.body.splitlines()]
+        assert_equals(records, [{'_id': 1,
+                                 'book': 'annakarenina',
+                                 'tags': ['russian', 'novel']}])
+
+    def test_dump_unknown_format(self):
+        resource = self._create_resource([{'book': 'annakarenina'}])
+
+        self.app.get('/datastore/dump/{0}'.format(resource['id']),
+                     params={'format': 'xls'}, status=400)
+
+    def test_dump_not_found(self):
+        self.app.get('/datastore/dump/not-a-resource', status=404)
+
+    def test_dump_reads_with_the_read_url(self):
+        resource = self._create_resource([{'book': 'annakarenina'}])
+
+        with mock.patch('ckanext.datastore.db.dump',
+                        return_value=iter([])) as dump:
+            self.app.get('/datastore/dump/{0}'.format(resource['id']))
+
+        assert_equals(dump.call_args[0][1]['connection_url'],
+                      pylons.config['ckan.datastore.read_url'])
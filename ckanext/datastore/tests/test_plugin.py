@@ -3,6 +3,7 @@ import mock
 
 import ckan.tests.helpers as helpers
 import ckan.plugins as p
+import ckanext.datastore.helpers as datastore_helpers
 import ckanext.datastore.interfaces as interfaces
 import ckanext.datastore.plugin as plugin
 
@@ -191,6 +192,67 @@ class TestPluginDatastoreSearch(object):
 
         assert_equal(result['where'], expected_where)
 
+    def test_cursor_sorts_by_id_when_no_sort_is_given(self):
+        data_dict = {
+            'cursor': '*',
+        }
+        fields_types = {
+            'country': 'text',
+        }
+
+        result = self._datastore_search(data_dict=data_dict,
+                                        fields_types=fields_types)
+
+        assert_equal(result['sort'], [u'"_id" asc'])
+        assert_equal(result['where'], [])
+        assert_equal(result['cursor_keys'], [('_id', 'asc')])
+
+    def test_cursor_selects_records_after_the_last_sort_values(self):
+        data_dict = {
+            'cursor': datastore_helpers.encode_cursor(
+                [('country', 'desc'), ('_id', 'asc')], ['Brazil', 10]),
+            'sort': 'country desc',
+        }
+        fields_types = {
+            'country': 'text',
+        }
+
+        result = self._datastore_search(data_dict=data_dict,
+                                        fields_types=fields_types)
+
+        assert_equal(result['sort'], [u'"country" desc', u'"_id" asc'])
+        assert_equal(result['where'], [
+            (u'("country" < %s) OR ("country" = %s AND '
+             u'("_id" > %s OR "_id" IS NULL))', 'Brazil', 'Brazil', 10)])
+
+    def test_cursor_after_null_value(self):
+        data_dict = {
+            'cursor': datastore_helpers.encode_cursor(
+                [('country', 'asc'), ('_id', 'asc')], [None, 10]),
+            'sort': 'country',
+        }
+        fields_types = {
+            'country': 'text',
+        }
+
+        result = self._datastore_search(data_dict=data_dict,
+                                        fields_types=fields_types)
+
+        assert_equal(result['where'], [
+            (u'("country" IS NULL AND ("_id" > %s OR "_id" IS NULL))', 10)])
+
+    def test_cursor_must_match_sort(self):
+        data_dict = {
+            'cursor': datastore_helpers.encode_cursor([('_id', 'asc')], [10]),
+            'sort': 'country',
+        }
+        fields_types = {
+            'country': 'text',
+        }
+
+        assert_raises(p.toolkit.ValidationError, self._datastore_search,
+                      data_dict=data_dict, fields_types=fields_types)
+
     def _datastore_search(self, context={}, data_dict={}, fields_types={}, query_dict={}):
         _query_dict = {
             'select': [],
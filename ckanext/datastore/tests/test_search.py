@@ -102,6 +102,88 @@ class TestDatastoreSearchNewTest(object):
         result_years = [r['the year'] for r in result['records']]
         assert_equals(result_years, [2013])
 
+    def _create_numbers(self, count):
+        resource = factories.Resource()
+        helpers.call_action('datastore_create',
+                            resource_id=resource['id'],
+                            force=True,
+                            records=[{'n': i % 3, 'name': str(i)}
+                                     for i in range(count)])
+        return resource
+
+    def test_cursor_pages_through_all_records(self):
+        resource = self._create_numbers(7)
+
+        names = []
+        cursor = '*'
+        while cursor:
+            result = helpers.call_action('datastore_search',
+                                         resource_id=resource['id'],
+                                         sort='n desc',
+                                         limit=3,
+                                         cursor=cursor)
+            names += [r['name'] for r in result['records']]
+            assert '_cursor_0' not in result['records'][0]
+            cursor = result['next_cursor']
+
+        assert_equals(names, ['2', '5', '1', '4', '0', '3', '6'])
+
+    def test_cursor_last_page_has_no_next_cursor(self):
+        resource = self._create_numbers(2)
+
+        result = helpers.call_action('datastore_search',
+                                     resource_id=resource['id'],
+                                     limit=5,
+                                     cursor='*')
+
+        assert_equals(len(result['records']), 2)
+        assert_equals(result['total'], 2)
+        assert_equals(result['next_cursor'], None)
+
+    def test_cursor_invalid(self):
+        resource = self._create_numbers(2)
+
+        assert_raises(p.toolkit.ValidationError, helpers.call_action,
+                      'datastore_search', resource_id=resource['id'],
+                      cursor='not a cursor')
+
+    def test_search_without_total(self):
+        resource = self._create_numbers(2)
+
+        result = helpers.call_action('datastore_search',
+                                     resource_id=resource['id'],
+                                     include_total=False)
+
+        assert_equals(len(result['records']), 2)
+        assert 'total' not in result
+
+    def test_search_estimates_total_above_threshold(self):
+        resource = self._create_numbers(5)
+        connection = db._get_engine(
+            {'connection_url': pylons.config['ckan.datastore.write_url']}
+        ).connect()
+        connection.execute(u'ANALYZE "{0}"'.format(resource['id']))
+        connection.close()
+
+        result = helpers.call_action('datastore_search',
+                                     resource_id=resource['id'],
+                                     limit=1,
+                                     total_estimation_threshold=2)
+
+        assert_equals(result['total'], 5)
+        assert result['total_was_estimated']
+
+    def test_search_counts_total_below_threshold(self):
+        resource = self._create_numbers(5)
+
+        result = helpers.call_action('datastore_search',
+                                     resource_id=resource['id'],
+                                     limit=1,
+                                     total_estimation_threshold=1000)
+
+        assert_equals(result['total'], 5)
+        assert 'total_was_estimated' not in result
+
 
 
 class TestDatastoreSearch(tests.WsgiAppCase):
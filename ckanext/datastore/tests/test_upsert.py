@@ -9,11 +9,14 @@ import ckan.plugins as p
 import ckan.lib.create_test_data as ctd
 import ckan.model as model
 import ckan.tests.legacy as tests
+import ckan.tests.helpers as helpers
+import ckan.tests.factories as factories
 
 import ckanext.datastore.db as db
 from ckanext.datastore.tests.helpers import rebuild_all_dbs, set_url_type
 
 assert_equal = nose.tools.assert_equal
+assert_raises = nose.tools.assert_raises
 
 
 class TestDatastoreUpsert(tests.WsgiAppCase):
@@ -553,3 +556,104 @@ class TestDatastoreUpdate(tests.WsgiAppCase):
         res_dict = json.loads(res.body)
 
         assert res_dict['success'] is False
+
+
+class TestDatastoreBulkLoad(object):
+    @classmethod
+    def setup_class(cls):
+        if not tests.is_datastore_supported():
+            raise nose.SkipTest("Datastore not supported")
+        p.load('datastore')
+
+    @classmethod
+    def teardown_class(cls):
+        p.unload('datastore')
+        helpers.reset_db()
+
+    def _create(self, records, **kwargs):
+        resource = factories.Resource()
+        helpers.call_action('datastore_create',
+                            resource_id=resource['id'],
+                            force=True,
+                            fields=[{'id': 'book', 'type': 'text'},
+                                    {'id': 'author', 'type': 'text'},
+                                    {'id': 'nested', 'type': 'json'},
+                                    {'id': 'characters', 'type': 'text[]'},
+                                    {'id': 'pages', 'type': 'int4'}],
+                            primary_key='book',
+                            records=records,
+                            **kwargs)
+        return resource
+
+    def _records(self, resource):
+        result = helpers.call_action('datastore_search',
+                                     resource_id=resource['id'],
+                                     sort='_id')
+        for record in result['records']:
+            record.pop('_id')
+        return result['records']
+
+    @helpers.change_config('ckan.datastore.bulk_load_threshold', '1')
+    def test_bulk_insert(self):
+        resource = self._create([
+            {'book': u'annakar\xe9nina', 'author': 'tolstoy',
+             'nested': {'b': [1, 2]}, 'characters': ['Anna', 'Ka"t\\ya'],
+             'pages': 864},
+            {'book': 'warandpeace', 'author': 'tab\tand\nnewline'},
+        ])
+
+        assert_equal(self._records(resource), [
+            {'book': u'annakar\xe9nina', 'author': 'tolstoy',
+             'nested': {'b': [1, 2]}, 'characters': ['Anna', 'Ka"t\\ya'],
+             'pages': 864},
+            {'book': 'warandpeace', 'author': 'tab\tand\nnewline',
+             'nested': None, 'characters': None, 'pages': None},
+        ])
+
+    @helpers.change_config('ckan.datastore.bulk_load_threshold', '1')
+    def test_bulk_insert_builds_full_text(self):
+        resource = self._create([{'book': 'annakarenina',
+                                  'author': 'tolstoy'}])
+
+        result = helpers.call_action('datastore_search',
+                                     resource_id=resource['id'],
+                                     q='tolstoy')
+
+        assert_equal(result['total'], 1)
+
+    @helpers.change_config('ckan.datastore.bulk_load_threshold', '1')
+    def test_bulk_insert_invalid_data(self):
+        assert_raises(p.toolkit.ValidationError, self._create,
+                      [{'book': 'annakarenina', 'pages': 'many'}])
+
+    @helpers.change_config('ckan.datastore.bulk_load_threshold', '1')
+    def test_bulk_upsert_last_record_of_key_wins(self):
+        resource = self._create([{'book': 'annakarenina', 'pages': 1}])
+
+        helpers.call_action('datastore_upsert',
+                            resource_id=resource['id'],
+                            force=True,
+                            method='upsert',
+                            records=[{'book': 'annakarenina', 'pages': 2},
+                                     {'book': 'warandpeace', 'pages': 3},
+                                     {'book': 'annakarenina', 'pages': 4},
+                                     {'book': 'warandpeace',
+                                      'author': 'tolstoy'}])
+
+        records = self._records(resource)
+        assert_equal([(r['book'], r['author'], r['pages']) for r in records],
+                     [('annakarenina', None, 4),
+                      ('warandpeace', 'tolstoy', 3)])
+
+    @helpers.change_config('ckan.datastore.bulk_load_threshold', '1')
+    def test_bulk_update_non_existing_key(self):
+        resource = self._create([{'book': 'annakarenina', 'pages': 1}])
+
+        assert_raises(p.toolkit.ValidationError, helpers.call_action,
+                      'datastore_upsert',
+                      resource_id=resource['id'],
+                      force=True,
+                      method='update',
+                      records=[{'book': 'annakarenina', 'pages': 2},
+                               {'book': 'warandpeace', 'pages': 3}])
+        assert_equal(self._records(resource)[0]['pages'], 1)
@@ -1,26 +1,17 @@
 import ckan
+import ckan.lib.term_translations as term_translations
 from ckan.plugins import SingletonPlugin, implements, IPackageController
 from ckan.plugins import IGroupController, IOrganizationController, ITagController, IResourceController
 import pylons
-from ckan.logic import get_action
 from pylons import config
 
 LANGS = ['en', 'fr', 'de', 'es', 'it', 'nl', 'ro', 'pt', 'pl']
 
-def translate_data_dict(data_dict):
-    '''Return the given dict (e.g. a dataset dict) with as many of its fields
-    as possible translated into the desired or the fallback language.
+def _terms_to_translate(flattened):
+    '''Return the set of terms translate_data_dict looks up for the given
+    flattened dict.
 
     '''
-    desired_lang_code = pylons.request.environ['CKAN_LANG']
-    fallback_lang_code = pylons.config.get('ckan.locale_default', 'en')
-
-    # Get a flattened copy of data_dict to do the translation on.
-    flattened = ckan.lib.navl.dictization_functions.flatten_dict(
-            data_dict)
-
-    # Get a simple flat list of all the terms to be translated, from the
-    # flattened data dict.
     terms = set()
     for (key, value) in flattened.items():
         if value in (None, True, False):
@@ -38,12 +29,48 @@ def translate_data_dict(data_dict):
                         terms.add(item)
                 else:
                     terms.add(item)
+    return terms
+
+def prefetch_data_dict_translations(data_dicts):
+    '''Fetch the translations translate_data_dict will need for all the
+    given dicts (e.g. a page of search results) with a single query.
+
+    '''
+    desired_lang_code = pylons.request.environ['CKAN_LANG']
+    fallback_lang_code = pylons.config.get('ckan.locale_default', 'en')
+
+    terms = set()
+    data_dicts = list(data_dicts)
+    while data_dicts:
+        flattened = ckan.lib.navl.dictization_functions.flatten_dict(
+                data_dicts.pop())
+        terms.update(_terms_to_translate(flattened))
+        # the organization gets translated as a dict of its own
+        if isinstance(flattened.get((u'organization',)), dict):
+            data_dicts.append(flattened[(u'organization',)])
+
+    term_translations.cache.prefetch(
+            terms, (desired_lang_code, fallback_lang_code))
+
+def translate_data_dict(data_dict):
+    '''Return the given dict (e.g. a dataset dict) with as many of its fields
+    as possible translated into the desired or the fallback language.
+
+    '''
+    desired_lang_code = pylons.request.environ['CKAN_LANG']
+    fallback_lang_code = pylons.config.get('ckan.locale_default', 'en')
+
+    # Get a flattened copy of data_dict to do the translation on.
+    flattened = ckan.lib.navl.dictization_functions.flatten_dict(
+            data_dict)
+
+    # Get a simple flat list of all the terms to be translated, from the
+    # flattened data dict.
+    terms = _terms_to_translate(flattened)
 
     # Get the translations of all the terms (as a list of dictionaries).
-    translations = get_action('term_translation_show')(
-            {'model': ckan.model},
-            {'terms': terms,
-                'lang_codes': (desired_lang_code, fallback_lang_code)})
+    translations = term_translations.cache.get_translations(
+            terms, (desired_lang_code, fallback_lang_code))
 
     # Transform the translations into a more convenient structure.
     desired_translations = {}
@@ -116,7 +143,7 @@ def translate_resource_data_dict(data_dict):
 
     # Get a simple flat list of all the terms to be translated, from the
     # flattened data dict.
-    terms = sets.Set()
+    terms = set()
     for (key, value) in flattened.items():
         if value in (None, True, False):
             continue
@@ -129,10 +156,8 @@ def translate_resource_data_dict(data_dict):
                  terms.add(item)
 
     # Get the translations of all the terms (as a list of dictionaries).
-    translations = ckan.logic.action.get.term_translation_show(
-            {'model': ckan.model},
-            {'terms': terms,
-                'lang_codes': (desired_lang_code, fallback_lang_code)})
+    translations = term_translations.cache.get_translations(
+            terms, (desired_lang_code, fallback_lang_code))
     # Transform the translations into a more convenient structure.
     desired_translations = {}
     fallback_translations = {}
@@ -194,6 +219,29 @@ KEYS_TO_IGNORE = ['state', 'revision_id', 'id', #title done seperately
 class MultilingualDataset(SingletonPlugin):
     implements(IPackageController, inherit=True)
 
+    def _index_terms(self, search_data):
+        '''Return the title and the other terms of a dataset to index.'''
+        title = search_data.get('title')
+        all_terms = []
+        for key, value in search_data.iteritems():
+            if key in KEYS_TO_IGNORE or key.startswith('title'):
+                continue
+            if not isinstance(value, list):
+                value = [value]
+            for item in value:
+                if isinstance(item, basestring):
+                    all_terms.append(item)
+        return title, all_terms
+
+    def before_index_batch(self, search_data_list):
+        # fetch the translations of the whole batch in one query
+        terms = set()
+        for search_data in search_data_list:
+            title, all_terms = self._index_terms(search_data)
+            terms.add(title)
+            terms.update(all_terms)
+        term_translations.cache.prefetch(terms, LANGS)
+
     def before_index(self, search_data):
 
         default_lang = search_data.get(
@@ -201,33 +249,24 @@ class MultilingualDataset(SingletonPlugin):
              pylons.config.get('ckan.locale_default', 'en')
         )
 
+        title, all_terms = self._index_terms(search_data)
+
+        # fetch the translations of the title and the rest in one query,
+        # unless before_index_batch already has
+        term_translations.cache.prefetch(all_terms + [title], LANGS)
+
         ## translate title
-        title = search_data.get('title')
         search_data['title_' + default_lang] = title 
-        title_translations = get_action('term_translation_show')(
-                          {'model': ckan.model},
-                          {'terms': [title],
-                              'lang_codes': LANGS})
+        title_translations = term_translations.cache.get_translations(
+            [title], LANGS)
 
         for translation in title_translations:
             title_field = 'title_' + translation['lang_code']
             search_data[title_field] = translation['term_translation']
 
         ## translate rest
-        all_terms = []
-        for key, value in search_data.iteritems():
-            if key in KEYS_TO_IGNORE or key.startswith('title'):
-                continue
-            if not isinstance(value, list):
-                value = [value]
-            for item in value:
-                if isinstance(item, basestring):
-                    all_terms.append(item)
-
-        field_translations = get_action('term_translation_show')(
-                          {'model': ckan.model},
-                          {'terms': all_terms,
-                              'lang_codes': LANGS})
+        field_translations = term_translations.cache.get_translations(
+            all_terms, LANGS)
 
         text_field_items = dict(('text_' + lang, []) for lang in LANGS)
         
@@ -277,6 +316,13 @@ class MultilingualDataset(SingletonPlugin):
 
     def after_search(self, search_results, search_params):
 
+        # before_view translates the results one at a time once this has
+        # run, so look up the translations of the whole page in one query
+        results = [result for result in search_results.get('results', [])
+                   if result]
+        if results:
+            prefetch_data_dict_translations(results)
+
         # Translate the unselected search facets.
         facets = search_results.get('search_facets')
         if not facets:
@@ -290,10 +336,8 @@ class MultilingualDataset(SingletonPlugin):
         for facet in facets.values():
             for item in facet['items']:
                 terms.add(item['display_name'])
-        translations = get_action('term_translation_show')(
-                {'model': ckan.model},
-                {'terms': terms,
-                    'lang_codes': (desired_lang_code, fallback_lang_code)})
+        translations = term_translations.cache.get_translations(
+                terms, (desired_lang_code, fallback_lang_code))
 
         # Replace facet display names with translated ones.
         for facet in facets.values():
@@ -325,10 +369,8 @@ class MultilingualDataset(SingletonPlugin):
         desired_lang_code = pylons.request.environ['CKAN_LANG']
         fallback_lang_code = pylons.config.get('ckan.locale_default', 'en')
         terms = [value for param, value in c.fields]
-        translations = get_action('term_translation_show')(
-                {'model': ckan.model},
-                {'terms': terms,
-                 'lang_codes': (desired_lang_code, fallback_lang_code)})
+        translations = term_translations.cache.get_translations(
+                terms, (desired_lang_code, fallback_lang_code))
         c.translated_fields = {}
         for param, value in c.fields:
             matching_translations = [translation for translation in
@@ -1,7 +1,10 @@
+import mock
+
 import ckan.plugins
 import ckanext.multilingual.plugin as mulilingual_plugin
 import ckan.lib.helpers
 import ckan.lib.create_test_data
+import ckan.lib.term_translations as term_translations
 import ckan.logic.action.update
 import ckan.model as model
 import ckan.tests.legacy
@@ -9,6 +12,7 @@ import ckan.tests.legacy.html_check
 import routes
 import paste.fixture
 import pylons.test
+import ckan.tests.helpers as helpers
 
 _create_test_data = ckan.lib.create_test_data
 
@@ -214,3 +218,51 @@ class TestDatasetSearchIndex():
             'title_fr': u'french david',
             'text_fr': u'french note french boon french_moo french moon'
         }, result
+
+    def test_translate_batch_with_one_query(self):
+        plugin = mulilingual_plugin.MultilingualDataset()
+        batch = [{'title': u'david', 'notes': u'an interesting note'},
+                 {'title': u'roger', 'tags': [u'moon', u'boon']}]
+        term_translations.cache.clear()
+
+        with model.meta.QueryCounter() as counter:
+            plugin.before_index_batch(batch)
+            results = [plugin.before_index(data) for data in batch]
+
+        assert counter.count == 1, counter.count
+        assert results[0]['title_fr'] == u'french david', results[0]
+        assert u'french moon' in results[1]['text_fr'], results[1]
+
+
+class TestDatasetSearchResultsTranslation(object):
+    'Test the translation of a page of search results.'
+
+    def setup(self):
+        helpers.reset_db()
+        term_translations.cache.clear()
+        helpers.call_action('term_translation_update_many', data=[
+            {'term': u'book', 'term_translation': u'Buch', 'lang_code': u'de'},
+            {'term': u'novel', 'term_translation': u'Roman',
+             'lang_code': u'de'},
+        ])
+
+    def test_page_of_results_is_translated_with_one_query(self):
+        plugin = mulilingual_plugin.MultilingualDataset()
+        results = [{'name': u'dataset-%s' % i, 'title': u'book',
+                    'notes': u'novel', 'tags': [{'name': u'tag-%s' % i}]}
+                   for i in range(5)]
+        search_results = {'count': 5, 'results': results,
+                          'search_facets': {}}
+        request = mock.Mock(environ={'CKAN_LANG': 'de'})
+        c = mock.Mock(fields=[])
+
+        with mock.patch.object(mulilingual_plugin.pylons, 'request', request):
+            with mock.patch.object(mulilingual_plugin.pylons, 'c', c):
+                with model.meta.QueryCounter() as counter:
+                    plugin.after_search(search_results, {})
+                    viewed = [plugin.before_view(result)
+                              for result in search_results['results']]
+
+        assert counter.count == 1, counter.count
+        assert [(d['title'], d['notes']) for d in viewed] == \
+            [(u'Buch', u'Roman')] * 5, viewed
@@ -26,6 +26,7 @@ entry_points = {
         'dataset = ckan.lib.cli:DatasetCmd',
         'search-index = ckan.lib.cli:SearchIndexCommand',
         'ratings = ckan.lib.cli:Ratings',
+        'group-hierarchy = ckan.lib.cli:GroupHierarchyCommand',
         'notify = ckan.lib.cli:Notification',
         'celeryd = ckan.lib.cli:Celery',
         'rdf-export = ckan.lib.cli:RDFExport',